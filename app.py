@@ -1,30 +1,66 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import (
+    Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session, stream_with_context,
+)
 import json
-import csv
-import io
+import logging
 import os
-import sqlite3
+import time
 from datetime import datetime, timedelta
 
-from models import init_db, get_db_connection, REQUIRED_CSV_COLUMNS
+from models import (
+    PRODUCT_FIELDS, init_db, init_app as init_db_app, get_db, get_db_connection, get_read_db, run_write,
+    READ_MODE, SNAPSHOT_REFRESH_SEC,
+)
+from import_jobs import (
+    ImportRejected, submit_import, submit_bulk_import, resume_pending_jobs, get_job as get_import_job
+)
+from generation_batches import (
+    BatchRejected, create_batch, submit_batch_async, resume_pending_batches, collect_batch,
+    select_references, read_reference_csv,
+)
+from generation_jobs import (
+    GenerationRejected, submit_generation, submit_rewrite, resume_pending_generation_jobs,
+    get_generation_job, wait_job_events,
+)
+from quota import (
+    PLAN_MODE, MONTHLY_LIMIT, month_key_jst, get_monthly_usage, remaining_quota,
+)
+from canonical import resolve_canonical, invalidate_canonical, canonical_cache_stats
+from page_cache import page_cache_stats
+from http_client import http_stats
+from product_search import search_products
+from autocomplete import (
+    build_autocomplete_index, refresh_autocomplete_index, discard_reference, complete_reference,
+    autocomplete_stats, AUTOCOMPLETE_LIMIT,
+)
 import llm_client as llmc
-from url_discovery import discover_reference_urls
+from url_discovery import cse_stats
+from generation_metrics import METRICS_DAYS, stage_summary, recent_articles
 
-# ----------------------------
-# Plan / quota settings
-# ----------------------------
-PLAN_MODE = os.getenv("HOROLOGEN_PLAN", "limited").strip().lower()  # "limited" / "unlimited"
-MONTHLY_LIMIT = int(os.getenv("HOROLOGEN_MONTHLY_LIMIT", "30"))
+# ライブラリのモジュールは logging.getLogger(__name__) で出す（ハンドラが未設定なら標準エラーへ）
+logging.basicConfig(level=logging.INFO, format="[%(name)s] %(levelname)s: %(message)s")
 
 # ----------------------------
 # Flask
 # ----------------------------
+# bulk_import の子プロセス（forkserver / spawn）は __main__ を __mp_main__ として読み直すので、
+# `python app.py` で起動したときにスキーマ作成やジョブの再開などを子プロセスで繰り返さない
+_IN_WORKER_PROCESS = __name__ == '__mp_main__'
+
 app = Flask(__name__)
-init_db()
+if not _IN_WORKER_PROCESS:
+    init_db()
+init_db_app(app)
 app.secret_key = 'horologen-secret-key-change-in-production'
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+# CSVはストリーミングで取り込むため、上限はディスク容量基準（既定 4GB）
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("HOROLOGEN_MAX_UPLOAD_MB", "4096")) * 1024 * 1024
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+if not _IN_WORKER_PROCESS:
+    resume_pending_jobs()
+    resume_pending_batches()
+    resume_pending_generation_jobs()
+    build_autocomplete_index()
 
 BRANDS = ['cartier', 'omega', 'grand_seiko', 'iwc', 'panerai']
 
@@ -51,88 +87,40 @@ def humanize_llm_error(e: Exception) -> str:
 # ----------------------------
 # Quota helpers (service-wide monthly limit)
 # ----------------------------
-def _month_key_jst() -> str:
-    dt = datetime.utcnow() + timedelta(hours=9)
-    return dt.strftime("%Y-%m")
-
-def get_monthly_usage(conn) -> int:
-    mk = _month_key_jst()
-    row = conn.execute(
-        "SELECT used_count FROM monthly_generation_usage WHERE month_key = ?",
-        (mk,)
-    ).fetchone()
-    return int(row["used_count"]) if row else 0
-
-def remaining_quota(conn) -> int:
-    if PLAN_MODE == "unlimited":
-        return 10**9  # display only
+def get_quota_view() -> tuple[str, int, int]:
+    conn = get_db()
+    mk = month_key_jst()
     used = get_monthly_usage(conn)
-    return max(0, MONTHLY_LIMIT - used)
+    rem = remaining_quota(conn)
+    return mk, used, rem
 
-def consume_quota_or_block(n: int = 1) -> tuple[bool, str]:
-    """
-    called right before LLM call.
-    limited: if exceeded => block. if OK => increment used_count (+n)
-    unlimited: always OK
-    """
-    if PLAN_MODE == "unlimited":
-        return True, ""
 
-    conn = get_db_connection()
-    try:
-        conn.execute("BEGIN IMMEDIATE")
-        mk = _month_key_jst()
-
-        row = conn.execute(
-            "SELECT used_count FROM monthly_generation_usage WHERE month_key = ?",
-            (mk,)
-        ).fetchone()
-        used = int(row["used_count"]) if row else 0
-
-        if used + n > MONTHLY_LIMIT:
-            conn.rollback()
-            return False, "今月の生成回数の上限に達しました。管理者にお問い合わせください。"
-
-        if row:
-            conn.execute(
-                "UPDATE monthly_generation_usage "
-                "SET used_count = used_count + ?, updated_at = CURRENT_TIMESTAMP "
-                "WHERE month_key = ?",
-                (n, mk)
-            )
-        else:
-            conn.execute(
-                "INSERT INTO monthly_generation_usage (month_key, used_count) VALUES (?, ?)",
-                (mk, n)
-            )
+def _note_primary_write() -> None:
+    """snapshot モードでは、書き込んだ本人の次の検索に結果が反映されるまで primary を読む"""
+    if READ_MODE == "snapshot":
+        session['read_primary_until'] = time.time() + SNAPSHOT_REFRESH_SEC
 
-        conn.commit()
-        return True, ""
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        app.logger.exception("quota check/update failed: %s", e)
-        return False, "システム側でエラーが発生しました。管理者にお問い合わせください。"
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
-def get_quota_view() -> tuple[str, int, int]:
-    conn = get_db_connection()
-    try:
-        mk = _month_key_jst()
-        used = get_monthly_usage(conn)
-        rem = remaining_quota(conn)
-        return mk, used, rem
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+def _search_db():
+    """GET の検索表示用の接続（HOROLOGEN_READ_MODE に従う）"""
+    if session.get('read_primary_until', 0) > time.time():
+        return get_db()
+    return get_read_db()
+
+
+def _generation_options_from_form() -> dict:
+    """生成フォーム（トーン・オプション・参考URL）の入力。ジョブにもこのまま保存する"""
+    raw_urls = [
+        request.form.get('reference_url_1', '').strip(),
+        request.form.get('reference_url_2', '').strip(),
+        request.form.get('reference_url_3', '').strip(),
+    ]
+    return {
+        "tone": request.form.get('tone', 'practical').strip(),
+        "include_brand_profile": request.form.get('include_brand_profile') == 'on',
+        "include_wearing_scenes": request.form.get('include_wearing_scenes') == 'on',
+        "reference_urls": [u for u in raw_urls if u],
+    }
 
 
 # ----------------------------
@@ -205,179 +193,19 @@ def admin_upload():
             flash('CSVファイルを選択してください', 'error')
             return redirect(url_for('admin_upload'))
 
-        conn = None
         try:
-            raw = file.read()
-            text = raw.decode('utf-8-sig')
-            stream = io.StringIO(text)
-            reader = csv.DictReader(stream)
-
-            csv_columns = reader.fieldnames
-            if csv_columns is None:
-                flash('CSVファイルが空です', 'error')
-                return redirect(url_for('admin_upload'))
-
-            csv_columns = [col.strip() for col in csv_columns]
-
-            missing_columns = set(REQUIRED_CSV_COLUMNS) - set(csv_columns)
-            if missing_columns:
-                flash(f'必須カラムが不足しています: {", ".join(sorted(missing_columns))}', 'error')
-                return redirect(url_for('admin_upload'))
-
-            extra_columns = set(csv_columns) - set(REQUIRED_CSV_COLUMNS)
-            if extra_columns:
-                flash(f'不正なカラムが含まれています: {", ".join(sorted(extra_columns))}。インポートを停止します。', 'error')
-                return redirect(url_for('admin_upload'))
-
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            total_rows = 0
-            inserted_count = 0
-            updated_count = 0
-            error_count = 0
-            error_details = []
-            changed_count = 0
-            override_conflict_count = 0
-            sample_diffs = []
-
-            fields = [
-                'price_jpy', 'case_size_mm', 'movement', 'case_material',
-                'bracelet_strap', 'dial_color', 'water_resistance_m', 'buckle',
-                'warranty_years', 'collection', 'movement_caliber',
-                'case_thickness_mm', 'lug_width_mm', 'remarks'
-            ]
-
-            for row_num, row in enumerate(reader, start=2):
-                total_rows += 1
-                row = {k.strip(): (v.strip() if v else '') for k, v in row.items()}
-
-                brand = row.get('brand', '').strip()
-                reference = row.get('reference', '').strip()
-
-                if not brand or not reference:
-                    error_count += 1
-                    error_details.append(f'行{row_num}: brandまたはreferenceが空です')
-                    continue
-
-                data = {f: row.get(f, '') for f in fields}
-                data['brand'] = brand
-                data['reference'] = reference
-
-                try:
-                    cursor.execute(
-                        "SELECT * FROM master_products WHERE brand = ? AND reference = ?",
-                        (brand, reference)
-                    )
-                    existing = cursor.fetchone()
-
-                    cursor.execute(
-                        "SELECT 1 FROM product_overrides WHERE brand = ? AND reference = ?",
-                        (brand, reference)
-                    )
-                    override_exists = cursor.fetchone() is not None
-
-                    row_changed = False
-                    row_has_override_conflict = False
-                    row_diffs = []
-
-                    if existing:
-                        for f in fields:
-                            old_value = existing[f] or ''
-                            new_value = data[f] or ''
-                            if old_value != new_value:
-                                row_changed = True
-                                diff_info = {'field': f, 'old': old_value, 'new': new_value}
-                                if override_exists:
-                                    row_has_override_conflict = True
-                                    diff_info['override_exists'] = True
-                                row_diffs.append(diff_info)
-
-                        if row_changed:
-                            changed_count += 1
-                            if row_has_override_conflict:
-                                override_conflict_count += 1
-                            if len(sample_diffs) < 10:
-                                sample_diffs.append({
-                                    'brand': brand,
-                                    'reference': reference,
-                                    'diffs': row_diffs
-                                })
-
-                    cursor.execute('''
-                        INSERT INTO master_products
-                        (brand, reference, price_jpy, case_size_mm, movement, case_material,
-                         bracelet_strap, dial_color, water_resistance_m, buckle, warranty_years,
-                         collection, movement_caliber, case_thickness_mm, lug_width_mm, remarks, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                        ON CONFLICT(brand, reference) DO UPDATE SET
-                            price_jpy = excluded.price_jpy,
-                            case_size_mm = excluded.case_size_mm,
-                            movement = excluded.movement,
-                            case_material = excluded.case_material,
-                            bracelet_strap = excluded.bracelet_strap,
-                            dial_color = excluded.dial_color,
-                            water_resistance_m = excluded.water_resistance_m,
-                            buckle = excluded.buckle,
-                            warranty_years = excluded.warranty_years,
-                            collection = excluded.collection,
-                            movement_caliber = excluded.movement_caliber,
-                            case_thickness_mm = excluded.case_thickness_mm,
-                            lug_width_mm = excluded.lug_width_mm,
-                            remarks = excluded.remarks,
-                            updated_at = CURRENT_TIMESTAMP
-                    ''', (
-                        brand, reference, data['price_jpy'], data['case_size_mm'],
-                        data['movement'], data['case_material'], data['bracelet_strap'],
-                        data['dial_color'], data['water_resistance_m'], data['buckle'],
-                        data['warranty_years'], data['collection'], data['movement_caliber'],
-                        data['case_thickness_mm'], data['lug_width_mm'], data['remarks']
-                    ))
-
-                    if existing:
-                        updated_count += 1
-                    else:
-                        inserted_count += 1
-
-                except sqlite3.Error as e:
-                    error_count += 1
-                    error_details.append(f'行{row_num}: データベースエラー - {str(e)}')
-
-            error_details_str = '\n'.join(error_details) if error_details else ''
-            sample_diffs_str = json.dumps(sample_diffs, ensure_ascii=False) if sample_diffs else None
-
-            cursor.execute('''
-                INSERT INTO master_uploads
-                (filename, total_rows, inserted_count, updated_count, error_count, error_details,
-                 changed_count, override_conflict_count, sample_diffs)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                file.filename, total_rows, inserted_count, updated_count, error_count, error_details_str,
-                changed_count, override_conflict_count, sample_diffs_str
-            ))
-
-            conn.commit()
-
-            flash(
-                f'インポート完了: 総行数={total_rows}, 新規={inserted_count}, 更新={updated_count}, '
-                f'エラー={error_count}, 変更={changed_count}, オーバーライド競合={override_conflict_count}',
-                'success'
-            )
-            if error_details:
-                flash(f'エラー詳細: {"; ".join(error_details[:5])}', 'warning')
-
+            job_id = submit_import(file, app.config['UPLOAD_FOLDER'])
+        except ImportRejected as e:
+            flash(str(e), 'error')
+            return redirect(url_for('admin_upload'))
         except Exception as e:
             flash(f'CSV取込中にエラーが発生しました: {e}', 'error')
-        finally:
-            try:
-                if conn:
-                    conn.close()
-            except Exception:
-                pass
+            return redirect(url_for('admin_upload'))
 
+        flash(f'インポートを受け付けました（ジョブ #{job_id}）。進捗はこの画面に表示されます', 'success')
         return redirect(url_for('admin_upload'))
 
-    conn = get_db_connection()
+    conn = get_db()
     latest_upload = conn.execute('''
         SELECT * FROM master_uploads
         ORDER BY uploaded_at DESC LIMIT 1
@@ -390,18 +218,345 @@ def admin_upload():
         except Exception:
             sample_diffs = None
 
-    conn.close()
-    return render_template('admin.html', latest_upload=latest_upload, sample_diffs=sample_diffs)
+    active_job = None
+    job_row = conn.execute('''
+        SELECT id, status FROM import_jobs
+        ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+    if job_row and job_row['status'] != 'done':
+        active_job = get_import_job(conn, job_row['id'])
+
+    return render_template('admin.html', latest_upload=latest_upload, sample_diffs=sample_diffs,
+                           active_job=active_job)
+
+
+@app.route('/admin/upload/bulk', methods=['POST'])
+def admin_upload_bulk():
+    files = [f for f in request.files.getlist('csv_files') if f and f.filename]
+    if not files:
+        flash('ファイルが選択されていません', 'error')
+        return redirect(url_for('admin_upload'))
+
+    if any(not f.filename.lower().endswith(('.csv', '.zip')) for f in files):
+        flash('CSVまたはZIPファイルを選択してください', 'error')
+        return redirect(url_for('admin_upload'))
+
+    try:
+        job_ids = submit_bulk_import(files, app.config['UPLOAD_FOLDER'])
+    except ImportRejected as e:
+        flash(str(e), 'error')
+        return redirect(url_for('admin_upload'))
+    except Exception as e:
+        flash(f'CSV取込中にエラーが発生しました: {e}', 'error')
+        return redirect(url_for('admin_upload'))
+
+    flash(f'一括インポートを受け付けました（{len(job_ids)}ファイル / ジョブ #{job_ids[0]}〜#{job_ids[-1]}）', 'success')
+    return redirect(url_for('admin_upload'))
+
+
+@app.route('/admin/upload/jobs/<int:job_id>')
+def admin_upload_job(job_id: int):
+    job = get_import_job(get_db(), job_id)
+    if not job:
+        return jsonify({'error': 'not_found'}), 404
+    return jsonify(job)
+
+
+@app.route('/admin/batches', methods=['POST'])
+def admin_batches():
+    """一括生成の登録（brand + 任意で collection、または reference 列のCSV）。準備・送信はバックグラウンド"""
+    brand = request.form.get('brand', '').strip()
+    collection = request.form.get('collection', '').strip()
+    file = request.files.get('csv_file')
+    try:
+        if file and file.filename:
+            targets = read_reference_csv(file.stream, default_brand=brand)
+            source = f'csv:{file.filename}'
+        elif brand:
+            targets = select_references(get_db(), brand, collection)
+            source = f'brand:{brand}' + (f' collection:{collection}' if collection else '')
+        else:
+            return jsonify({'error': 'brand または csv_file を指定してください'}), 400
+
+        options = {
+            'tone': request.form.get('tone', 'practical').strip() or 'practical',
+            'include_brand_profile': request.form.get('include_brand_profile') == 'on',
+            'include_wearing_scenes': request.form.get('include_wearing_scenes') == 'on',
+        }
+        batch_id = create_batch(targets, source, options)
+    except BatchRejected as e:
+        return jsonify({'error': str(e)}), 400
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSVファイルはUTF-8で保存してください'}), 400
+
+    submit_batch_async(batch_id)
+    return jsonify({'batch_id': batch_id, 'total': len(set(targets))}), 202
+
+
+@app.route('/admin/batches/<int:batch_id>')
+def admin_batch(batch_id: int):
+    """状態の確認。API 側が終わっていればこの呼び出しで結果を保存する"""
+    try:
+        status = collect_batch(batch_id)
+    except Exception as e:
+        app.logger.exception("batch collect failed: %s", e)
+        return jsonify({'error': humanize_llm_error(e)}), 502
+    if not status:
+        return jsonify({'error': 'not_found'}), 404
+    return jsonify(status)
+
+
+@app.route('/admin/cache_stats')
+def admin_cache_stats():
+    return jsonify({
+        'canonical': canonical_cache_stats(),
+        'autocomplete': autocomplete_stats(),
+        'pages': page_cache_stats(),
+        'http': http_stats(),
+        'cse': cse_stats(),
+    })
+
+
+@app.route('/admin/generation_metrics')
+def admin_generation_metrics():
+    """段階ごとの待ち時間（p50 / p95 / p99）と直近の生成の内訳。?format=json で JSON"""
+    days = request.args.get('days', type=int) or METRICS_DAYS
+    conn = get_db()
+    stages = stage_summary(conn, days=days)
+    recent = recent_articles(conn)
+    if request.args.get('format') == 'json':
+        return jsonify({'days': days, 'stages': stages, 'recent': recent})
+    return render_template('admin_metrics.html', days=days, stages=stages, recent=recent)
+
+
+# ----------------------------
+# Generation jobs
+#   - 画面（JS）からの生成・言い換えはジョブに登録して job_id を即返す（generation_jobs）
+#   - 結果は /staff/generate/jobs/<id> をポーリングするか、/events を SSE で購読する
+#   - JS が使えないときはフォーム送信。同じジョブに登録して /staff/search?job_id= へリダイレクトし、
+#     終わるまでその画面を JOB_POLL_SEC ごとに再読み込みする（リクエストスレッドでは待たない）
+# ----------------------------
+STREAM_KEEPALIVE_SEC = 15
+JOB_POLL_SEC = float(os.getenv("HOROLOGEN_JOB_POLL_SEC", "2"))
+
+
+def _sse(event: str, data, event_id: int = 0) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _job_view(job: dict) -> dict:
+    """画面表示用のエラーメッセージを足す（詳細はログとジョブの error 列）"""
+    if job.get("status") == "failed":
+        job = {**job, "message": humanize_llm_error(RuntimeError(job.get("error", "")))}
+    return job
+
+
+def _job_urls(job_id: int) -> dict:
+    return {
+        "job_id": job_id,
+        "status_url": url_for('staff_generation_job', job_id=job_id),
+        "events_url": url_for('staff_generation_job_events', job_id=job_id),
+    }
+
+
+@app.route('/staff/generate/jobs', methods=['POST'])
+def staff_generate_jobs():
+    """生成フォーム / 言い換えフォームと同じ入力でジョブを登録（202 + job_id）"""
+    brand = request.form.get('brand', '').strip()
+    reference = request.form.get('reference', '').strip()
+    if not brand or not reference:
+        return jsonify({'error': 'ブランドとリファレンスを入力してください'}), 400
+
+    try:
+        if request.form.get('action') == 'rewrite_once':
+            source_article_id = request.form.get('source_article_id', '').strip()
+            if not source_article_id.isdigit():
+                return jsonify({'error': '言い換え対象が不正です'}), 400
+            job_id = submit_rewrite(int(source_article_id))
+        else:
+            job_id = submit_generation(brand, reference, _generation_options_from_form())
+    except GenerationRejected as e:
+        return jsonify({'error': str(e)}), 403
+    except Exception as e:
+        app.logger.exception("generation job submit failed: %s", e)
+        return jsonify({'error': 'システム側でエラーが発生しました。管理者にお問い合わせください。'}), 500
+
+    # 保存はワーカーで行うので、セッション（snapshot モードの primary 読み）は登録時に更新しておく
+    _note_primary_write()
+    return jsonify(_job_urls(job_id)), 202
+
+
+@app.route('/staff/generate/jobs/<int:job_id>')
+def staff_generation_job(job_id: int):
+    job = get_generation_job(get_db(), job_id)
+    if not job:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(_job_view(job))
+
+
+@app.route('/staff/generate/jobs/<int:job_id>/events')
+def staff_generation_job_events(job_id: int):
+    """
+    ジョブの途中経過を SSE で送る（status / references / attempt / delta、最後に done か error）。
+    id は何件目のイベントか。EventSource の再接続（Last-Event-ID）では続きから送る
+    """
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        after = 0
+
+    def _final(job: dict) -> str:
+        if job["status"] == "done":
+            return _sse("done", job)
+        return _sse("error", _job_view(job))
+
+    def _generate():
+        cursor = after
+        while True:
+            got = wait_job_events(job_id, cursor, STREAM_KEEPALIVE_SEC)
+            if got is None:
+                # このプロセスにバッファが無い（別ワーカープロセス・再起動前のジョブ）: 状態だけ追う
+                conn = get_db_connection()
+                try:
+                    job = get_generation_job(conn, job_id)
+                finally:
+                    conn.close()
+                if not job:
+                    yield _sse("error", {"message": "ジョブが見つかりません"})
+                    return
+                if job["status"] in ("done", "failed"):
+                    yield _final(job)
+                    return
+                yield _sse("status", job)
+                time.sleep(JOB_POLL_SEC)
+                continue
+
+            cursor, events, finished = got
+            if not events and not finished:
+                yield ": keepalive\n\n"
+                continue
+            for kind, data in events:
+                cursor += 1
+                if kind == "error":
+                    data = {**data, "message": humanize_llm_error(RuntimeError(data.get("error", "")))}
+                yield _sse(kind, data, event_id=cursor)
+            if finished:
+                return
+
+    return Response(stream_with_context(_generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx のバッファリングを止める
+    })
+
+
+def _render_job_result(brand: str, reference: str, job: dict):
+    """フォーム送信（JS なし）: 完了したジョブの記事を生成結果として表示"""
+    conn = get_db()
+    article = conn.execute("SELECT * FROM generated_articles WHERE id = ?", (job["article_id"],)).fetchone()
+    payload = {}
+    try:
+        payload = json.loads(article['payload_json']) if article['payload_json'] else {}
+    except Exception:
+        payload = {}
+    reference_urls = payload.get("reference_urls") or []
+
+    spec = resolve_canonical(conn, brand, reference, with_sources=True)
+
+    history_rows = conn.execute("""
+        SELECT id, intro_text, specs_text, payload_json, created_at, rewrite_depth, rewrite_parent_id
+        FROM generated_articles
+        WHERE brand = ? AND reference = ?
+        ORDER BY created_at DESC, id DESC
+        LIMIT 5
+    """, (brand, reference)).fetchall()
+    history = _build_history_rows(history_rows)
+
+    mk, used, rem = get_quota_view()
+
+    return render_template(
+        'search.html',
+        brands=BRANDS,
+        brand=brand,
+        reference=reference,
+        master=spec.master,
+        override=spec.override,
+        canonical=spec.canonical,
+        overridden_fields=spec.overridden_fields,
+
+        generated_intro_text=article['intro_text'],
+        generated_specs_text=article['specs_text'],
+
+        generation_tone=(payload.get('style', {}) or {}).get('tone'),
+        generation_include_brand_profile=(payload.get('options', {}) or {}).get('include_brand_profile'),
+        generation_include_wearing_scenes=(payload.get('options', {}) or {}).get('include_wearing_scenes'),
+        generation_reference_urls=reference_urls,
+
+        selected_reference_url=payload.get("selected_reference_url", ""),
+        selected_reference_reason=payload.get("selected_reference_reason", ""),
+
+        combined_reference_chars=payload.get("combined_reference_chars", 0),
+        combined_reference_preview=payload.get("combined_reference_preview", ""),
+        reference_urls_debug=payload.get("reference_urls_debug", []),
+
+        llm_client_file=llmc.__file__,
+        raw_urls_debug=reference_urls,
+
+        similarity_percent=int(payload.get("similarity_percent", 0) or 0),
+        similarity_level=payload.get("similarity_level", "blue") or "blue",
+
+        saved_article_id=article['id'],
+        rewrite_depth=int(article['rewrite_depth'] or 0),
+
+        plan_mode=PLAN_MODE,
+        monthly_limit=MONTHLY_LIMIT,
+        monthly_used=used,
+        monthly_remaining=rem,
+        month_key=mk,
+
+        history=history,
+    )
+
+
+@app.route('/staff/search/api')
+def staff_search_api():
+    """リファレンス / コレクション / キャリバーの検索（JSON）。?q=&brand=&page=&per_page="""
+    try:
+        page = int(request.args.get('page', '1'))
+        per_page = int(request.args.get('per_page', '20'))
+    except ValueError:
+        return jsonify({'error': 'page / per_page は整数で指定してください'}), 400
+    return jsonify(search_products(
+        _search_db(),
+        request.args.get('q', ''),
+        brand=request.args.get('brand', ''),
+        page=page,
+        per_page=per_page,
+    ))
+
+
+@app.route('/staff/autocomplete')
+def staff_autocomplete():
+    """入力中のリファレンス候補（JSON）。?q=&brand=&limit=。SQLite は読まない"""
+    t0 = time.perf_counter()
+    try:
+        limit = max(1, min(int(request.args.get('limit', AUTOCOMPLETE_LIMIT)), 50))
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    suggestions = complete_reference(
+        request.args.get('q', ''),
+        brand=request.args.get('brand', '').strip() or None,
+        limit=limit,
+    )
+    return jsonify({
+        'suggestions': suggestions,
+        'elapsed_ms': round((time.perf_counter() - t0) * 1000, 3),
+    })
 
 
 @app.route('/staff/search', methods=['GET', 'POST'])
 def staff_search():
-    fields = [
-        'price_jpy', 'case_size_mm', 'movement', 'case_material',
-        'bracelet_strap', 'dial_color', 'water_resistance_m', 'buckle',
-        'warranty_years', 'collection', 'movement_caliber',
-        'case_thickness_mm', 'lug_width_mm', 'remarks',
-    ]
+    fields = PRODUCT_FIELDS
 
     # NOTE: do NOT put plan_mode/monthly_* here (avoid duplicate keyword bugs)
     debug_defaults = {
@@ -448,9 +603,8 @@ def staff_search():
                 data[f] = request.form.get(f, '').strip()
             data['editor_note'] = request.form.get('editor_note', '').strip()
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
+            conn = get_db()
+            run_write(conn, lambda c: c.execute('''
                 INSERT INTO product_overrides
                 (brand, reference, price_jpy, case_size_mm, movement, case_material,
                  bracelet_strap, dial_color, water_resistance_m, buckle, warranty_years,
@@ -480,9 +634,10 @@ def staff_search():
                 data['warranty_years'], data['collection'], data['movement_caliber'],
                 data['case_thickness_mm'], data['lug_width_mm'], data['remarks'],
                 data['editor_note']
-            ))
-            conn.commit()
-            conn.close()
+            )))
+            invalidate_canonical(brand, reference)
+            refresh_autocomplete_index(conn)
+            _note_primary_write()
 
             flash('オーバーライドを保存しました', 'success')
             return redirect(url_for('staff_search', brand=brand, reference=reference))
@@ -494,13 +649,17 @@ def staff_search():
                 flash('ブランドとリファレンスを入力してください', 'error')
                 return redirect(url_for('staff_search'))
 
-            conn = get_db_connection()
-            conn.execute('''
+            conn = get_db()
+            run_write(conn, lambda c: c.execute('''
                 DELETE FROM product_overrides
                 WHERE brand = ? AND reference = ?
-            ''', (brand, reference))
-            conn.commit()
-            conn.close()
+            ''', (brand, reference)))
+            invalidate_canonical(brand, reference)
+            if not conn.execute(
+                "SELECT 1 FROM canonical_products WHERE brand = ? AND reference = ?", (brand, reference)
+            ).fetchone():
+                discard_reference(brand, reference)
+            _note_primary_write()
 
             flash('オーバーライドを解除しました（マスタに戻しました）', 'success')
             return redirect(url_for('staff_search', brand=brand, reference=reference))
@@ -515,194 +674,16 @@ def staff_search():
                 flash('ブランドとリファレンスを入力してください', 'error')
                 return redirect(url_for('staff_search'))
 
-            raw_urls = [
-                request.form.get('reference_url_1', '').strip(),
-                request.form.get('reference_url_2', '').strip(),
-                request.form.get('reference_url_3', '').strip(),
-            ]
-            raw_urls = [u for u in raw_urls if u]
-
-            if not raw_urls:
-                auto_urls, _auto_debug = discover_reference_urls(brand, reference, max_urls=3)
-                reference_urls = auto_urls[:3]
-            else:
-                reference_urls = raw_urls[:3]
-
-            conn = get_db_connection()
-            master = conn.execute('''
-                SELECT * FROM master_products
-                WHERE brand = ? AND reference = ?
-            ''', (brand, reference)).fetchone()
-
-            override = conn.execute('''
-                SELECT * FROM product_overrides
-                WHERE brand = ? AND reference = ?
-            ''', (brand, reference)).fetchone()
-
-            canonical = {}
-            for f in fields:
-                ov = override[f] if override and override[f] else ''
-                ms = master[f] if master and master[f] else ''
-                canonical[f] = ov if ov else ms
-
-            editor_note = (override['editor_note'] if override and 'editor_note' in override.keys() and override['editor_note'] else '')
-            conn.close()
-
-            tone_ui = request.form.get('tone', 'practical').strip()
-            tone_map = {
-                "practical": "practical",
-                "luxury": "luxury",
-                "magazine_story": "magazine_story",
-                "casual_friendly": "casual_friendly",
-            }
-            tone = tone_map.get(tone_ui, "practical")
-
-            include_brand_profile = request.form.get('include_brand_profile') == 'on'
-            include_wearing_scenes = request.form.get('include_wearing_scenes') == 'on'
-
-            payload = {
-                'product': {'brand': brand, 'reference': reference},
-                'facts': canonical,
-                'style': {'tone': tone, 'writing_variant_id': 1},
-                'options': {
-                    'include_brand_profile': include_brand_profile,
-                    'include_wearing_scenes': include_wearing_scenes
-                },
-                'constraints': {'target_intro_chars': 1500, 'max_specs_chars': 1000},
-                'editor_note': editor_note,
-                'reference_urls': reference_urls,
-                'reference_url': reference_urls[0] if reference_urls else "",
-            }
-
-            ok, msg = consume_quota_or_block(n=1)
-            if not ok:
-                flash(msg, 'error')
-                return redirect(url_for('staff_search', brand=brand, reference=reference))
-
+            # JS なしでもジョブ経由（二重送信・再送は同じジョブにまとまり、同時数もワーカー数まで）
+            options = _generation_options_from_form()
             try:
-                intro_text, specs_text, ref_meta = llmc.generate_article(payload, rewrite_mode="none")
-            except Exception as e:
-                app.logger.exception("LLM generate_dummy failed: %s", e)
-                flash(humanize_llm_error(e), 'error')
+                job_id = submit_generation(brand, reference, options)
+            except GenerationRejected as e:
+                flash(str(e), 'error')
                 return redirect(url_for('staff_search', brand=brand, reference=reference))
 
-            combined_reference_chars = int(ref_meta.get("combined_reference_chars", 0) or 0)
-            combined_reference_preview = ref_meta.get("combined_reference_preview", "") or ""
-            reference_urls_debug = ref_meta.get("reference_urls_debug", []) or []
-            selected_reference_url = ref_meta.get("selected_reference_url", "") or ""
-            selected_reference_reason = ref_meta.get("selected_reference_reason", "") or ""
-
-            similarity_percent = int(ref_meta.get("similarity_percent", 0) or 0)
-            similarity_level = (ref_meta.get("similarity_level") or "blue").strip() or "blue"
-            rewrite_applied = bool(ref_meta.get("rewrite_applied", False))
-
-            payload["selected_reference_url"] = selected_reference_url
-            payload["selected_reference_reason"] = selected_reference_reason
-            payload["combined_reference_chars"] = combined_reference_chars
-            payload["combined_reference_preview"] = combined_reference_preview
-            payload["reference_urls_debug"] = reference_urls_debug
-            payload["similarity_percent"] = similarity_percent
-            payload["similarity_level"] = similarity_level
-            payload["rewrite_applied"] = rewrite_applied
-
-            saved_article_id = None
-            try:
-                conn_save = get_db_connection()
-
-                payload["rewrite_depth"] = 0
-                payload["rewrite_parent_id"] = None
-                payload["rewrite_applied"] = False
-
-                cur = conn_save.execute("""
-                    INSERT INTO generated_articles
-                    (brand, reference, payload_json, intro_text, specs_text, rewrite_depth, rewrite_parent_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    brand,
-                    reference,
-                    json.dumps(payload, ensure_ascii=False),
-                    intro_text,
-                    specs_text,
-                    0,
-                    None
-                ))
-                conn_save.commit()
-                saved_article_id = cur.lastrowid
-                conn_save.close()
-            except Exception as e:
-                flash(f'生成履歴の保存に失敗しました: {e}', 'error')
-
-            conn = get_db_connection()
-            master = conn.execute('''
-                SELECT * FROM master_products
-                WHERE brand = ? AND reference = ?
-            ''', (brand, reference)).fetchone()
-
-            override = conn.execute('''
-                SELECT * FROM product_overrides
-                WHERE brand = ? AND reference = ?
-            ''', (brand, reference)).fetchone()
-
-            canonical = {}
-            overridden_fields = set()
-            for f in fields:
-                ov = override[f] if override and override[f] else ''
-                ms = master[f] if master and master[f] else ''
-                canonical[f] = ov if ov else ms
-                if ov:
-                    overridden_fields.add(f)
-
-            history_rows = conn.execute("""
-                SELECT id, intro_text, specs_text, payload_json, created_at, rewrite_depth, rewrite_parent_id
-                FROM generated_articles
-                WHERE brand = ? AND reference = ?
-                ORDER BY created_at DESC, id DESC
-                LIMIT 5
-            """, (brand, reference)).fetchall()
-            conn.close()
-            history = _build_history_rows(history_rows)
-
-            mk, used, rem = get_quota_view()
-
-            return render_template(
-                'search.html',
-                brands=BRANDS,
-                brand=brand,
-                reference=reference,
-                master=master,
-                override=override,
-                canonical=canonical,
-                overridden_fields=overridden_fields,
-
-                generated_intro_text=intro_text,
-                generated_specs_text=specs_text,
-                generation_tone=tone,
-                generation_include_brand_profile=include_brand_profile,
-                generation_include_wearing_scenes=include_wearing_scenes,
-                generation_reference_urls=reference_urls,
-
-                selected_reference_url=selected_reference_url,
-                selected_reference_reason=selected_reference_reason,
-
-                history=history,
-                combined_reference_chars=combined_reference_chars,
-                combined_reference_preview=combined_reference_preview,
-                reference_urls_debug=reference_urls_debug,
-                llm_client_file=llmc.__file__,
-                raw_urls_debug=(raw_urls if raw_urls else reference_urls),
-
-                similarity_percent=similarity_percent,
-                similarity_level=similarity_level,
-
-                saved_article_id=saved_article_id,
-                rewrite_depth=0,
-
-                plan_mode=PLAN_MODE,
-                monthly_limit=MONTHLY_LIMIT,
-                monthly_used=used,
-                monthly_remaining=rem,
-                month_key=mk,
-            )
+            _note_primary_write()
+            return redirect(url_for('staff_search', brand=brand, reference=reference, job_id=job_id))
 
         # ----------------------------
         # Rewrite once (max 1 per source id)
@@ -716,160 +697,15 @@ def staff_search():
                 flash('言い換え対象が不正です', 'error')
                 return redirect(url_for('staff_search', brand=brand, reference=reference))
 
-            conn = get_db_connection()
-            row = conn.execute(
-                "SELECT * FROM generated_articles WHERE id = ?",
-                (int(source_article_id),)
-            ).fetchone()
-
-            if not row:
-                conn.close()
-                flash('言い換え対象の履歴が見つかりません', 'error')
-                return redirect(url_for('staff_search', brand=brand, reference=reference))
-
-            payload = {}
+            # Server-side guard: same source id can be rewritten only once (submit_rewrite)
             try:
-                payload = json.loads(row['payload_json']) if row['payload_json'] else {}
-            except Exception:
-                payload = {}
-
-            # Server-side guard: same source id can be rewritten only once
-            already = conn.execute(
-                "SELECT 1 FROM generated_articles WHERE rewrite_parent_id = ? LIMIT 1",
-                (int(source_article_id),)
-            ).fetchone()
-            if already:
-                conn.close()
-                flash('この履歴は既に言い換え済みのため、再度の言い換えはできません（最大1回）', 'warning')
+                job_id = submit_rewrite(int(source_article_id))
+            except GenerationRejected as e:
+                flash(str(e), 'warning')
                 return redirect(url_for('staff_search', brand=brand, reference=reference))
 
-            # Prevent rewriting a rewritten record
-            src_depth = int(payload.get("rewrite_depth", 0) or 0)
-            if src_depth >= 1:
-                conn.close()
-                flash('この履歴は既に言い換え済みのため、再度の言い換えはできません（最大1回）', 'warning')
-                return redirect(url_for('staff_search', brand=brand, reference=reference))
-
-            ok, msg = consume_quota_or_block(n=1)
-            if not ok:
-                conn.close()
-                flash(msg, 'error')
-                return redirect(url_for('staff_search', brand=brand, reference=reference))
-
-            try:
-                intro_text, specs_text, ref_meta = llmc.generate_article(payload, rewrite_mode="force")
-            except Exception as e:
-                conn.close()
-                app.logger.exception("LLM rewrite_once failed: %s", e)
-                flash(humanize_llm_error(e), 'error')
-                return redirect(url_for('staff_search', brand=brand, reference=reference))
-
-            payload["selected_reference_url"] = ref_meta.get("selected_reference_url", "")
-            payload["selected_reference_reason"] = ref_meta.get("selected_reference_reason", "")
-            payload["combined_reference_chars"] = ref_meta.get("combined_reference_chars", 0)
-            payload["combined_reference_preview"] = ref_meta.get("combined_reference_preview", "")
-            payload["reference_urls_debug"] = ref_meta.get("reference_urls_debug", [])
-
-            similarity_percent = int(ref_meta.get("similarity_percent", 0) or 0)
-            similarity_level = (ref_meta.get("similarity_level", "blue") or "blue").strip()
-
-            payload["similarity_percent"] = similarity_percent
-            payload["similarity_level"] = similarity_level
-
-            payload["rewrite_applied"] = True
-            payload["rewrite_depth"] = 1
-            payload["rewrite_parent_id"] = int(source_article_id)
-
-            cur = conn.execute("""
-                INSERT INTO generated_articles
-                (brand, reference, payload_json, intro_text, specs_text, rewrite_depth, rewrite_parent_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                brand,
-                reference,
-                json.dumps(payload, ensure_ascii=False),
-                intro_text,
-                specs_text,
-                1,
-                int(source_article_id)
-            ))
-            conn.commit()
-            saved_article_id = cur.lastrowid
-
-            master = conn.execute('''
-                SELECT * FROM master_products
-                WHERE brand = ? AND reference = ?
-            ''', (brand, reference)).fetchone()
-
-            override = conn.execute('''
-                SELECT * FROM product_overrides
-                WHERE brand = ? AND reference = ?
-            ''', (brand, reference)).fetchone()
-
-            canonical = {}
-            overridden_fields = set()
-            for f in fields:
-                ov = override[f] if override and override[f] else ''
-                ms = master[f] if master and master[f] else ''
-                canonical[f] = ov if ov else ms
-                if ov:
-                    overridden_fields.add(f)
-
-            history_rows = conn.execute("""
-                SELECT id, intro_text, specs_text, payload_json, created_at, rewrite_depth, rewrite_parent_id
-                FROM generated_articles
-                WHERE brand = ? AND reference = ?
-                ORDER BY created_at DESC, id DESC
-                LIMIT 5
-            """, (brand, reference)).fetchall()
-
-            conn.close()
-            history = _build_history_rows(history_rows)
-
-            mk, used, rem = get_quota_view()
-
-            return render_template(
-                'search.html',
-                brands=BRANDS,
-                brand=brand,
-                reference=reference,
-                master=master,
-                override=override,
-                canonical=canonical,
-                overridden_fields=overridden_fields,
-
-                generated_intro_text=intro_text,
-                generated_specs_text=specs_text,
-
-                generation_tone=(payload.get('style', {}) or {}).get('tone'),
-                generation_include_brand_profile=(payload.get('options', {}) or {}).get('include_brand_profile'),
-                generation_include_wearing_scenes=(payload.get('options', {}) or {}).get('include_wearing_scenes'),
-                generation_reference_urls=(payload.get("reference_urls") or []),
-
-                selected_reference_url=payload.get("selected_reference_url", ""),
-                selected_reference_reason=payload.get("selected_reference_reason", ""),
-
-                combined_reference_chars=payload.get("combined_reference_chars", 0),
-                combined_reference_preview=payload.get("combined_reference_preview", ""),
-                reference_urls_debug=payload.get("reference_urls_debug", []),
-
-                llm_client_file=llmc.__file__,
-                raw_urls_debug=(payload.get("reference_urls") or []),
-
-                similarity_percent=similarity_percent,
-                similarity_level=similarity_level,
-
-                saved_article_id=saved_article_id,
-                rewrite_depth=1,
-
-                plan_mode=PLAN_MODE,
-                monthly_limit=MONTHLY_LIMIT,
-                monthly_used=used,
-                monthly_remaining=rem,
-                month_key=mk,
-
-                history=history,
-            )
+            _note_primary_write()
+            return redirect(url_for('staff_search', brand=brand, reference=reference, job_id=job_id))
 
         if action == 'regenerate_from_history':
             flash('履歴から再生成は現在停止中です（今は不要なため）', 'warning')
@@ -888,6 +724,19 @@ def staff_search():
     brand = request.args.get('brand', '').strip()
     reference = request.args.get('reference', '').strip()
 
+    # JS なしのフォーム送信の続き: 終わっていれば結果、まだなら再読み込みで待つ
+    pending_job = None
+    job_id = request.args.get('job_id', type=int)
+    if job_id and brand and reference:
+        job = get_generation_job(get_db(), job_id)
+        if job and job["status"] == "done":
+            return _render_job_result(brand, reference, job)
+        if job and job["status"] == "failed":
+            app.logger.error("generation job %s failed: %s", job_id, job["error"])
+            flash(_job_view(job)["message"], 'error')
+            return redirect(url_for('staff_search', brand=brand, reference=reference))
+        pending_job = job
+
     master = None
     override = None
     canonical = {}
@@ -896,29 +745,25 @@ def staff_search():
     override_warning = None
     import_conflict_warning = None
     history = []
+    search_candidates = []
 
     if brand and reference:
-        conn = get_db_connection()
-
-        master = conn.execute('''
-            SELECT * FROM master_products
-            WHERE brand = ? AND reference = ?
-        ''', (brand, reference)).fetchone()
-
-        override = conn.execute('''
-            SELECT * FROM product_overrides
-            WHERE brand = ? AND reference = ?
-        ''', (brand, reference)).fetchone()
+        conn = _search_db()
 
-        for f in fields:
-            ov = override[f] if override and override[f] else ''
-            ms = master[f] if master and master[f] else ''
-            canonical[f] = ov if ov else ms
-            if ov:
-                overridden_fields.add(f)
+        # キャッシュ経由。snapshot は古い値をキャッシュに載せないよう、ミス時は primary から読む
+        spec = resolve_canonical(get_db() if READ_MODE == "snapshot" else conn, brand, reference,
+                                 with_sources=True)
+        master = spec.master
+        override = spec.override
+        canonical = spec.canonical
+        overridden_fields = spec.overridden_fields
 
-        if not master:
+        if not spec.has_master:
             warnings.append('商品マスタに存在しません。任意入力してください')
+        if not spec.has_master and not spec.has_override:
+            # 区切り違い・前方一致・コレクション名などで近いものを提示
+            found = search_products(conn, reference, brand=brand, per_page=10)
+            search_candidates = found['results'] or found['suggestions']
         if not canonical.get('price_jpy'):
             warnings.append('price_jpyがマスタとオーバーライドの両方で空です')
 
@@ -933,7 +778,6 @@ def staff_search():
             LIMIT 5
         """, (brand, reference)).fetchall()
 
-        conn.close()
         history = _build_history_rows(history_rows)
 
     return render_template(
@@ -949,6 +793,9 @@ def staff_search():
         override_warning=override_warning,
         import_conflict_warning=import_conflict_warning,
         history=history,
+        search_candidates=search_candidates,
+        pending_job=pending_job,
+        job_refresh_sec=max(1, int(JOB_POLL_SEC)),
 
         plan_mode=PLAN_MODE,
         monthly_limit=MONTHLY_LIMIT,
@@ -0,0 +1,161 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from models import get_db_connection
+from product_search import normalize_reference
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Reference autocomplete（プロセス内の前方一致インデックス）
+#   - ブランドごとに (reference_norm, reference) のソート済み配列を持ち、bisect で前方一致範囲を引く
+#   - 起動時に canonical_products から構築（マスタのみ・オーバーライドのみの商品も含む）
+#   - 以降は canonical_products.id が前回より大きい行だけを取り込む（インポート後・オーバーライド保存後）
+#   - 1打鍵ごとの問い合わせでは SQLite を読まない
+# ----------------------------
+AUTOCOMPLETE_LIMIT = 10
+# 別プロセス（bulk_import CLI など）の追加分を取り込む間隔
+AUTOCOMPLETE_REFRESH_SEC = float(os.getenv("HOROLOGEN_AUTOCOMPLETE_REFRESH_SEC", "60"))
+
+Entry = Tuple[str, str]  # (reference_norm, reference)
+
+
+class _ReferenceIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 読み取りはロックなし（配列は差し替えのみで、書き換えない）
+        self._by_brand: Dict[str, List[Entry]] = {}
+        self._members: Dict[str, set] = {}
+        self._last_id = 0
+        self._refreshed_at = 0.0
+        self._refreshing = False
+        self.ready = False
+
+    # ---- 構築・更新 ----
+    def _merge(self, rows: Iterable[Tuple[int, str, str, str]]) -> int:
+        """(id, brand, reference, reference_norm) を取り込む。呼び出し側で self._lock を持つこと"""
+        added: Dict[str, List[Entry]] = {}
+        max_id = self._last_id
+        for row_id, brand, reference, norm in rows:
+            max_id = max(max_id, row_id)
+            members = self._members.setdefault(brand, set())
+            if reference in members:
+                continue
+            members.add(reference)
+            added.setdefault(brand, []).append((norm, reference))
+
+        for brand, entries in added.items():
+            # ソート済み同士の結合は timsort でほぼ線形（insort を件数分呼ぶより速い）
+            merged = self._by_brand.get(brand, []) + entries
+            merged.sort()
+            self._by_brand[brand] = merged
+        self._last_id = max_id
+        return sum(len(v) for v in added.values())
+
+    def refresh(self, conn=None) -> int:
+        """前回以降に増えた canonical_products の行を取り込み、追加件数を返す"""
+        own = conn is None
+        conn = conn or get_db_connection()
+        try:
+            with self._lock:
+                rows = conn.execute(
+                    'SELECT id, brand, reference, reference_norm FROM canonical_products WHERE id > ?',
+                    (self._last_id,)
+                ).fetchall()
+                n = self._merge(tuple(r) for r in rows)
+                self._refreshed_at = time.monotonic()
+                self.ready = True
+                return n
+        finally:
+            if own:
+                conn.close()
+
+    def discard(self, brand: str, reference: str) -> None:
+        with self._lock:
+            members = self._members.get(brand)
+            if not members or reference not in members:
+                return
+            members.discard(reference)
+            entries = self._by_brand.get(brand, [])
+            self._by_brand[brand] = [e for e in entries if e[1] != reference]
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("autocomplete refresh failed: %s: %s", type(e).__name__, e)
+        finally:
+            self._refreshing = False
+
+    def maybe_refresh_async(self) -> None:
+        if self._refreshing or time.monotonic() - self._refreshed_at < AUTOCOMPLETE_REFRESH_SEC:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    # ---- 問い合わせ ----
+    @staticmethod
+    def _prefix_range(entries: List[Entry], norm: str, limit: int) -> List[Entry]:
+        out = []
+        i = bisect.bisect_left(entries, (norm, ''))
+        while i < len(entries) and len(out) < limit and entries[i][0].startswith(norm):
+            out.append(entries[i])
+            i += 1
+        return out
+
+    def suggest(self, prefix: str, brand: Optional[str] = None, limit: int = AUTOCOMPLETE_LIMIT) -> List[Dict[str, str]]:
+        norm = normalize_reference(prefix)
+        if not norm:
+            return []
+        by_brand = self._by_brand
+        brands = [brand] if brand else sorted(by_brand)
+
+        hits = []
+        for b in brands:
+            for norm_ref, reference in self._prefix_range(by_brand.get(b, []), norm, limit):
+                hits.append((norm_ref, b, reference))
+        hits.sort()
+        return [{'brand': b, 'reference': r} for _n, b, r in hits[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'brands': len(self._by_brand),
+            'references': sum(len(v) for v in self._by_brand.values()),
+            'last_id': self._last_id,
+        }
+
+
+_index = _ReferenceIndex()
+
+
+def build_autocomplete_index() -> int:
+    """起動時に呼ぶ（全件読み込み）"""
+    t0 = time.perf_counter()
+    n = _index.refresh()
+    logger.info("autocomplete indexed %d references in %.2fs", n, time.perf_counter() - t0)
+    return n
+
+
+def refresh_autocomplete_index(conn=None) -> int:
+    """インポート・オーバーライド保存の後に呼ぶ（増えた行だけ取り込む）"""
+    return _index.refresh(conn)
+
+
+def discard_reference(brand: str, reference: str) -> None:
+    """商品が canonical_products から消えたとき（オーバーライドのみの商品を解除した場合）"""
+    _index.discard(brand, reference)
+
+
+def complete_reference(prefix: str, brand: Optional[str] = None,
+                       limit: int = AUTOCOMPLETE_LIMIT) -> List[Dict[str, str]]:
+    _index.maybe_refresh_async()
+    return _index.suggest(prefix, brand=brand, limit=limit)
+
+
+def autocomplete_stats() -> Dict[str, Any]:
+    return _index.stats()
@@ -0,0 +1,140 @@
+"""
+SQLite の同時実行ベンチマーク（storage profile ごとの比較）
+
+    python bench_concurrency.py --seconds 10 --readers 4 --generators 2
+
+一時DBに対して、検索（読み取り）・記事生成（クォータ消費 + generated_articles 挿入）・
+CSVインポートを同時に流し、profile ごとに ops/sec・p95/最大レイテンシ・locked エラー数を表示する。
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import models
+from bench_import import _make_csv
+
+
+_SEARCH_SQL = '''
+    SELECT m.*, o.price_jpy AS o_price_jpy, o.editor_note
+    FROM master_products m
+    LEFT JOIN product_overrides o ON o.brand = m.brand AND o.reference = m.reference
+    WHERE m.brand = ? AND m.reference LIKE ?
+    ORDER BY m.reference
+    LIMIT 20
+'''
+
+
+def _search(conn, i: int) -> None:
+    brand = ['cartier', 'omega', 'grand_seiko', 'iwc', 'panerai'][i % 5]
+    conn.execute(_SEARCH_SQL, (brand, f'REF-{i % 1000:04d}%')).fetchall()
+
+
+def _generate(conn, i: int) -> None:
+    """app.consume_quota_or_block + 生成結果の保存と同じ書き込みパターン"""
+    def _consume_and_save(c) -> None:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(
+            "INSERT INTO monthly_generation_usage (month_key, used_count) VALUES ('bench', 1) "
+            "ON CONFLICT(month_key) DO UPDATE SET used_count = used_count + 1"
+        )
+        c.execute(
+            "INSERT INTO generated_articles (brand, reference, payload_json, intro_text, specs_text) "
+            "VALUES (?, ?, '{}', ?, '')",
+            ('omega', f'REF-{i:07d}', 'x' * 2000)
+        )
+
+    models.run_write(conn, _consume_and_save)
+
+
+def _import(conn, i: int, csv_text: str) -> None:
+    from csv_import import import_csv
+    import_csv(conn, csv.DictReader(io.StringIO(csv_text)), f'bench_{i}.csv')
+
+
+def _worker(kind: str, stop: threading.Event, out: Dict[str, List], csv_text: str,
+            think_sec: float) -> None:
+    conn = models.get_db_connection()
+    latencies, errors = [], 0
+    i = 0
+    try:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                if kind == 'search':
+                    _search(conn, i)
+                elif kind == 'generate':
+                    _generate(conn, i)
+                else:
+                    _import(conn, i, csv_text)
+                latencies.append(time.perf_counter() - t0)
+            except Exception as e:
+                if not models.is_locked_error(e):
+                    raise
+                errors += 1
+                conn.rollback()
+            i += 1
+            if kind == 'generate' and think_sec:
+                time.sleep(think_sec)  # 実際は LLM 呼び出しを挟むので書き込みは連続しない
+    finally:
+        conn.close()
+    out[kind].append((latencies, errors))
+
+
+def _run_profile(tmpdir: str, profile: str, args, seed_text: str, import_text: str) -> None:
+    models.DB_PATH = os.path.join(tmpdir, f'{profile}.db')
+    models.STORAGE_PROFILE = dict(models.STORAGE_PROFILES[profile])
+    models.init_db()
+
+    conn = models.get_db_connection()
+    _import(conn, 0, seed_text)
+    conn.close()
+
+    kinds = ['search'] * args.readers + ['generate'] * args.generators + ['import']
+    out: Dict[str, List] = {'search': [], 'generate': [], 'import': []}
+    stop = threading.Event()
+    threads = [threading.Thread(target=_worker, args=(k, stop, out, import_text, args.think_ms / 1000.0)) for k in kinds]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f'[{profile}]')
+    for kind in ('search', 'generate', 'import'):
+        lat = sorted(x for latencies, _ in out[kind] for x in latencies)
+        errors = sum(e for _, e in out[kind])
+        p95 = lat[int(len(lat) * 0.95)] * 1000 if lat else 0.0
+        mx = lat[-1] * 1000 if lat else 0.0
+        print(
+            f'  {kind:9s} ops={len(lat):>7d}  {len(lat) / args.seconds:9.1f} ops/sec  '
+            f'p95={p95:8.1f}ms  max={mx:8.1f}ms  locked={errors}'
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--seconds', type=float, default=10.0)
+    ap.add_argument('--readers', type=int, default=4)
+    ap.add_argument('--generators', type=int, default=2)
+    ap.add_argument('--think-ms', type=float, default=5.0, help='生成1回ごとの間隔（LLM 呼び出しの代わり）')
+    ap.add_argument('--rows', type=int, default=20000, help='事前投入する行数')
+    ap.add_argument('--import-rows', type=int, default=5000, help='同時に流すインポート1回あたりの行数')
+    ap.add_argument('--profiles', default='rollback,wal')
+    args = ap.parse_args()
+
+    seed_text = _make_csv(args.rows)
+    import_text = _make_csv(args.import_rows, seed=11)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for profile in [p.strip() for p in args.profiles.split(',') if p.strip()]:
+            _run_profile(tmpdir, profile, args, seed_text, import_text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+参考ページ本文抽出（html_extract）のベンチマーク
+
+    python bench_extract.py --pages 200
+    python bench_extract.py --dir saved_pages/      # 保存したページ（*.html）で比較
+    python bench_extract.py --from-cache            # ページキャッシュ（<DBパス>.pages）の本文で比較
+    python bench_extract.py --dir fixtures/extract --check           # 保存済みの bs4 出力（expected.json）と照合
+    python bench_extract.py --dir fixtures/extract --write-expected  # expected.json を bs4 で作り直す
+
+各バックエンドの pages/sec と、基準（bs4、無ければ stream）との抽出テキストの不一致件数を表示する。
+--check は --dir の expected.json（従来の bs4 実装の出力）を基準にし、auto で選ぶバックエンドが
+1ページでも一致しなければ終了コード 1 を返す。
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+from typing import List, Tuple
+
+import html_extract
+
+_WORDS = ['ケース', 'ムーブメント', 'キャリバー', '防水', 'サファイアクリスタル', 'ステンレススチール',
+          'クロノグラフ', 'パワーリザーブ', 'Co-Axial', 'Master Chronometer', 'Seamaster', 'ダイアル',
+          'ブレスレット', 'ラグ', 'ベゼル', 'セラミック', '自動巻き', '日付表示', '&amp;', '&nbsp;', '&#8211;']
+
+
+def _sentence(rnd: random.Random, n: int) -> str:
+    return ' '.join(rnd.choice(_WORDS) for _ in range(n)) + '。'
+
+
+def _make_page(rnd: random.Random) -> str:
+    """ブランド公式ページに似た構成（ナビ・スクリプトが多く、本文は main 配下）"""
+    nav = ''.join(f'<li><a href="/c/{i}">{rnd.choice(_WORDS)}</a></li>' for i in range(rnd.randint(40, 200)))
+    scripts = ''.join(
+        f'<script>window.__d{i}={{"k":"{"x" * rnd.randint(200, 2000)}"}};</script>' for i in range(rnd.randint(5, 30))
+    )
+    specs = ''.join(
+        f'<tr><th>{rnd.choice(_WORDS)}</th><td>{_sentence(rnd, 3)}</td></tr>' for _ in range(rnd.randint(10, 40))
+    )
+    body = ''.join(
+        f'<h2>{_sentence(rnd, 4)}</h2>'
+        + ''.join(f'<p>{_sentence(rnd, rnd.randint(5, 30))} <b>{rnd.choice(_WORDS)}</b></p>' for _ in range(5))
+        + '<ul>' + ''.join(f'<li>{_sentence(rnd, 6)}</li>' for _ in range(5)) + '</ul>'
+        for _ in range(rnd.randint(3, 12))
+    )
+    root = rnd.choice(['<main>{}</main>', '<article class="post">{}</article>',
+                       '<div class="entry-content">{}</div>', '<div>{}</div>'])
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Seamaster</title>'
+        f'<style>.a{{color:red}}</style>{scripts}</head><body>'
+        f'<header><nav><ul>{nav}</ul></nav></header>'
+        + root.format(f'<h1>{_sentence(rnd, 3)}</h1>{body}<table>{specs}</table><!-- spec end -->')
+        + f'<aside>{_sentence(rnd, 20)}</aside><footer><p>{_sentence(rnd, 10)}</p></footer></body></html>'
+    )
+
+
+def _load_pages(args) -> List[Tuple[str, str]]:
+    if args.dir:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.dir, '*.htm*'))):
+            with open(path, 'rb') as f:
+                pages.append((os.path.basename(path), f.read().decode('utf-8', errors='replace')))
+        return pages
+    if args.from_cache:
+        import page_cache
+        conn = page_cache._conn()
+        urls = [r['url'] for r in conn.execute('SELECT url FROM page_cache ORDER BY url')]
+        return [(u, page_cache.lookup(u).html()) for u in urls]
+    rnd = random.Random(7)
+    return [(f'synthetic-{i}', _make_page(rnd)) for i in range(args.pages)]
+
+
+EXPECTED_FILE = 'expected.json'
+
+
+def _write_expected(args, pages: List[Tuple[str, str]]) -> None:
+    backends = html_extract.available_extractors()
+    if 'bs4' not in backends:
+        sys.exit('bs4 is not installed')
+    expected = {}
+    for name, h in pages:
+        text, method = backends['bs4'](h)
+        expected[name] = {'text': text, 'method': method}
+    with open(os.path.join(args.dir, EXPECTED_FILE), 'w', encoding='utf-8') as f:
+        json.dump(expected, f, ensure_ascii=False, indent=1, sort_keys=True)
+        f.write('\n')
+    print(f'wrote {len(expected)} pages to {os.path.join(args.dir, EXPECTED_FILE)}')
+
+
+def _check(args, pages: List[Tuple[str, str]]) -> None:
+    with open(os.path.join(args.dir, EXPECTED_FILE), encoding='utf-8') as f:
+        expected = json.load(f)
+    missing = sorted(set(expected) ^ {n for n, _h in pages})
+    if missing:
+        sys.exit(f'{EXPECTED_FILE} and pages differ: {missing}')
+
+    auto_name = html_extract.get_extractor('auto')[0]
+    failed = False
+    for name, fn in html_extract.available_extractors().items():
+        mismatched = [n for n, h in pages if fn(h) != (expected[n]['text'], expected[n]['method'])]
+        in_auto = name in html_extract.AUTO_EXTRACTORS
+        print(f'{name:11s} {"auto" if in_auto else "    "}  mismatch={len(mismatched)}/{len(pages)}'
+              + (f'  {mismatched}' if mismatched else ''))
+        if mismatched and in_auto:
+            failed = True
+    print(f'auto -> {auto_name}')
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--pages', type=int, default=100, help='合成ページ数（--dir / --from-cache が無いとき）')
+    ap.add_argument('--dir', default='')
+    ap.add_argument('--from-cache', action='store_true')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--check', action='store_true', help='--dir の expected.json と照合（計測はしない）')
+    ap.add_argument('--write-expected', action='store_true', help='--dir の expected.json を bs4 で作り直す')
+    args = ap.parse_args()
+    if (args.check or args.write_expected) and not args.dir:
+        ap.error('--check / --write-expected には --dir が必要です')
+
+    pages = _load_pages(args)
+    if not pages:
+        print('no pages')
+        return
+    if args.write_expected:
+        _write_expected(args, pages)
+        return
+    if args.check:
+        _check(args, pages)
+        return
+    total_mb = sum(len(h.encode('utf-8')) for _n, h in pages) / 1024 / 1024
+    print(f'pages={len(pages)}  html={total_mb:.1f}MB  default extractor={html_extract.EXTRACTOR_NAME}')
+
+    backends = html_extract.available_extractors()
+    ref_name = 'bs4' if 'bs4' in backends else 'stream'
+    expected = [backends[ref_name](h) for _n, h in pages]
+
+    for name, fn in backends.items():
+        best = None
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            outputs = [fn(h) for _n, h in pages]
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        mismatched = [pages[i][0] for i, out in enumerate(outputs) if out != expected[i]]
+        print(
+            f'{name:11s} {len(pages) / best:8.1f} pages/sec  {best / len(pages) * 1000:7.2f}ms/page  '
+            f'mismatch vs {ref_name}={len(mismatched)}'
+            + (f'  e.g. {mismatched[:3]}' if mismatched else '')
+        )
+
+
+if __name__ == '__main__':
+    main()
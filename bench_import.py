@@ -0,0 +1,242 @@
+"""
+CSVインポートのベンチマーク（従来の1行ずつループ vs セットベース）
+
+    python bench_import.py --rows 200000
+    python bench_import.py --bulk 8 --rows 100000 --workers 1,2,4,8   # bulk_import のワーカー数ごとの wall time
+
+一時DBに対して同じCSVを取り込み、rows/sec と統計の一致を表示する。
+既存行・変更行・オーバーライドを混ぜるため、半分の行を事前投入してから計測する。
+--bulk N ではブランド別の N ファイル（各 --rows 行）を bulk_import で取り込み、ワーカー数ごとの
+wall time と、統計・取込後の master_products が1ファイルずつ import_csv した場合と同じかを表示する。
+"""
+import argparse
+import csv
+import hashlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import models
+from models import PRODUCT_FIELDS
+
+
+def _make_csv(n_rows: int, seed: int = 7, brand: str = '') -> str:
+    rnd = random.Random(seed)
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(models.REQUIRED_CSV_COLUMNS)
+    brands = [brand] if brand else ['cartier', 'omega', 'grand_seiko', 'iwc', 'panerai']
+    for i in range(n_rows):
+        brand = brands[i % len(brands)]
+        row = [brand, f'REF-{i:07d}']
+        for f in PRODUCT_FIELDS:
+            row.append(f'{f}-{rnd.randint(0, 3)}')
+        if i % 97 == 0:
+            row[1] = ''  # エラー行
+        elif i % 50 == 49:
+            row[1] = f'REF-{i - 10:07d}'  # 同一CSV内の重複キー
+        w.writerow(row)
+    return out.getvalue()
+
+
+def _legacy_import(conn, reader, filename):
+    """baseline: 従来の admin_upload と同じ 1行ごとの SELECT x2 + UPSERT"""
+    import json
+    cursor = conn.cursor()
+    total_rows = inserted_count = updated_count = error_count = 0
+    changed_count = override_conflict_count = 0
+    error_details, sample_diffs = [], []
+    fields = PRODUCT_FIELDS
+
+    for row_num, row in enumerate(reader, start=2):
+        total_rows += 1
+        row = {k.strip(): (v.strip() if v else '') for k, v in row.items()}
+        brand = row.get('brand', '').strip()
+        reference = row.get('reference', '').strip()
+        if not brand or not reference:
+            error_count += 1
+            error_details.append(f'行{row_num}: brandまたはreferenceが空です')
+            continue
+        data = {f: row.get(f, '') for f in fields}
+
+        existing = cursor.execute(
+            "SELECT * FROM master_products WHERE brand = ? AND reference = ?", (brand, reference)
+        ).fetchone()
+        override_exists = cursor.execute(
+            "SELECT 1 FROM product_overrides WHERE brand = ? AND reference = ?", (brand, reference)
+        ).fetchone() is not None
+
+        if existing:
+            row_diffs = []
+            for f in fields:
+                old_value = existing[f] or ''
+                new_value = data[f] or ''
+                if old_value != new_value:
+                    diff_info = {'field': f, 'old': old_value, 'new': new_value}
+                    if override_exists:
+                        diff_info['override_exists'] = True
+                    row_diffs.append(diff_info)
+            if row_diffs:
+                changed_count += 1
+                if override_exists:
+                    override_conflict_count += 1
+                if len(sample_diffs) < 10:
+                    sample_diffs.append({'brand': brand, 'reference': reference, 'diffs': row_diffs})
+
+        cols = ['brand', 'reference'] + fields
+        cursor.execute(
+            'INSERT INTO master_products (' + ', '.join(cols) + ', updated_at) VALUES ('
+            + ', '.join('?' for _ in cols) + ', CURRENT_TIMESTAMP) '
+            'ON CONFLICT(brand, reference) DO UPDATE SET '
+            + ', '.join(f'{f} = excluded.{f}' for f in fields) + ', updated_at = CURRENT_TIMESTAMP',
+            (brand, reference, *(data[f] for f in fields))
+        )
+        if existing:
+            updated_count += 1
+        else:
+            inserted_count += 1
+
+    cursor.execute('''
+        INSERT INTO master_uploads
+        (filename, total_rows, inserted_count, updated_count, error_count, error_details,
+         changed_count, override_conflict_count, sample_diffs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (filename, total_rows, inserted_count, updated_count, error_count, '\n'.join(error_details),
+          changed_count, override_conflict_count,
+          json.dumps(sample_diffs, ensure_ascii=False) if sample_diffs else None))
+    conn.commit()
+    return {
+        'total_rows': total_rows, 'inserted_count': inserted_count, 'updated_count': updated_count,
+        'error_count': error_count, 'changed_count': changed_count,
+        'override_conflict_count': override_conflict_count, 'sample_diffs': sample_diffs,
+    }
+
+
+def _fresh_db(tmpdir: str, name: str, seed_text: str) -> str:
+    path = os.path.join(tmpdir, name)
+    models.DB_PATH = path
+    models.init_db()
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    _legacy_import(conn, csv.DictReader(io.StringIO(seed_text)), 'seed.csv')
+    conn.execute(
+        "INSERT INTO product_overrides (brand, reference, price_jpy) "
+        "SELECT brand, reference, '1' FROM master_products WHERE id % 13 = 0"
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _table_digest(path: str) -> str:
+    conn = sqlite3.connect(path)
+    h = hashlib.sha256()
+    cols = ', '.join(['brand', 'reference'] + PRODUCT_FIELDS)
+    for row in conn.execute(f'SELECT {cols} FROM master_products ORDER BY brand, reference'):
+        h.update(repr(tuple(row)).encode('utf-8'))
+    conn.close()
+    return h.hexdigest()[:16]
+
+
+def bench_bulk(n_files: int, rows: int, worker_counts):
+    """bulk_import のワーカー数ごとの wall time（同じ入力・同じ事前投入DBから毎回やり直す）"""
+    import bulk_import
+    from csv_import import import_csv
+
+    keys = ['total_rows', 'inserted_count', 'updated_count', 'error_count',
+            'changed_count', 'override_conflict_count', 'sample_diffs']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files, seed_parts = [], []
+        for k in range(n_files):
+            brand = f'brand{k:02d}'
+            seed_lines = _make_csv(rows, brand=brand).splitlines(keepends=True)
+            seed_parts.append(''.join(seed_lines[1: 1 + rows // 2]))
+            path = os.path.join(tmpdir, f'{brand}.csv')
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(_make_csv(rows, seed=11 + k, brand=brand))
+            files.append((path, f'{brand}.csv'))
+        header = ','.join(models.REQUIRED_CSV_COLUMNS) + '\r\n'
+        seeded = _fresh_db(tmpdir, 'seeded.db', header + ''.join(seed_parts))
+
+        def _copy(name: str) -> str:
+            path = os.path.join(tmpdir, name)
+            shutil.copyfile(seeded, path)
+            models.DB_PATH = path
+            return path
+
+        # 基準: 1ファイルずつ import_csv
+        path = _copy('serial.db')
+        conn = models.get_db_connection()
+        t0 = time.perf_counter()
+        expected = []
+        for p, name in files:
+            with open(p, 'rb') as f:
+                from csv_import import open_csv_stream
+                st = import_csv(conn, open_csv_stream(f), name)
+            expected.append({k: st[k] for k in keys})
+        base = time.perf_counter() - t0
+        conn.close()
+        digest = _table_digest(path)
+        total = n_files * rows
+        print(f'cpus={os.cpu_count()} files={n_files} rows/file={rows}')
+        print(f'{"import_csv x" + str(n_files):16s} {base:8.2f}s  {total / base:10.0f} rows/sec')
+
+        for w in worker_counts:
+            path = _copy(f'bulk_{w}.db')
+            t0 = time.perf_counter()
+            results = bulk_import.run_bulk_import(files, workers=w)
+            dt = time.perf_counter() - t0
+            same = ([{k: r['stats'][k] for k in keys} for r in results] == expected
+                    and _table_digest(path) == digest)
+            print(f'{"bulk workers=" + str(w):16s} {dt:8.2f}s  {total / dt:10.0f} rows/sec  '
+                  f'x{base / dt:4.2f}  identical={same}')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=50000)
+    ap.add_argument('--bulk', type=int, default=0, help='bulk_import をこのファイル数で計測')
+    ap.add_argument('--workers', default='1,2,4', help='--bulk で試すワーカー数（カンマ区切り）')
+    args = ap.parse_args()
+
+    if args.bulk:
+        bench_bulk(args.bulk, args.rows, [int(w) for w in args.workers.split(',') if w.strip()])
+        return
+
+    from csv_import import import_csv
+
+    text = _make_csv(args.rows)
+    lines = text.splitlines(keepends=True)
+    seed_text = ''.join(lines[: 1 + args.rows // 2])
+    update_text = _make_csv(args.rows, seed=11)
+
+    keys = ['total_rows', 'inserted_count', 'updated_count', 'error_count',
+            'changed_count', 'override_conflict_count', 'sample_diffs']
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = {}
+        for label, fn in (('legacy_loop', _legacy_import), ('set_based', import_csv)):
+            path = _fresh_db(tmpdir, f'{label}.db', seed_text)
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            t0 = time.perf_counter()
+            stats = fn(conn, csv.DictReader(io.StringIO(update_text)), 'bench.csv')
+            dt = time.perf_counter() - t0
+            conn.close()
+            results[label] = {k: stats[k] for k in keys}
+            print(f'{label:12s} rows={args.rows:>8d}  {dt:8.2f}s  {args.rows / dt:10.0f} rows/sec')
+
+        same = results['legacy_loop'] == results['set_based']
+        print('stats identical:', same)
+        if not same:
+            for k in keys:
+                if results['legacy_loop'][k] != results['set_based'][k]:
+                    print(' ', k, results['legacy_loop'][k], '!=', results['set_based'][k])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+商品検索（product_search.search_products）のベンチマーク
+
+    python bench_search.py --rows 1000000
+
+一時DBにカタログを取り込み（canonical_products / canonical_fts はトリガーで構築）、
+完全一致・区切り違い・前方一致・コレクション・キャリバー・該当なしの各クエリについて
+p50 / p95 / 最大のレイテンシを表示する。
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import tempfile
+import time
+
+import models
+from models import PRODUCT_FIELDS
+
+_COLLECTIONS = ['Speedmaster', 'Seamaster', 'Constellation', 'De Ville', 'Santos', 'Tank',
+                'Ballon Bleu', 'Heritage', 'Pilot', 'Portugieser', 'Luminor', 'Radiomir']
+
+
+def _make_catalog_csv(n_rows: int, seed: int = 3) -> str:
+    rnd = random.Random(seed)
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(models.REQUIRED_CSV_COLUMNS)
+    brands = ['cartier', 'omega', 'grand_seiko', 'iwc', 'panerai']
+    for i in range(n_rows):
+        values = {f: '' for f in PRODUCT_FIELDS}
+        values['price_jpy'] = str(rnd.randint(100, 3000) * 1000)
+        values['collection'] = f'{rnd.choice(_COLLECTIONS)} {rnd.randint(1, 400)}'
+        values['movement_caliber'] = str(rnd.randint(1000, 9999))
+        ref = f'{100 + i % 900}.{(i // 900) % 100:02d}.{i % 97:02d}.{i // 90000:02d}.{i % 13:02d}.{i % 1000:03d}'
+        w.writerow([brands[i % len(brands)], ref] + [values[f] for f in PRODUCT_FIELDS])
+    return out.getvalue()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=200000)
+    ap.add_argument('--repeat', type=int, default=50)
+    args = ap.parse_args()
+
+    from csv_import import import_csv
+    from product_search import search_products
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        models.DB_PATH = os.path.join(tmpdir, 'search.db')
+        models.init_db()
+        conn = models.get_db_connection()
+
+        t0 = time.perf_counter()
+        import_csv(conn, csv.DictReader(io.StringIO(_make_catalog_csv(args.rows))), 'catalog.csv',
+                   chunk_rows=50000)
+        print(f'catalog rows={args.rows}  import+index {time.perf_counter() - t0:.1f}s')
+
+        sample = conn.execute(
+            'SELECT reference, collection, movement_caliber FROM canonical_products '
+            'ORDER BY id LIMIT 1 OFFSET ?', (args.rows // 2,)
+        ).fetchone()
+        ref = sample['reference']
+        queries = [
+            ('exact', ref, None),
+            ('no_separator', ref.replace('.', ''), None),
+            ('dash_separator', ref.replace('.', '-'), None),
+            ('prefix', '.'.join(ref.split('.')[:3]), None),
+            ('prefix_brand', '.'.join(ref.split('.')[:3]), 'omega'),
+            ('collection', sample['collection'], None),
+            ('collection_word', sample['collection'].split()[0], None),
+            ('caliber', sample['movement_caliber'], None),
+            ('no_hit', 'ZX-00000', None),
+        ]
+
+        for label, q, brand in queries:
+            times = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                res = search_products(conn, q, brand=brand)
+                times.append((time.perf_counter() - t) * 1000)
+            times.sort()
+            n_hits = len(res['results']) or len(res['suggestions'])
+            print(
+                f'{label:16s} q={q!r:28s} hits={n_hits:>3d}  '
+                f'p50={times[len(times) // 2]:7.2f}ms  p95={times[int(len(times) * 0.95)]:7.2f}ms  '
+                f'max={times[-1]:7.2f}ms'
+            )
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
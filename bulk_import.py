@@ -0,0 +1,359 @@
+"""
+複数CSV / ZIP の一括インポート
+
+    python bulk_import.py omega.csv cartier.csv ...
+    python bulk_import.py nightly_feeds.zip --workers 4
+
+- パース（デコード・CSV解析・行の検証）と差分算出はワーカープロセスで並列実行
+  （各ワーカーは読み取り専用の接続を持ち、チャンクごとに既存行との差分を出す）
+- ブランド単位でシャーディング（同じブランドのファイルは同じワーカーで順番に処理）
+- ワーカーは新規・変更のある行だけをチャンク単位でライターへ送る。ライターは UPSERT だけを行い、
+  適用したらそのワーカーへ ack を返す。ワーカーは直前のチャンクの ack を待ってから次の差分を出すので、
+  同じシャード内では指定順に取り込んだのと同じ結果になり、メモリはワーカーあたり約2チャンクで一定
+- シャードをまたぐ適用順は決まらない（1ファイル1ブランドならキーが重ならないので結果は同じ）
+- 子プロセスは forkserver（無ければ spawn）で起動する（スレッドを持つ Flask プロセスから fork しない）
+- ワーカーが1本になる（CPU 1個・シャード1つ）ときはプロセスを起こさず、このプロセスで順に import_csv と同じ
+  取込をする（1本だとプロセス間の受け渡しの分だけ遅くなるため）
+- 結果はファイルごとに master_uploads へ1行記録（開始時に running、終了時に done / failed）
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import models
+from models import get_db_connection, run_write
+from csv_import import (
+    IMPORT_CHUNK_ROWS, SAMPLE_DIFFS_LIMIT, apply_rows, check_csv_columns, diff_chunk, drop_staging,
+    finish_upload, import_rows, iter_csv_rows, new_import_stats, open_csv_stream, open_diff_connection,
+    start_upload,
+)
+
+logger = logging.getLogger(__name__)
+
+BULK_WORKERS = int(os.getenv("HOROLOGEN_BULK_WORKERS", "0")) or (os.cpu_count() or 1)
+
+_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# (保存先パス, 表示用ファイル名)
+BulkFile = Tuple[str, str]
+
+
+# ----------------------------
+# 入力の展開
+# ----------------------------
+def expand_inputs(inputs: List[BulkFile], workdir: str) -> List[BulkFile]:
+    """CSV はそのまま、ZIP は中の .csv を workdir に展開して返す（指定順を保持）"""
+    files: List[BulkFile] = []
+    for path, display_name in inputs:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for i, info in enumerate(zf.infolist()):
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or not name.lower().endswith('.csv') or name.startswith('.'):
+                        continue
+                    dest = os.path.join(workdir, f'{i:05d}_{name}')
+                    with zf.open(info) as src, open(dest, 'wb') as dst:
+                        while True:
+                            buf = src.read(1024 * 1024)
+                            if not buf:
+                                break
+                            dst.write(buf)
+                    files.append((dest, name))
+        else:
+            files.append((path, display_name))
+    return files
+
+
+def peek_brand(path: str) -> str:
+    """シャードキー用に先頭データ行の brand だけ読む（読めなければ空文字）"""
+    try:
+        with open(path, 'rb') as f:
+            reader = open_csv_stream(f)
+            for row in reader:
+                return (row.get('brand') or '').strip()
+    except Exception:
+        pass
+    return ''
+
+
+# ----------------------------
+# ワーカー（別プロセス）
+#   ライターへのメッセージ（ワーカーごとに送信順が保たれる）:
+#     ('start', wid, i, column_error)
+#     ('chunk', wid, i, rows, delta, total_rows, error_count)   rows は新規・変更のある行だけ
+#     ('done', wid, i, stats)                                   パース側の統計（行数・エラー）
+#     ('failed', wid, i, error, stats)
+# ----------------------------
+def _worker(wid: int, db_path: str, chunk_rows: int, tasks, results, acks) -> None:
+    conn = open_diff_connection(db_path)
+    unacked = [False]  # 直前に送ったチャンクがまだ適用されていないか（ファイルをまたいで持ち越す）
+
+    def _wait_applied() -> None:
+        if unacked[0]:
+            acks.get()
+            unacked[0] = False
+
+    try:
+        while True:
+            shard = tasks.get()
+            if shard is None:
+                break
+            for i, path in shard:
+                _diff_file(conn, wid, i, path, chunk_rows, results, _wait_applied, unacked)
+    finally:
+        conn.close()
+
+
+def _diff_file(conn, wid: int, i: int, path: str, chunk_rows: int, results,
+               wait_applied: Callable[[], None], unacked: List[bool]) -> None:
+    stats = new_import_stats()
+    started = False
+    try:
+        with open(path, 'rb') as f:
+            reader = open_csv_stream(f)
+            column_error = check_csv_columns(reader.fieldnames)
+            results.put(('start', wid, i, column_error))
+            started = True
+            if not column_error:
+                rows = iter_csv_rows(reader, stats)
+                samples = 0
+                while True:
+                    chunk = list(islice(rows, chunk_rows))  # パースは直前のチャンクの適用と並行
+                    if not chunk:
+                        break
+                    wait_applied()
+                    delta, write_rows = diff_chunk(conn, chunk, SAMPLE_DIFFS_LIMIT - samples)
+                    samples += len(delta['sample_diffs'])
+                    results.put(('chunk', wid, i, write_rows, delta, stats['total_rows'], stats['error_count']))
+                    unacked[0] = True
+        results.put(('done', wid, i, stats))
+    except Exception as e:
+        error = 'CSVファイルはUTF-8で保存してください' if isinstance(e, UnicodeDecodeError) else f'{type(e).__name__}: {e}'
+        if not started:
+            # ヘッダまでに失敗したものは取り込まない（master_uploads にも残さない）
+            results.put(('start', wid, i, error))
+            results.put(('done', wid, i, stats))
+        else:
+            results.put(('failed', wid, i, error, stats))
+
+
+# ----------------------------
+# 並列パース・差分 + 単一ライター
+# ----------------------------
+def run_bulk_import(
+    files: List[BulkFile],
+    workers: Optional[int] = None,
+    on_file_start: Optional[Callable[[int], None]] = None,
+    on_file_done: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    chunk_rows: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    files を取り込み、ファイルごとの結果 dict を指定順で返す。
+    結果: {'filename', 'column_error', 'error', 'stats'}
+    （column_error があれば取り込まない。error は途中で失敗したもので、それまでのチャンクは取り込み済み）
+    """
+    if not files:
+        return []
+    shards: "OrderedDict[str, List[int]]" = OrderedDict()
+    for i, (path, _name) in enumerate(files):
+        shards.setdefault(peek_brand(path) or f'__file_{i}', []).append(i)
+
+    n_workers = max(1, min(int(workers or BULK_WORKERS), len(shards)))
+    chunk_rows = max(1, int(chunk_rows or IMPORT_CHUNK_ROWS))
+    if n_workers == 1:
+        return _run_sequential(files, on_file_start, on_file_done, chunk_rows)
+
+    ctx = multiprocessing.get_context(_START_METHOD)
+    tasks = ctx.Queue()
+    results = ctx.Queue()
+    acks = [ctx.Queue() for _ in range(n_workers)]
+    # 大きいシャードから配る（最後に長いシャードが1本だけ残らないように）
+    for key in sorted(shards, key=lambda k: -sum(_file_size(files[i][0]) for i in shards[k])):
+        tasks.put([(i, files[i][0]) for i in shards[key]])
+    for _ in range(n_workers):
+        tasks.put(None)
+    procs = [
+        ctx.Process(target=_worker, args=(wid, models.DB_PATH, chunk_rows, tasks, results, acks[wid]),
+                    name=f'horologen-bulk-{wid}', daemon=True)
+        for wid in range(n_workers)
+    ]
+    for p in procs:
+        p.start()
+
+    out: List[Optional[Dict[str, Any]]] = [None] * len(files)
+    state: Dict[int, Dict[str, Any]] = {}
+    conn = get_db_connection()
+    completed = False
+    try:
+        remaining = len(files)
+        while remaining:
+            msg = _next_message(results, procs)
+            kind, wid, i = msg[:3]
+            name = files[i][1]
+            if kind == 'start':
+                column_error = msg[3]
+                state[i] = {'stats': new_import_stats(), 'upload_id': None, 'column_error': column_error}
+                if on_file_start:
+                    on_file_start(i)
+                if not column_error:
+                    state[i]['upload_id'] = run_write(conn, lambda c: start_upload(c.cursor(), name))
+                continue
+
+            st = state[i]
+            stats = st['stats']
+            if kind == 'chunk':
+                rows, delta, stats['total_rows'], stats['error_count'] = msg[3:]
+                if rows:
+                    apply_rows(conn, rows)
+                for key in ('updated_count', 'inserted_count', 'changed_count', 'override_conflict_count'):
+                    stats[key] += delta[key]
+                stats['sample_diffs'].extend(delta['sample_diffs'])
+                acks[wid].put(1)
+                continue
+
+            # done / failed: パース側の統計を取り込んで確定
+            parsed = msg[3] if kind == 'done' else msg[4]
+            for key in ('total_rows', 'error_count', 'error_details'):
+                stats[key] = parsed[key]
+            error = msg[3] if kind == 'failed' else None
+            _finish(conn, st, 'failed' if error else 'done', error)
+            result = {'filename': name, 'column_error': st['column_error'], 'error': error, 'stats': stats}
+            if st['upload_id']:
+                stats['upload_id'] = st['upload_id']
+            out[i] = result
+            remaining -= 1
+            if on_file_done:
+                on_file_done(i, result)
+        completed = True
+    except BaseException as e:
+        # 適用の失敗・ワーカーの異常終了: 開始済みで結果の出ていないファイルを failed で閉じる
+        conn.rollback()
+        for i, st in state.items():
+            if out[i] is None and not st.get('finished'):
+                try:
+                    _finish(conn, st, 'failed', f'{type(e).__name__}: {e}')
+                except Exception as finish_error:
+                    logger.warning("could not mark upload %s failed: %s", st['upload_id'], finish_error)
+        raise
+    finally:
+        drop_staging(conn)
+        conn.close()
+        for p in procs:
+            # 途中で失敗したときは ack 待ちのワーカーが残るので待たずに止める
+            p.join(timeout=5 if completed else 0)
+            if p.is_alive():
+                p.terminate()
+
+    return out  # type: ignore[return-value]
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _next_message(results, procs) -> tuple:
+    """ワーカーからの次のメッセージ。全ワーカーが異常終了していたら RuntimeError"""
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            if not any(p.is_alive() for p in procs):
+                codes = [p.exitcode for p in procs]
+                raise RuntimeError(f'bulk import workers exited unexpectedly (exitcodes={codes})')
+
+
+def _finish(conn, st: Dict[str, Any], status: str, error: Optional[str]) -> None:
+    if st['upload_id']:
+        run_write(conn, lambda c: finish_upload(c.cursor(), st['upload_id'], st['stats'],
+                                                status=status, error=error))
+    st['finished'] = True
+
+
+def _run_sequential(
+    files: List[BulkFile],
+    on_file_start: Optional[Callable[[int], None]],
+    on_file_done: Optional[Callable[[int, Dict[str, Any]], None]],
+    chunk_rows: int,
+) -> List[Dict[str, Any]]:
+    """ワーカー1本分: このプロセスで1ファイルずつ取り込む（結果は run_bulk_import と同じ形）"""
+    out: List[Dict[str, Any]] = []
+    conn = get_db_connection()
+    try:
+        for i, (path, name) in enumerate(files):
+            stats = new_import_stats()
+            column_error = error = None
+            if on_file_start:
+                on_file_start(i)
+            try:
+                with open(path, 'rb') as f:
+                    reader = open_csv_stream(f)
+                    column_error = check_csv_columns(reader.fieldnames)
+                    if not column_error:
+                        # master_uploads の記録（失敗時の failed も含む）は import_rows が行う
+                        import_rows(conn, iter_csv_rows(reader, stats), name, stats, chunk_rows=chunk_rows)
+            except sqlite3.Error:
+                raise  # DB 側の失敗は並列時と同じく全体を止める
+            except Exception as e:
+                error = 'CSVファイルはUTF-8で保存してください' if isinstance(e, UnicodeDecodeError) else f'{type(e).__name__}: {e}'
+                if 'upload_id' not in stats:
+                    column_error, error = error, None  # ヘッダまでに失敗したもの（取り込まない）
+            result = {'filename': name, 'column_error': column_error, 'error': error, 'stats': stats}
+            out.append(result)
+            if on_file_done:
+                on_file_done(i, result)
+    finally:
+        conn.close()
+    return out
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description='複数CSV / ZIP を一括インポート')
+    ap.add_argument('paths', nargs='+', help='CSV または ZIP')
+    ap.add_argument('--workers', type=int, default=None, help='パース・差分用プロセス数（既定: CPU数）')
+    args = ap.parse_args(argv)
+
+    from models import init_db
+    init_db()
+
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='horologen-bulk-') as workdir:
+        files = expand_inputs([(p, os.path.basename(p)) for p in args.paths], workdir)
+        if not files:
+            print('CSVファイルがありません', file=sys.stderr)
+            return 1
+        results = run_bulk_import(files, workers=args.workers)
+
+    failed = 0
+    for r in results:
+        st = r['stats']
+        if r['column_error'] or r['error']:
+            failed += 1
+            print(f"NG  {r['filename']}: {r['column_error'] or r['error']}")
+            continue
+        print(
+            f"OK  {r['filename']}: 総行数={st['total_rows']}, 新規={st['inserted_count']}, "
+            f"更新={st['updated_count']}, エラー={st['error_count']}, 変更={st['changed_count']}, "
+            f"オーバーライド競合={st['override_conflict_count']}"
+        )
+    print(f'{len(results)} files in {time.perf_counter() - t0:.2f}s')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from models import PRODUCT_FIELDS, overridden_fields_from_mask
+
+# ----------------------------
+# Canonical spec resolver
+#   - 正規スペック = フィールドごとに「オーバーライドが空でなければオーバーライド、なければマスタ」
+#   - 値は canonical_products（トリガーで維持）から1行で読む
+#   - 編集フォーム用のマスタ / オーバーライドの生の行は with_sources=True のときだけ読む
+#   - (brand, reference) 単位の LRU キャッシュ（プロセス内）
+#   - save_override / delete_override / CSV インポートで該当キーだけ無効化
+#   - 別プロセス（bulk_import CLI など）からの書き込みは TTL で追従
+# ----------------------------
+CANONICAL_CACHE_SIZE = int(os.getenv("HOROLOGEN_CANONICAL_CACHE_SIZE", "4096"))
+CANONICAL_CACHE_TTL_SEC = float(os.getenv("HOROLOGEN_CANONICAL_CACHE_TTL_SEC", "300"))
+
+Key = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class CanonicalSpec:
+    brand: str
+    reference: str
+    canonical: Dict[str, str] = field(default_factory=dict)
+    overridden_fields: FrozenSet[str] = frozenset()
+    has_master: bool = False
+    has_override: bool = False
+    editor_note: str = ''
+    # with_sources=True で読んだ場合のみ（それ以外は None）
+    master: Optional[Dict[str, Any]] = None
+    override: Optional[Dict[str, Any]] = None
+    sources_loaded: bool = False
+
+
+def load_canonical(conn, brand: str, reference: str, with_sources: bool = False) -> CanonicalSpec:
+    """キャッシュを通さず DB から組み立てる"""
+    row = conn.execute(
+        'SELECT * FROM canonical_products WHERE brand = ? AND reference = ?',
+        (brand, reference)
+    ).fetchone()
+
+    master = override = None
+    if with_sources and row:
+        if row['has_master']:
+            master = conn.execute('''
+                SELECT * FROM master_products
+                WHERE brand = ? AND reference = ?
+            ''', (brand, reference)).fetchone()
+        if row['has_override']:
+            override = conn.execute('''
+                SELECT * FROM product_overrides
+                WHERE brand = ? AND reference = ?
+            ''', (brand, reference)).fetchone()
+
+    return CanonicalSpec(
+        brand=brand,
+        reference=reference,
+        canonical={f: (row[f] if row else '') for f in PRODUCT_FIELDS},
+        overridden_fields=overridden_fields_from_mask(row['overridden_mask']) if row else frozenset(),
+        has_master=bool(row and row['has_master']),
+        has_override=bool(row and row['has_override']),
+        editor_note=(row['editor_note'] if row else '') or '',
+        master=dict(master) if master else None,
+        override=dict(override) if override else None,
+        sources_loaded=with_sources,
+    )
+
+
+class _CanonicalCache:
+    def __init__(self, maxsize: int, ttl_sec: float):
+        self.maxsize = max(0, maxsize)
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Key, Tuple[float, CanonicalSpec]]" = OrderedDict()
+        # 無効化のたびに進める。読み込み中に無効化が挟まった結果はキャッシュしない
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Key) -> Tuple[Optional[CanonicalSpec], int]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl_sec:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], self._epoch
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None, self._epoch
+
+    def put(self, key: Key, spec: CanonicalSpec, epoch: int) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._entries[key] = (time.monotonic(), spec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys: Iterable[Key]) -> None:
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_sec': self.ttl_sec,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+_cache = _CanonicalCache(CANONICAL_CACHE_SIZE, CANONICAL_CACHE_TTL_SEC)
+
+
+def resolve_canonical(conn, brand: str, reference: str, with_sources: bool = False) -> CanonicalSpec:
+    """
+    (brand, reference) の正規スペックを返す（キャッシュ優先）。
+    with_sources=True なら編集フォーム用に master / override の行も付ける。
+    canonical dict は呼び出しごとのコピーなので、payload に入れて加工してもキャッシュは汚れない。
+    """
+    key = (brand, reference)
+    spec, epoch = _cache.get(key)
+    if spec is None or (with_sources and not spec.sources_loaded):
+        spec = load_canonical(conn, brand, reference, with_sources=with_sources)
+        _cache.put(key, spec, epoch)
+    return replace(spec, canonical=dict(spec.canonical))
+
+
+def invalidate_canonical(brand: str, reference: str) -> None:
+    _cache.invalidate([(brand, reference)])
+
+
+def invalidate_canonical_many(keys: Iterable[Key]) -> None:
+    _cache.invalidate(keys)
+
+
+def clear_canonical_cache() -> None:
+    _cache.clear()
+
+
+def canonical_cache_stats() -> Dict[str, Any]:
+    return _cache.stats()
@@ -0,0 +1,417 @@
+import csv
+import io
+import json
+import os
+import sqlite3
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from models import REQUIRED_CSV_COLUMNS, PRODUCT_FIELDS, readonly_uri, run_write, write_with_canonical_sync
+from canonical import invalidate_canonical_many
+
+# ----------------------------
+# CSV import engine（セットベース）
+#   1) パース済みの行を TEMP テーブルへ executemany で投入
+#   2) 新規/更新/差分/オーバーライド競合を SQL の JOIN でまとめて算出
+#   3) master_products への UPSERT を1文で適用
+#   4) canonical_products と全文索引もチャンクのキーについて set-based に反映（行ごとのトリガーは止める）
+# ----------------------------
+SAMPLE_DIFFS_LIMIT = 10
+
+# error_details に残す行数（それ以降は error_count だけ数える。エラーだらけの巨大ファイルでもメモリは一定）
+ERROR_DETAILS_LIMIT = int(os.getenv("HOROLOGEN_IMPORT_ERROR_DETAILS_LIMIT", "100"))
+
+# 1チャンク（= 1 commit）あたりの行数
+IMPORT_CHUNK_ROWS = int(os.getenv("HOROLOGEN_IMPORT_CHUNK_ROWS", "5000"))
+
+_COLS = ['brand', 'reference'] + PRODUCT_FIELDS
+
+# (row_num, brand, reference, *PRODUCT_FIELDS の値)
+StagedRow = Tuple[Any, ...]
+
+
+def check_csv_columns(fieldnames: Optional[List[str]]) -> str:
+    """ヘッダ検証。問題があればエラーメッセージを返す（問題なしは空文字）"""
+    if fieldnames is None:
+        return 'CSVファイルが空です'
+
+    csv_columns = [(col or '').strip() for col in fieldnames]
+
+    missing_columns = set(REQUIRED_CSV_COLUMNS) - set(csv_columns)
+    if missing_columns:
+        return f'必須カラムが不足しています: {", ".join(sorted(missing_columns))}'
+
+    extra_columns = set(csv_columns) - set(REQUIRED_CSV_COLUMNS)
+    if extra_columns:
+        return f'不正なカラムが含まれています: {", ".join(sorted(extra_columns))}。インポートを停止します。'
+
+    return ''
+
+
+def new_import_stats() -> Dict[str, Any]:
+    return {
+        'total_rows': 0,
+        'inserted_count': 0,
+        'updated_count': 0,
+        'error_count': 0,
+        'error_details': [],
+        'changed_count': 0,
+        'override_conflict_count': 0,
+        'sample_diffs': [],
+    }
+
+
+def _add_error(stats: Dict[str, Any], message: str) -> None:
+    stats['error_count'] += 1
+    if len(stats['error_details']) < ERROR_DETAILS_LIMIT:
+        stats['error_details'].append(message)
+
+
+def iter_csv_rows(reader: Iterable[Dict[str, Any]], stats: Dict[str, Any]) -> Iterator[StagedRow]:
+    """
+    csv.DictReader から (row_num, brand, reference, *fields) のタプルを返す。
+    brand / reference が空の行は stats のエラーに計上してスキップ。
+    """
+    if isinstance(reader, csv.DictReader):
+        yield from _iter_positional(reader, stats)
+        return
+
+    for row_num, row in enumerate(reader, start=2):
+        stats['total_rows'] += 1
+        row = {(k or '').strip(): (v.strip() if isinstance(v, str) else '') for k, v in row.items()}
+
+        brand = row.get('brand', '')
+        reference = row.get('reference', '')
+
+        if not brand or not reference:
+            _add_error(stats, f'行{row_num}: brandまたはreferenceが空です')
+            continue
+
+        yield (row_num, brand, reference, *(row.get(f, '') for f in PRODUCT_FIELDS))
+
+
+def _iter_positional(reader: csv.DictReader, stats: Dict[str, Any]) -> Iterator[StagedRow]:
+    """DictReader と同じ解釈のまま、行ごとの dict 生成を省いた高速パス"""
+    header = [(col or '').strip() for col in (reader.fieldnames or [])]
+    pos = {name: i for i, name in enumerate(header)}  # 重複ヘッダは DictReader 同様に後勝ち
+    idx = [pos[c] for c in _COLS]
+
+    row_num = 1
+    for values in reader.reader:
+        if not values:
+            continue  # DictReader は空行を読み飛ばす
+        row_num += 1
+        stats['total_rows'] += 1
+        n = len(values)
+        out = tuple(values[i].strip() if i < n else '' for i in idx)
+
+        if not out[0] or not out[1]:
+            _add_error(stats, f'行{row_num}: brandまたはreferenceが空です')
+            continue
+
+        yield (row_num, *out)
+
+
+# ----------------------------
+# SQL（フィールド一覧から組み立て）
+# ----------------------------
+_STAGING_DDL = (
+    'CREATE TEMP TABLE IF NOT EXISTS import_staging ('
+    'row_num INTEGER PRIMARY KEY, brand TEXT NOT NULL, reference TEXT NOT NULL, '
+    + ', '.join(f'{f} TEXT' for f in PRODUCT_FIELDS)
+    + ')'
+)
+
+_STAGING_INDEX_DDL = (
+    'CREATE INDEX IF NOT EXISTS temp.idx_import_staging_key '
+    'ON import_staging (brand, reference, row_num)'
+)
+
+_STAGING_INSERT = (
+    'INSERT INTO temp.import_staging (row_num, ' + ', '.join(_COLS) + ') '
+    'VALUES (?, ' + ', '.join('?' for _ in _COLS) + ')'
+)
+
+# 同一CSV内で同じ (brand, reference) が複数回出る場合は、直前の行を「既存」とみなす
+# （行ごとに UPSERT していた従来ロジックと同じ統計になる）
+_OLD = {f: f'(CASE WHEN p.row_num IS NOT NULL THEN p.{f} ELSE m.{f} END)' for f in PRODUCT_FIELDS}
+
+def _diff_select(with_values: bool) -> str:
+    values = ''
+    if with_values:
+        values = ', ' + ', '.join(
+            f"IFNULL({_OLD[f]}, '') AS old_{f}, IFNULL(st.{f}, '') AS new_{f}" for f in PRODUCT_FIELDS
+        )
+    return (
+        'SELECT st.row_num AS row_num, st.brand AS brand, st.reference AS reference, '
+        '(p.row_num IS NOT NULL OR m.id IS NOT NULL) AS existed, '
+        '(o.id IS NOT NULL) AS override_exists, '
+        '((p.row_num IS NOT NULL OR m.id IS NOT NULL) AND ('
+        + ' OR '.join(f"IFNULL({_OLD[f]}, '') <> IFNULL(st.{f}, '')" for f in PRODUCT_FIELDS)
+        + ')) AS changed'
+        + values
+        + ' FROM temp.import_staging st'
+        ' LEFT JOIN temp.import_staging p ON p.row_num = ('
+        '   SELECT MAX(p2.row_num) FROM temp.import_staging p2'
+        '   WHERE p2.brand = st.brand AND p2.reference = st.reference AND p2.row_num < st.row_num)'
+        ' LEFT JOIN master_products m ON m.brand = st.brand AND m.reference = st.reference'
+        ' LEFT JOIN product_overrides o ON o.brand = st.brand AND o.reference = st.reference'
+    )
+
+
+_DIFF_COUNTS = (
+    'SELECT COUNT(*) AS staged, '
+    'IFNULL(SUM(existed), 0) AS updated, '
+    'IFNULL(SUM(changed), 0) AS changed, '
+    'IFNULL(SUM(changed AND override_exists), 0) AS conflicts '
+    'FROM (' + _diff_select(with_values=False) + ')'
+)
+
+# 行ごとの既存/変更/オーバーライド有無（bulk_import のワーカーが書き込む行を選ぶのに使う）
+_DIFF_ROWS = _diff_select(with_values=False)
+
+_DIFF_SAMPLES = (
+    'SELECT * FROM (' + _diff_select(with_values=True) + ') WHERE changed ORDER BY row_num LIMIT ?'
+)
+
+# 各キーの最終行だけを1文で UPSERT（WHERE 句は ON CONFLICT の構文上必須）
+_UPSERT = (
+    'INSERT INTO master_products (' + ', '.join(_COLS) + ', updated_at) '
+    'SELECT ' + ', '.join(_COLS) + ', CURRENT_TIMESTAMP FROM temp.import_staging '
+    'WHERE row_num IN (SELECT MAX(row_num) FROM temp.import_staging GROUP BY brand, reference) '
+    'ON CONFLICT(brand, reference) DO UPDATE SET '
+    + ', '.join(f'{f} = excluded.{f}' for f in PRODUCT_FIELDS)
+    + ', updated_at = CURRENT_TIMESTAMP'
+)
+
+
+# canonical_products / 全文索引をまとめて反映するキー（行ごとのトリガーの代わり）
+_STAGED_KEYS = 'SELECT DISTINCT brand, reference FROM temp.import_staging'
+
+
+def _stage_rows(cursor, rows: Iterable[StagedRow]) -> None:
+    cursor.execute('DELETE FROM temp.import_staging')
+    cursor.executemany(
+        _STAGING_INSERT,
+        rows
+    )
+
+
+def _diff_staged(cursor, sample_room: int) -> Dict[str, Any]:
+    """ステージ済みチャンクの統計（差分）を返す。stats への反映は commit 成功後に呼び元で行う"""
+    counts = cursor.execute(_DIFF_COUNTS).fetchone()
+    staged, updated, changed, conflicts = (int(v or 0) for v in counts)
+
+    delta = {
+        'updated_count': updated,
+        'inserted_count': staged - updated,
+        'changed_count': changed,
+        'override_conflict_count': conflicts,
+        'sample_diffs': [],
+    }
+    if sample_room <= 0 or not changed:
+        return delta
+    delta['sample_diffs'] = _sample_diffs(cursor, sample_room)
+    return delta
+
+
+def _sample_diffs(cursor, sample_room: int) -> List[Dict[str, Any]]:
+    samples = []
+    for r in cursor.execute(_DIFF_SAMPLES, (sample_room,)).fetchall():
+        row_diffs = []
+        for f in PRODUCT_FIELDS:
+            old_value = r[f'old_{f}']
+            new_value = r[f'new_{f}']
+            if old_value != new_value:
+                diff_info = {'field': f, 'old': old_value, 'new': new_value}
+                if r['override_exists']:
+                    diff_info['override_exists'] = True
+                row_diffs.append(diff_info)
+        samples.append({
+            'brand': r['brand'],
+            'reference': r['reference'],
+            'diffs': row_diffs
+        })
+    return samples
+
+
+def open_diff_connection(db_path: str):
+    """
+    差分算出だけをする読み取り専用の接続（bulk_import のワーカープロセス用）。
+    TEMP の import_staging は接続ごとなので、ライターの接続とは干渉しない
+    """
+    conn = sqlite3.connect(readonly_uri(db_path), uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute(_STAGING_DDL)
+    conn.execute(_STAGING_INDEX_DDL)
+    return conn
+
+
+def diff_chunk(conn, chunk: List[StagedRow], sample_room: int) -> Tuple[Dict[str, Any], List[StagedRow]]:
+    """
+    open_diff_connection の接続で chunk の差分を出し、(delta, 書き込みが必要な行) を返す。
+    書き込みが必要なのは新規の行と値が変わる行だけ（変わらない行を UPSERT しても結果は同じ）。
+    同じキーの先行チャンクがライターで commit 済みであることが前提
+    """
+    cursor = conn.cursor()
+    _stage_rows(cursor, chunk)
+    staged = updated = changed = conflicts = 0
+    write_rows = set()
+    for r in cursor.execute(_DIFF_ROWS):
+        staged += 1
+        updated += r['existed']
+        if r['changed']:
+            changed += 1
+            conflicts += r['override_exists']
+        if r['changed'] or not r['existed']:
+            write_rows.add(r['row_num'])
+    delta = {
+        'updated_count': updated,
+        'inserted_count': staged - updated,
+        'changed_count': changed,
+        'override_conflict_count': conflicts,
+        'sample_diffs': _sample_diffs(cursor, sample_room) if changed and sample_room > 0 else [],
+    }
+    conn.commit()
+    return delta, [r for r in chunk if r[0] in write_rows]
+
+
+def apply_rows(conn, rows: List[StagedRow]) -> None:
+    """diff_chunk 済みの行を UPSERT する（bulk_import の単一ライター用。差分はここでは出さない）"""
+    def _apply(c) -> None:
+        cursor = c.cursor()
+        cursor.execute(_STAGING_DDL)
+        cursor.execute(_STAGING_INDEX_DDL)
+        _stage_rows(cursor, rows)
+        c.commit()
+        cursor.execute('BEGIN IMMEDIATE')
+        write_with_canonical_sync(cursor, _UPSERT, _STAGED_KEYS)
+
+    run_write(conn, _apply)
+    invalidate_canonical_many((r[1], r[2]) for r in rows)
+
+
+def drop_staging(conn) -> None:
+    try:
+        conn.execute('DROP TABLE IF EXISTS temp.import_staging')
+    except Exception:
+        pass
+
+
+def _apply_chunk(conn, chunk: List[StagedRow], sample_room: int) -> Dict[str, Any]:
+    cursor = conn.cursor()
+    # TEMP テーブルへの投入は main DB のロックを取らないので、先に確定させておく
+    _stage_rows(cursor, chunk)
+    conn.commit()
+    # 差分の読み取り前に書き込みロックを取る（WAL で読み取り後に昇格すると
+    # 他の書き込みが挟まった時点で busy_timeout を待たずに失敗するため）
+    cursor.execute('BEGIN IMMEDIATE')
+    delta = _diff_staged(cursor, sample_room)
+    write_with_canonical_sync(cursor, _UPSERT, _STAGED_KEYS)
+    return delta
+
+
+def start_upload(cursor, filename: str) -> int:
+    """取込開始時に master_uploads へ status = 'running' の行を作って id を返す"""
+    cursor.execute(
+        "INSERT INTO master_uploads (filename, total_rows, inserted_count, updated_count, error_count, status) "
+        "VALUES (?, 0, 0, 0, 0, 'running')",
+        (filename,)
+    )
+    return cursor.lastrowid
+
+
+def finish_upload(cursor, upload_id: int, stats: Dict[str, Any], status: str = 'done',
+                  error: Optional[str] = None) -> None:
+    """
+    master_uploads の行に統計を書いて status を確定する。
+    failed の場合の件数は commit 済みのチャンクまで（取り込まれた行と一致する）
+    """
+    error_details = list(stats['error_details'])
+    omitted = stats['error_count'] - len(error_details)
+    if omitted > 0:
+        error_details.append(f'ほか {omitted} 件')
+    sample_diffs = stats['sample_diffs']
+    error_details_str = '\n'.join(error_details) if error_details else ''
+    sample_diffs_str = json.dumps(sample_diffs, ensure_ascii=False) if sample_diffs else None
+
+    cursor.execute('''
+        UPDATE master_uploads SET
+            total_rows = ?, inserted_count = ?, updated_count = ?, error_count = ?, error_details = ?,
+            changed_count = ?, override_conflict_count = ?, sample_diffs = ?, status = ?, error = ?
+        WHERE id = ?
+    ''', (
+        stats['total_rows'], stats['inserted_count'], stats['updated_count'],
+        stats['error_count'], error_details_str,
+        stats['changed_count'], stats['override_conflict_count'], sample_diffs_str, status, error,
+        upload_id
+    ))
+
+
+def import_csv(conn, reader: Iterable[Dict[str, Any]], filename: str,
+               chunk_rows: Optional[int] = None,
+               progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    CSV（DictReader）を master_products に取り込み、master_uploads に結果を記録する。
+    chunk_rows 行ごとに差分算出・UPSERT・commit するため、ファイルサイズに関係なくメモリは一定。
+    progress を渡すと、各チャンクの commit 後に途中経過の stats で呼ばれる。
+    戻り値は統計 dict（error_details / sample_diffs は list のまま）。
+    """
+    stats = new_import_stats()
+    return import_rows(conn, iter_csv_rows(reader, stats), filename, stats,
+                       chunk_rows=chunk_rows, progress=progress)
+
+
+def import_rows(conn, rows: Iterable[StagedRow], filename: str, stats: Dict[str, Any],
+                chunk_rows: Optional[int] = None,
+                progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    パース済みの行（iter_csv_rows の出力）を取り込む。
+    stats には行数・パースエラーが計上済みである前提（bulk_import が別プロセスでパースする場合に使う）。
+    """
+    chunk_rows = max(1, int(chunk_rows or IMPORT_CHUNK_ROWS))
+    cursor = conn.cursor()
+    rows = iter(rows)
+    # チャンクごとに commit するので、途中で失敗しても取り込まれた行の記録が残るよう先に作る
+    upload_id = run_write(conn, lambda c: start_upload(c.cursor(), filename))
+    stats['upload_id'] = upload_id
+    try:
+        cursor.execute(_STAGING_DDL)
+        cursor.execute(_STAGING_INDEX_DDL)
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                break
+            # ロック競合時はチャンク単位でやり直す（stats は commit 後に加算）
+            delta = run_write(conn, _apply_chunk, chunk, SAMPLE_DIFFS_LIMIT - len(stats['sample_diffs']))
+            invalidate_canonical_many((r[1], r[2]) for r in chunk)
+            for key in ('updated_count', 'inserted_count', 'changed_count', 'override_conflict_count'):
+                stats[key] += delta[key]
+            stats['sample_diffs'].extend(delta['sample_diffs'])
+            if progress:
+                progress(stats)
+
+        run_write(conn, lambda c: finish_upload(c.cursor(), upload_id, stats))
+    except Exception as e:
+        conn.rollback()
+        try:
+            run_write(conn, lambda c: finish_upload(c.cursor(), upload_id, stats, status='failed',
+                                                    error=f'{type(e).__name__}: {e}'))
+        except Exception:
+            pass
+        raise
+    finally:
+        try:
+            cursor.execute('DROP TABLE IF EXISTS temp.import_staging')
+        except Exception:
+            pass
+    return stats
+
+
+def open_csv_stream(binary_stream) -> csv.DictReader:
+    """
+    アップロードされたバイナリストリームを逐次デコードして DictReader を返す。
+    ファイル全体を read() / decode() しない。
+    """
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    return csv.DictReader(text_stream)
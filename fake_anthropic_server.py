@@ -0,0 +1,270 @@
+"""
+ローカル確認用の Anthropic API 互換サーバ（Messages / Message Batches の必要な部分だけ）
+
+    python fake_anthropic_server.py --port 8765 --batch-delay 5
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=dummy python generation_batches.py submit --brand omega --wait
+
+- POST /v1/messages                      return_article の tool_use を返す（usage はキャッシュ区切りをまねて数える）
+                                         stream: true なら input_json_delta で少しずつ送る
+                                         --no-tool-every N で N 回ごとに tool_use の無いテキスト応答
+- POST /v1/messages/batches              受け付けて in_progress
+                                         --lose-create-every N で N 回ごとに受け付けたまま応答せずに切断
+- GET  /v1/messages/batches              一覧（新しい順、limit / after_id）
+- GET  /v1/messages/batches/<id>         --batch-delay 秒後に ended
+- GET  /v1/messages/batches/<id>/results JSONL（--fail-every N で N 件ごとに errored）
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlparse
+
+_lock = threading.Lock()
+_batches: Dict[str, Dict[str, Any]] = {}
+_cached_prefixes = set()
+_message_count = [0]
+_create_count = [0]
+
+
+def _cache_usage(params: Dict[str, Any]) -> Dict[str, int]:
+    """
+    プロンプトキャッシュのまね。cache_control の付いたブロックまでの前置き（tools → system → messages）
+    を覚えておき、最長一致を read、新しい区切りを creation として数える（トークン数は文字数 / 2 の概算）
+    """
+    parts = [json.dumps(params.get("tools", []), ensure_ascii=False)]
+    prefixes = []
+    system = params.get("system") or []
+    blocks = [system] if isinstance(system, str) else list(system)
+    for m in params.get("messages", []):
+        content = m.get("content")
+        blocks += [content] if isinstance(content, str) else list(content or [])
+    for b in blocks:
+        parts.append(b if isinstance(b, str) else b.get("text", ""))
+        if isinstance(b, dict) and b.get("cache_control"):
+            prefixes.append("".join(parts))
+    total = len("".join(parts)) // 2
+    read = creation = 0
+    with _lock:
+        for p in prefixes:
+            if p in _cached_prefixes:
+                read = len(p) // 2
+            else:
+                _cached_prefixes.add(p)
+                creation = len(p) // 2 - read
+    return {"input_tokens": max(0, total - read - creation),
+            "cache_creation_input_tokens": max(0, creation), "cache_read_input_tokens": read}
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _text_message(params: Dict[str, Any]) -> Dict[str, Any]:
+    """tool を使わずに返した応答（構造化出力の取り直しの確認用）"""
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake"),
+        "content": [{"type": "text", "text": "承知しました。紹介文を作成します。"}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {**_cache_usage(params), "output_tokens": 12},
+    }
+
+
+def _fake_message(params: Dict[str, Any], n: int) -> Dict[str, Any]:
+    prompt = json.dumps(params.get("messages", []), ensure_ascii=False)
+    m = re.search(r"(?:reference|型番)[^A-Za-z0-9]{0,20}([A-Za-z0-9][A-Za-z0-9.\-_/]{3,})", prompt)
+    ref = m.group(1) if m else f"#{n}"
+    article = {
+        "intro_text": f"{ref} の紹介文（テスト用の固定文です）。ケースとムーブメントの特徴を落ち着いた文体でまとめています。",
+        "specs_text": f"・リファレンス：{ref}\n・ムーブメント：自動巻き",
+    }
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake"),
+        "content": [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                     "name": "return_article", "input": article}],
+        "stop_reason": "tool_use",
+        "stop_sequence": None,
+        "usage": {**_cache_usage(params), "output_tokens": 300},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "FakeAnthropic/1.0"
+    batch_delay = 5.0
+    fail_every = 0
+    no_tool_every = 0
+    lose_create_every = 0
+    stream_delay = 0.02
+
+    def log_message(self, fmt, *args):  # noqa: D401  アクセスログは出さない
+        pass
+
+    def _json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def _batch_view(self, b: Dict[str, Any]) -> Dict[str, Any]:
+        ended = time.time() - b["created"] >= self.batch_delay
+        n = len(b["requests"])
+        failed = sum(1 for i in range(n) if self.fail_every and (i + 1) % self.fail_every == 0)
+        host = self.headers.get("Host", "127.0.0.1")
+        return {
+            "id": b["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else n,
+                "succeeded": n - failed if ended else 0,
+                "errored": failed if ended else 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": _iso(b["created"]),
+            "expires_at": _iso(b["created"] + 86400),
+            "ended_at": _iso(b["created"] + self.batch_delay) if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"http://{host}/v1/messages/batches/{b['id']}/results" if ended else None,
+        }
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.startswith("/v1/messages/batches"):
+            batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+            with _lock:
+                _batches[batch_id] = {"id": batch_id, "created": time.time(), "requests": body.get("requests", [])}
+                view = self._batch_view(_batches[batch_id])
+                _create_count[0] += 1
+                lose = self.lose_create_every and _create_count[0] % self.lose_create_every == 0
+            if lose:
+                # batch はできたが応答が届かない（送信側のタイムアウト・切断をまねる）
+                self.close_connection = True
+                return
+            return self._json(200, view)
+        if self.path.startswith("/v1/messages"):
+            with _lock:
+                _message_count[0] += 1
+                no_tool = self.no_tool_every and _message_count[0] % self.no_tool_every == 0
+            message = _text_message(body) if no_tool else _fake_message(body, 0)
+            if body.get("stream"):
+                return self._stream(message)
+            return self._json(200, message)
+        return self._json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+    def _stream(self, message: Dict[str, Any]) -> None:
+        """messages.stream 用の SSE。tool 入力は少しずつ input_json_delta で送る"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def send(event: str, data: Dict[str, Any]) -> None:
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        block = message["content"][0]
+        usage = message["usage"]
+        send("message_start", {"type": "message_start", "message": {
+            **message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 1}}})
+        if block["type"] == "tool_use":
+            send("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {
+                "type": "tool_use", "id": block["id"], "name": block["name"], "input": {}}})
+            raw, delta_type, key = json.dumps(block["input"], ensure_ascii=False), "input_json_delta", "partial_json"
+        else:
+            send("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {
+                "type": "text", "text": ""}})
+            raw, delta_type, key = block["text"], "text_delta", "text"
+        for i in range(0, len(raw), 7):
+            send("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {
+                "type": delta_type, key: raw[i:i + 7]}})
+            time.sleep(self.stream_delay)
+        send("content_block_stop", {"type": "content_block_stop", "index": 0})
+        send("message_delta", {"type": "message_delta", "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                               "usage": {"output_tokens": usage["output_tokens"]}})
+        send("message_stop", {"type": "message_stop"})
+
+    def _list_batches(self) -> None:
+        query = parse_qs(urlparse(self.path).query)
+        limit = int((query.get("limit") or ["20"])[0])
+        after_id = (query.get("after_id") or [""])[0]
+        with _lock:
+            ordered = sorted(_batches.values(), key=lambda b: b["created"], reverse=True)
+            if after_id:
+                ids = [b["id"] for b in ordered]
+                ordered = ordered[ids.index(after_id) + 1:] if after_id in ids else []
+            page = [self._batch_view(b) for b in ordered[:limit]]
+        self._json(200, {
+            "data": page,
+            "has_more": len(ordered) > limit,
+            "first_id": page[0]["id"] if page else None,
+            "last_id": page[-1]["id"] if page else None,
+        })
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/v1/messages/batches":
+            return self._list_batches()
+        m = re.match(r"^/v1/messages/batches/([^/?]+)(/results)?", self.path)
+        with _lock:
+            b = _batches.get(m.group(1)) if m else None
+        if b is None:
+            return self._json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+        if not m.group(2):
+            return self._json(200, self._batch_view(b))
+
+        lines = []
+        for i, req in enumerate(b["requests"]):
+            if self.fail_every and (i + 1) % self.fail_every == 0:
+                result = {"type": "errored", "error": {"type": "error", "error": {
+                    "type": "overloaded_error", "message": "fake overloaded"}}}
+            else:
+                result = {"type": "succeeded", "message": _fake_message(req.get("params", {}), i)}
+            lines.append(json.dumps({"custom_id": req.get("custom_id"), "result": result}, ensure_ascii=False))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--batch-delay', type=float, default=5.0, help='バッチが ended になるまでの秒数')
+    ap.add_argument('--fail-every', type=int, default=0, help='N 件ごとに errored を返す（0 = 全件成功）')
+    ap.add_argument('--no-tool-every', type=int, default=0,
+                    help='/v1/messages の N 回ごとに tool_use の無い応答を返す（0 = 常に tool_use）')
+    ap.add_argument('--lose-create-every', type=int, default=0,
+                    help='バッチ作成の N 回ごとに、受け付けたまま応答せずに切断する（0 = しない）')
+    args = ap.parse_args()
+
+    Handler.lose_create_every = args.lose_create_every
+    Handler.batch_delay = args.batch_delay
+    Handler.fail_every = args.fail_every
+    Handler.no_tool_every = args.no_tool_every
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+    print(f'fake anthropic on http://127.0.0.1:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,608 @@
+"""
+Message Batches API での一括記事生成
+
+    python generation_batches.py submit --brand omega --wait
+    python generation_batches.py submit --brand omega --collection Seamaster --tone luxury
+    python generation_batches.py submit --csv refs.csv --brand omega   # 列: reference（brand 列があればそちらを優先）
+    python generation_batches.py status 12
+    python generation_batches.py collect 12 --wait
+
+- 対象ごとに単発生成と同じ手順で payload を作る（URL自動発見 → 正規スペック → build_payload → prepare_article）
+- リクエストはまとめて messages.batches.create に投げ、結果は回収時に generated_articles へ保存
+- クォータはバッチ登録と同じトランザクションで件数分まとめて消費（足りなければバッチごと拒否）。
+  生成できなかった分は回収完了時にまとめて返却する
+- 言い換え再生成は行わない（rewrite_mode="none" 相当）。必要なら生成後に画面から1回ずつ
+- 送信前に status = submitting と submit_token（custom_id の先頭）を保存してから batches.create を呼ぶ。
+  送信の途中で落ちたり応答が失われたりしたら、batches.list から custom_id の先頭が一致する batch を探して
+  それを使う（送り直さない）。API 側に無いと確認できたときだけ準備からやり直す
+- ローカル確認は fake_anthropic_server.py に ANTHROPIC_BASE_URL を向ける（smoke_batches.py で一通り実行）
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from generation_jobs import annotate_payload, insert_generated_article, payload_fingerprint
+from models import get_db_connection, run_write
+from quota import charge_quota, refund_quota, month_key_jst
+
+BATCH_PREPARE_WORKERS = int(os.getenv("HOROLOGEN_BATCH_PREPARE_WORKERS", "4"))
+BATCH_POLL_SEC = float(os.getenv("HOROLOGEN_BATCH_POLL_SEC", "30"))
+BATCH_MAX_ITEMS = int(os.getenv("HOROLOGEN_BATCH_MAX_ITEMS", "500"))
+# batches.list で送信済みの batch を探すとき、submit_started_at よりこれだけ前から見る（時計のずれ）
+BATCH_RECONCILE_SKEW_SEC = float(os.getenv("HOROLOGEN_BATCH_RECONCILE_SKEW_SEC", "300"))
+# submitting のままこれより経ち、API 側にも無ければ送信は届かなかったとみなして準備からやり直す（回収時）
+BATCH_SUBMIT_STALE_SEC = float(os.getenv("HOROLOGEN_BATCH_SUBMIT_STALE_SEC", "900"))
+
+logger = logging.getLogger(__name__)
+
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# バッチ準備（ページ取得を含むので数分かかる）を画面から投げたとき用
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="horologen-batch")
+
+class BatchRejected(Exception):
+    """対象なし・クォータ不足などで登録前に弾いたもの（メッセージは画面表示用）"""
+
+
+# ----------------------------
+# 対象の選択
+# ----------------------------
+def select_references(conn, brand: str, collection: str = "") -> List[Tuple[str, str]]:
+    sql = "SELECT brand, reference FROM canonical_products WHERE brand = ?"
+    params: List[Any] = [brand]
+    if collection:
+        sql += " AND collection = ?"
+        params.append(collection)
+    sql += " ORDER BY reference"
+    return [(r["brand"], r["reference"]) for r in conn.execute(sql, params)]
+
+
+def read_reference_csv(binary_stream, default_brand: str = "") -> List[Tuple[str, str]]:
+    """reference 列（必須）と brand 列（任意、無ければ default_brand）"""
+    from csv_import import open_csv_stream
+
+    reader = open_csv_stream(binary_stream)
+    columns = [(c or "").strip() for c in (reader.fieldnames or [])]
+    if "reference" not in columns:
+        raise BatchRejected("CSVに reference 列がありません")
+    out = []
+    for row in reader:
+        row = {(k or "").strip(): (v or "").strip() for k, v in row.items()}
+        brand = row.get("brand") or default_brand
+        if brand and row.get("reference"):
+            out.append((brand, row["reference"]))
+    return out
+
+
+# ----------------------------
+# 登録（クォータ消費と同じトランザクション）
+# ----------------------------
+def create_batch(targets: List[Tuple[str, str]], source: str, options: Dict[str, Any]) -> int:
+    targets = list(dict.fromkeys(targets))
+    if not targets:
+        raise BatchRejected("対象の商品がありません")
+    if len(targets) > BATCH_MAX_ITEMS:
+        raise BatchRejected(f"1バッチの上限（{BATCH_MAX_ITEMS}件）を超えています: {len(targets)}件")
+
+    mk = month_key_jst()
+
+    def _create(c) -> Optional[int]:
+        c.execute("BEGIN IMMEDIATE")
+        if not charge_quota(c, len(targets), mk):
+            return None
+        batch_id = c.execute(
+            "INSERT INTO generation_batches (source, options_json, total, quota_month, quota_charged) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (source, json.dumps(options, ensure_ascii=False), len(targets), mk, len(targets))
+        ).lastrowid
+        c.executemany(
+            "INSERT INTO generation_batch_items (batch_id, brand, reference) VALUES (?, ?, ?)",
+            [(batch_id, b, r) for b, r in targets]
+        )
+        return batch_id
+
+    conn = get_db_connection()
+    try:
+        batch_id = run_write(conn, _create)
+    finally:
+        conn.close()
+    if batch_id is None:
+        raise BatchRejected(f"今月の生成回数の残りが足りません（{len(targets)}件）")
+    return batch_id
+
+
+# ----------------------------
+# 準備 + 送信
+# ----------------------------
+def _prepare_item(item_id: int, brand: str, reference: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    import llm_client as llmc
+    from canonical import resolve_canonical
+    from url_discovery import discover_reference_urls
+
+    conn = get_db_connection()
+    try:
+        urls, _debug = discover_reference_urls(brand, reference, max_urls=3, conn=conn)
+        spec = resolve_canonical(conn, brand, reference)
+    finally:
+        conn.close()
+
+    payload = llmc.build_payload(
+        brand, reference, spec.canonical, spec.editor_note, urls[:3],
+        tone=options.get("tone", "practical"),
+        include_brand_profile=bool(options.get("include_brand_profile")),
+        include_wearing_scenes=bool(options.get("include_wearing_scenes")),
+    )
+    ctx = llmc.prepare_article(payload)
+    return {
+        # 単発生成と同じ指紋（同じ入力の記事を generation_jobs の実行時に再利用できるように）
+        "fingerprint": payload_fingerprint(payload, ctx["combined_reference_text"]),
+        "params": llmc.article_request_params(ctx.pop("system"), ctx.pop("user_prompt")),
+        "payload": payload,
+        "context": ctx,
+    }
+
+
+def _custom_id(token: Optional[str], item_id: int) -> str:
+    # submit_token の無い（この仕組みより前に送った）バッチは item-<id>
+    return f"{token}-item-{item_id}" if token else f"item-{item_id}"
+
+
+def submit_batch(batch_id: int, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    pending の商品を準備して1つの Message Batch として送る。
+    送る前に submitting と submit_token を保存する（落ちても _find_api_batch で送った batch を見つけられる）
+    """
+    import llm_client as llmc
+
+    conn = get_db_connection()
+    try:
+        batch = conn.execute("SELECT * FROM generation_batches WHERE id = ?", (batch_id,)).fetchone()
+        if batch is None or batch["status"] != "preparing":
+            return batch_status(conn, batch_id)
+        options = json.loads(batch["options_json"] or "{}")
+        items = conn.execute(
+            "SELECT id, brand, reference FROM generation_batch_items WHERE batch_id = ? AND status = 'pending'",
+            (batch_id,)
+        ).fetchall()
+
+        requests_: List[Dict[str, Any]] = []
+        prepared: List[Tuple[int, Dict[str, Any]]] = []
+        with ThreadPoolExecutor(max_workers=max(1, workers or BATCH_PREPARE_WORKERS)) as ex:
+            futures = [(it["id"], ex.submit(_prepare_item, it["id"], it["brand"], it["reference"], options))
+                       for it in items]
+            for item_id, fut in futures:
+                try:
+                    prepared.append((item_id, fut.result()))
+                except Exception as e:
+                    _fail_items(conn, [item_id], f"prepare: {type(e).__name__}: {e}")
+
+        if not prepared:
+            _finish_batch(conn, batch_id, error="no requests prepared")
+            return batch_status(conn, batch_id)
+
+        token = f"hg{batch_id}-{uuid.uuid4().hex[:8]}"
+        for item_id, p in prepared:
+            requests_.append({"custom_id": _custom_id(token, item_id), "params": p["params"]})
+
+        def _mark_submitting(c) -> bool:
+            c.execute("BEGIN IMMEDIATE")
+            claimed = c.execute(
+                f"UPDATE generation_batches SET status = 'submitting', submit_token = ?, submit_started_at = {_NOW} "
+                "WHERE id = ? AND status = 'preparing'",
+                (token, batch_id)
+            ).rowcount
+            if not claimed:
+                return False
+            c.executemany(
+                "UPDATE generation_batch_items SET payload_json = ?, context_json = ?, content_fingerprint = ? "
+                "WHERE id = ?",
+                [(json.dumps(p["payload"], ensure_ascii=False), json.dumps(p["context"], ensure_ascii=False),
+                  p["fingerprint"], item_id) for item_id, p in prepared]
+            )
+            return True
+
+        if not run_write(conn, _mark_submitting):
+            return batch_status(conn, batch_id)  # 別の送信が先に進めた
+
+        try:
+            # 作成は冪等でない（client は SDK の自動再試行をしない。応答が失われたら下の照合で拾う）
+            api_batch = llmc.client.messages.batches.create(requests=requests_)
+        except Exception as e:
+            # 応答だけ失われて batch はできていることがある。見つかればそれを使い、無いと確認できたら失敗にする
+            logger.warning("batch %s create failed: %s: %s", batch_id, type(e).__name__, e)
+            try:
+                state, api_batch_id = _find_api_batch(conn, batch_id)
+            except Exception as le:
+                logger.warning("batch %s list failed: %s: %s", batch_id, type(le).__name__, le)
+                state, api_batch_id = "unsure", None  # submitting のまま（回収・再起動時に照合し直す）
+            if state == "found":
+                _mark_submitted(conn, batch_id, api_batch_id)
+            elif state == "none":
+                _fail_items(conn, [item_id for item_id, _p in prepared], f"submit: {type(e).__name__}: {e}")
+                _finish_batch(conn, batch_id, error=f"{type(e).__name__}: {e}")
+            return batch_status(conn, batch_id)
+
+        _mark_submitted(conn, batch_id, api_batch.id)
+        return batch_status(conn, batch_id)
+    finally:
+        conn.close()
+
+
+def _mark_submitted(conn, batch_id: int, api_batch_id: str) -> None:
+    """送った batch を記録し、送った商品（submitting の時点で payload を持つ pending）を submitted にする"""
+    def _mark(c) -> None:
+        c.execute("BEGIN IMMEDIATE")
+        if not c.execute(
+            f"UPDATE generation_batches SET status = 'submitted', api_batch_id = ?, submitted_at = {_NOW} "
+            "WHERE id = ? AND status = 'submitting'",
+            (api_batch_id, batch_id)
+        ).rowcount:
+            return
+        c.execute(
+            "UPDATE generation_batch_items SET status = 'submitted' "
+            "WHERE batch_id = ? AND status = 'pending' AND payload_json IS NOT NULL",
+            (batch_id,)
+        )
+
+    run_write(conn, _mark)
+
+
+def _parse_db_time(value: str) -> datetime:
+    """SQLite の 'now'（UTC, 'YYYY-MM-DD HH:MM:SS[.fff]'）"""
+    fmt = "%Y-%m-%d %H:%M:%S.%f" if "." in value else "%Y-%m-%d %H:%M:%S"
+    return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+
+
+def _find_api_batch(conn, batch_id: int) -> Tuple[str, Optional[str]]:
+    """
+    submitting のバッチを送った Message Batch を batches.list から探す。
+    ("found", api_batch_id) / ("none", None) = 送信は届いていない / ("unsure", None) = まだ決められない
+
+    batches.list は新しい順。submit_started_at（から時計のずれの分だけ前）以降に作られ、
+    件数が送った数と同じで、まだどのバッチにも記録されていないものが候補。
+    custom_id は結果にしか出てこないので、処理が終わった候補の結果の先頭が submit_token で始まれば確定。
+    処理中の候補があれば終わるまで unsure（別の送信を取り違えないように）
+    """
+    import llm_client as llmc
+
+    batch = conn.execute("SELECT * FROM generation_batches WHERE id = ?", (batch_id,)).fetchone()
+    token = batch["submit_token"]
+    sent = conn.execute(
+        "SELECT COUNT(*) FROM generation_batch_items "
+        "WHERE batch_id = ? AND status = 'pending' AND payload_json IS NOT NULL",
+        (batch_id,)
+    ).fetchone()[0]
+    known = {r[0] for r in conn.execute(
+        "SELECT api_batch_id FROM generation_batches WHERE api_batch_id IS NOT NULL"
+    )}
+    since = _parse_db_time(batch["submit_started_at"]) - timedelta(seconds=BATCH_RECONCILE_SKEW_SEC)
+
+    in_progress = 0
+    for api_batch in llmc.client.messages.batches.list(limit=100):
+        if api_batch.created_at < since:
+            break
+        if api_batch.id in known or sum(_request_counts(api_batch).values()) != sent:
+            continue
+        if api_batch.processing_status != "ended":
+            in_progress += 1
+            continue
+        results = llmc.client.messages.batches.results(api_batch.id)
+        try:
+            first = next(iter(results), None)
+        finally:
+            results.close()
+        if first is not None and first.custom_id.startswith(f"{token}-"):
+            return "found", api_batch.id
+    return ("unsure" if in_progress else "none"), None
+
+
+def _reconcile_submitting(conn, batch_id: int, resubmit_if_missing: bool) -> None:
+    """submitting のバッチを照合する。見つかれば submitted に、無ければ（許すときだけ）準備からやり直す"""
+    state, api_batch_id = _find_api_batch(conn, batch_id)
+    if state == "found":
+        logger.info("batch %s: found submitted batch %s", batch_id, api_batch_id)
+        _mark_submitted(conn, batch_id, api_batch_id)
+    elif state == "none" and resubmit_if_missing:
+        logger.info("batch %s: not found on the API; preparing again", batch_id)
+        run_write(conn, lambda c: c.execute(
+            "UPDATE generation_batches SET status = 'preparing', submit_token = NULL, submit_started_at = NULL "
+            "WHERE id = ? AND status = 'submitting'",
+            (batch_id,)
+        ))
+        submit_batch_async(batch_id)
+
+
+def submit_batch_async(batch_id: int) -> None:
+    _executor.submit(_submit_quietly, batch_id)
+
+
+def _submit_quietly(batch_id: int) -> None:
+    try:
+        submit_batch(batch_id)
+    except Exception as e:
+        logger.exception("batch %s submit failed: %s", batch_id, e)
+        conn = get_db_connection()
+        try:
+            _finish_batch(conn, batch_id, error=f"{type(e).__name__}: {e}")
+        finally:
+            conn.close()
+
+
+def _resume_submitting(batch_id: int) -> None:
+    conn = get_db_connection()
+    try:
+        _reconcile_submitting(conn, batch_id, resubmit_if_missing=True)
+    except Exception as e:
+        logger.warning("batch %s reconcile failed: %s: %s", batch_id, type(e).__name__, e)
+    finally:
+        conn.close()
+
+
+def resume_pending_batches() -> None:
+    """
+    起動時に呼ぶ。
+    - preparing: batches.create の前に止まった（何も送っていない）ので準備からやり直す
+    - submitting: batches.create の途中で止まった。送った batch を batches.list から探して使い、
+      API 側に無いと確認できたときだけ準備からやり直す（処理中の候補があれば回収時にもう一度照合）
+    """
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT id, status FROM generation_batches WHERE status IN ('preparing', 'submitting') ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
+    for r in rows:
+        if r["status"] == "preparing":
+            submit_batch_async(r["id"])
+        else:
+            _executor.submit(_resume_submitting, r["id"])
+
+
+# ----------------------------
+# 回収
+# ----------------------------
+def _fail_items(conn, item_ids: List[int], error: str) -> None:
+    run_write(conn, lambda c: c.executemany(
+        "UPDATE generation_batch_items SET status = 'failed', error = ? WHERE id = ?",
+        [(error, i) for i in item_ids]
+    ))
+
+
+def _finish_batch(conn, batch_id: int, error: str = "") -> None:
+    """集計を確定し、生成できなかった分のクォータを返却する（1回だけ）"""
+    def _finish(c) -> None:
+        c.execute("BEGIN IMMEDIATE")
+        batch = c.execute("SELECT * FROM generation_batches WHERE id = ?", (batch_id,)).fetchone()
+        if batch is None or batch["status"] in ("collected", "failed"):
+            return
+        # 送られずに残ったものは失敗扱い
+        c.execute(
+            "UPDATE generation_batch_items SET status = 'failed', error = COALESCE(error, 'not submitted') "
+            "WHERE batch_id = ? AND status = 'pending'",
+            (batch_id,)
+        )
+        succeeded = c.execute(
+            "SELECT COUNT(*) FROM generation_batch_items WHERE batch_id = ? AND status = 'succeeded'",
+            (batch_id,)
+        ).fetchone()[0]
+        refund = max(0, batch["quota_charged"] - succeeded)
+        refund_quota(c, refund, batch["quota_month"])
+        c.execute(
+            f"UPDATE generation_batches SET status = ?, succeeded = ?, failed = total - ?, quota_refunded = ?, "
+            f"error = ?, finished_at = {_NOW} WHERE id = ?",
+            ("failed" if error else "collected", succeeded, succeeded, refund, error or None, batch_id)
+        )
+
+    run_write(conn, _finish)
+
+
+def _save_result(conn, item, result) -> None:
+    import llm_client as llmc
+
+    payload = json.loads(item["payload_json"])
+    ctx = json.loads(item["context_json"])
+    intro, specs, ref_meta = llmc.finish_article(result.message, payload, ctx)
+
+    annotate_payload(payload, ref_meta)
+    payload["generation_batch_id"] = item["batch_id"]
+
+    def _insert(c) -> None:
+        article_id = insert_generated_article(c, item["brand"], item["reference"], payload, intro, specs,
+                                              content_fingerprint=item["content_fingerprint"])
+        c.execute(
+            "UPDATE generation_batch_items SET status = 'succeeded', article_id = ?, error = NULL WHERE id = ?",
+            (article_id, item["id"])
+        )
+
+    run_write(conn, _insert)
+
+
+def collect_batch(batch_id: int) -> Dict[str, Any]:
+    """
+    API 側の処理が終わっていれば結果を保存して集計を確定する。
+    途中で止まっても、submitted のまま残った商品だけを次回処理する。
+    submitting（送信の応答が取れなかった）なら先に batches.list と照合する。
+    """
+    import llm_client as llmc
+
+    conn = get_db_connection()
+    try:
+        batch = conn.execute("SELECT * FROM generation_batches WHERE id = ?", (batch_id,)).fetchone()
+        if batch is not None and batch["status"] == "submitting":
+            # 送信中の別スレッドと取り違えないよう、やり直すのは十分に時間が経ったものだけ
+            stale = (datetime.now(timezone.utc) - _parse_db_time(batch["submit_started_at"])
+                     ).total_seconds() > BATCH_SUBMIT_STALE_SEC
+            _reconcile_submitting(conn, batch_id, resubmit_if_missing=stale)
+            batch = conn.execute("SELECT * FROM generation_batches WHERE id = ?", (batch_id,)).fetchone()
+        if batch is None or batch["status"] != "submitted":
+            return batch_status(conn, batch_id)
+
+        api_batch = llmc.client.messages.batches.retrieve(batch["api_batch_id"])
+        if api_batch.processing_status != "ended":
+            out = batch_status(conn, batch_id)
+            out["api_status"] = api_batch.processing_status
+            out["api_request_counts"] = _request_counts(api_batch)
+            return out
+
+        items = {
+            _custom_id(batch["submit_token"], r["id"]): r for r in conn.execute(
+                "SELECT * FROM generation_batch_items WHERE batch_id = ? AND status = 'submitted'", (batch_id,)
+            ).fetchall()
+        }
+        for entry in llmc.client.messages.batches.results(batch["api_batch_id"]):
+            item = items.pop(entry.custom_id, None)
+            if item is None:
+                continue
+            if entry.result.type != "succeeded":
+                err = getattr(getattr(entry.result, "error", None), "error", None)
+                _fail_items(conn, [item["id"]], f"{entry.result.type}: {getattr(err, 'message', '') or ''}".strip())
+                continue
+            try:
+                _save_result(conn, item, entry.result)
+            except Exception as e:
+                _fail_items(conn, [item["id"]], f"{type(e).__name__}: {e}")
+
+        # 結果に含まれなかったもの
+        if items:
+            _fail_items(conn, [it["id"] for it in items.values()], "missing from results")
+        _finish_batch(conn, batch_id)
+        return batch_status(conn, batch_id)
+    finally:
+        conn.close()
+
+
+def _request_counts(api_batch) -> Dict[str, int]:
+    counts = getattr(api_batch, "request_counts", None)
+    keys = ("processing", "succeeded", "errored", "canceled", "expired")
+    return {k: int(getattr(counts, k, 0) or 0) for k in keys}
+
+
+def wait_for_batch(batch_id: int, poll_sec: Optional[float] = None, on_poll=None) -> Dict[str, Any]:
+    while True:
+        status = collect_batch(batch_id)
+        if status.get("status") not in ("preparing", "submitting", "submitted"):
+            return status
+        if on_poll:
+            on_poll(status)
+        time.sleep(BATCH_POLL_SEC if poll_sec is None else poll_sec)
+
+
+def batch_status(conn, batch_id: int) -> Dict[str, Any]:
+    batch = conn.execute("SELECT * FROM generation_batches WHERE id = ?", (batch_id,)).fetchone()
+    if batch is None:
+        return {}
+    out = dict(batch)
+    out["items"] = [dict(r) for r in conn.execute(
+        "SELECT id, brand, reference, status, article_id, error FROM generation_batch_items "
+        "WHERE batch_id = ? ORDER BY id",
+        (batch_id,)
+    ).fetchall()]
+    return out
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def _print_status(status: Dict[str, Any], verbose: bool = False) -> None:
+    if not status:
+        print("batch not found")
+        return
+    print(
+        f"batch {status['id']}: {status['status']} total={status['total']} succeeded={status['succeeded']} "
+        f"failed={status['failed']} quota_charged={status['quota_charged']} refunded={status['quota_refunded']}"
+        + (f" api={status.get('api_status')} {status.get('api_request_counts')}" if status.get("api_status") else "")
+        + (f" error={status['error']}" if status.get("error") else "")
+    )
+    if verbose:
+        for it in status["items"]:
+            print(f"  {it['brand']} {it['reference']}: {it['status']}"
+                  + (f" article_id={it['article_id']}" if it["article_id"] else "")
+                  + (f" ({it['error']})" if it["error"] else ""))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--poll-sec', type=float, default=None)
+    common.add_argument('-v', '--verbose', action='store_true')
+
+    ap = argparse.ArgumentParser(description='Message Batches API での一括記事生成')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+
+    sp = sub.add_parser('submit', parents=[common], help='バッチを登録して送信')
+    sp.add_argument('--brand', default='')
+    sp.add_argument('--collection', default='')
+    sp.add_argument('--csv', default='', help='reference 列（任意で brand 列）を持つCSV')
+    sp.add_argument('--tone', default='practical',
+                    choices=['practical', 'luxury', 'magazine_story', 'casual_friendly'])
+    sp.add_argument('--include-brand-profile', action='store_true')
+    sp.add_argument('--include-wearing-scenes', action='store_true')
+    sp.add_argument('--workers', type=int, default=None, help='準備（URL発見・ページ取得）の並列数')
+    sp.add_argument('--wait', action='store_true', help='回収まで待つ')
+
+    for name in ('status', 'collect'):
+        p = sub.add_parser(name, parents=[common])
+        p.add_argument('batch_id', type=int)
+        if name == 'collect':
+            p.add_argument('--wait', action='store_true')
+    args = ap.parse_args(argv)
+
+    from models import init_db
+    init_db()
+
+    if args.cmd == 'status':
+        conn = get_db_connection()
+        try:
+            _print_status(batch_status(conn, args.batch_id), verbose=args.verbose)
+        finally:
+            conn.close()
+        return 0
+
+    if args.cmd == 'collect':
+        status = (wait_for_batch(args.batch_id, args.poll_sec, on_poll=_print_status) if args.wait
+                  else collect_batch(args.batch_id))
+        _print_status(status, verbose=args.verbose)
+        return 0
+
+    if args.csv:
+        with open(args.csv, 'rb') as f:
+            targets = read_reference_csv(f, default_brand=args.brand)
+        source = f'csv:{os.path.basename(args.csv)}'
+    elif args.brand:
+        conn = get_db_connection()
+        try:
+            targets = select_references(conn, args.brand, args.collection)
+        finally:
+            conn.close()
+        source = f'brand:{args.brand}' + (f' collection:{args.collection}' if args.collection else '')
+    else:
+        print('--brand または --csv を指定してください', file=sys.stderr)
+        return 2
+
+    options = {
+        'tone': args.tone,
+        'include_brand_profile': args.include_brand_profile,
+        'include_wearing_scenes': args.include_wearing_scenes,
+    }
+    try:
+        batch_id = create_batch(targets, source, options)
+    except BatchRejected as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
+    status = submit_batch(batch_id, workers=args.workers)
+    if args.wait and status.get('status') == 'submitted':
+        status = wait_for_batch(batch_id, args.poll_sec, on_poll=_print_status)
+    _print_status(status, verbose=args.verbose)
+    return 0 if status.get('status') != 'failed' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,594 @@
+"""
+記事生成ジョブ（通常生成・言い換え再生成をリクエストスレッドから切り離す）
+
+- POST はクォータ消費とジョブ登録だけ行い、job_id を返す（同じトランザクション）
+- 生成本体（URL自動発見 → ページ取得 → モデル呼び出し → 保存）はワーカープールで実行。
+  プールの大きさ（HOROLOGEN_GENERATION_WORKERS）がモデル呼び出しの同時数の上限になる
+- 記事の保存とジョブの done は1トランザクション。途中で落ちても記事が二重に残らない
+- 実行中のジョブは owner（models.JOB_OWNER）と heartbeat_at を持つ。起動時は heartbeat の途切れた running だけを
+  queued に戻して再実行（上限 HOROLOGEN_GENERATION_JOB_ATTEMPTS 回）。別プロセスで実行中のジョブには触らない
+- 結果の保存・失敗の記録は「自分が claim した回（owner と attempts が一致し、まだ running）」のときだけ。
+  途中で他のプロセスに引き継がれていたら記事の INSERT ごと取り消す
+- 失敗したジョブはクォータを1回分返却する（返却済みは quota_refunded で記録し、二重に戻さない）
+- 途中経過（参考URL・intro_text の差分）はプロセス内のバッファに積み、SSE で購読できる。
+  バッファの無いジョブ（別プロセス・再起動前のもの）は generation_jobs テーブルの状態だけをポーリングする
+- 二重送信・ブラウザの再送は同じ結果にまとめる（クォータも1回分だけ）:
+  - 登録時: 入力（正規スペック・editor_note・トーン・オプション・指定URL）の request_key が同じジョブが
+    実行中、または HOROLOGEN_IDEMPOTENCY_WINDOW_SEC 以内に完了していれば、そのジョブを返す
+  - 実行時: 参考ページ取得後の content_fingerprint（参考テキストのハッシュを含む）が同じ記事が
+    期間内にあれば、モデルを呼ばずにその記事を結果にしてクォータを返す
+- 実行中の計測（generation_metrics.py）はジョブの完了・失敗と同じトランザクションで保存する
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import generation_metrics
+from models import JOB_OWNER, get_db_connection, job_lease_expired_sql, run_write, start_job_heartbeat
+from quota import charge_quota, refund_quota, month_key_jst
+
+logger = logging.getLogger(__name__)
+
+GENERATION_WORKERS = int(os.getenv("HOROLOGEN_GENERATION_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("HOROLOGEN_GENERATION_JOB_ATTEMPTS", "2"))
+IDEMPOTENCY_WINDOW_SEC = int(os.getenv("HOROLOGEN_IDEMPOTENCY_WINDOW_SEC", "600"))  # 0 = 実行中のまとめだけ
+
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# このプロセスが attempts 回目として claim し、まだ running のジョブ（params: id, owner, attempts）
+_CLAIMED = "id = ? AND status = 'running' AND owner = ? AND attempts = ?"
+
+_executor = ThreadPoolExecutor(max_workers=max(1, GENERATION_WORKERS), thread_name_prefix="horologen-generate")
+
+# 生成結果のうち payload に残す ref_meta の項目（履歴表示・再生成で使う）
+_PAYLOAD_META_KEYS = (
+    "selected_reference_url", "selected_reference_reason", "combined_reference_chars",
+    "combined_reference_preview", "reference_urls_debug", "similarity_percent", "similarity_level",
+    "llm_usage", "llm_attempts",
+)
+
+TONES = ("practical", "luxury", "magazine_story", "casual_friendly")
+
+
+class GenerationRejected(Exception):
+    """クォータ不足・言い換え済みなどで登録前に弾いたもの（メッセージは画面表示用）"""
+
+
+class LeaseLost(Exception):
+    """実行中に heartbeat が途切れ、ジョブが別の実行へ移っていた（この実行の結果は捨てる）"""
+
+
+# ----------------------------
+# 生成の手順
+# ----------------------------
+def build_generation_payload(conn, brand: str, reference: str,
+                             options: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    生成フォームの入力（tone / include_* / reference_urls）から (reference_urls, payload)。
+    参考URLが未入力なら自動発見の結果を使う
+    """
+    import llm_client as llmc
+    from canonical import resolve_canonical
+    from url_discovery import discover_reference_urls
+
+    reference_urls = [u for u in options.get("reference_urls") or [] if u][:3]
+    if not reference_urls:
+        auto_urls, _auto_debug = discover_reference_urls(brand, reference, max_urls=3, conn=conn)
+        reference_urls = auto_urls[:3]
+
+    spec = resolve_canonical(conn, brand, reference)
+    tone = options.get("tone") if options.get("tone") in TONES else "practical"
+    payload = llmc.build_payload(
+        brand, reference, spec.canonical, spec.editor_note, reference_urls, tone=tone,
+        include_brand_profile=bool(options.get("include_brand_profile")),
+        include_wearing_scenes=bool(options.get("include_wearing_scenes")),
+    )
+    return reference_urls, payload
+
+
+def annotate_payload(payload: Dict[str, Any], ref_meta: Dict[str, Any],
+                     rewrite_parent_id: Optional[int] = None) -> None:
+    """生成結果を payload に記録する（rewrite_parent_id があれば言い換え）"""
+    for key in _PAYLOAD_META_KEYS:
+        payload[key] = ref_meta.get(key)
+    payload["selected_reference_url"] = payload["selected_reference_url"] or ""
+    payload["selected_reference_reason"] = payload["selected_reference_reason"] or ""
+    payload["combined_reference_chars"] = int(payload["combined_reference_chars"] or 0)
+    payload["combined_reference_preview"] = payload["combined_reference_preview"] or ""
+    payload["reference_urls_debug"] = payload["reference_urls_debug"] or []
+    payload["similarity_percent"] = int(payload["similarity_percent"] or 0)
+    payload["similarity_level"] = (payload["similarity_level"] or "blue").strip() or "blue"
+    payload["llm_usage"] = payload["llm_usage"] or {}
+    payload["llm_attempts"] = payload["llm_attempts"] or []
+
+    payload["rewrite_applied"] = rewrite_parent_id is not None
+    payload["rewrite_depth"] = 0 if rewrite_parent_id is None else 1
+    payload["rewrite_parent_id"] = rewrite_parent_id
+
+
+def insert_generated_article(c, brand: str, reference: str, payload: Dict[str, Any],
+                             intro_text: str, specs_text: str, content_fingerprint: Optional[str] = None) -> int:
+    """annotate_payload 済みの payload で generated_articles に1行（run_write の中で使う）"""
+    return c.execute("""
+        INSERT INTO generated_articles
+        (brand, reference, payload_json, intro_text, specs_text, rewrite_depth, rewrite_parent_id,
+         content_fingerprint)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        brand,
+        reference,
+        json.dumps(payload, ensure_ascii=False),
+        intro_text,
+        specs_text,
+        payload["rewrite_depth"],
+        payload["rewrite_parent_id"],
+        content_fingerprint,
+    )).lastrowid
+
+
+def _digest(obj: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(obj, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _normalized_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "tone": options.get("tone") if options.get("tone") in TONES else "practical",
+        "include_brand_profile": bool(options.get("include_brand_profile")),
+        "include_wearing_scenes": bool(options.get("include_wearing_scenes")),
+        "reference_urls": [u for u in options.get("reference_urls") or [] if u][:3],
+    }
+
+
+def generation_request_key(conn, brand: str, reference: str, options: Dict[str, Any]) -> str:
+    """登録時の重複判定キー（参考ページは取りに行かない。自動発見の URL も含めない）"""
+    from canonical import resolve_canonical
+
+    spec = resolve_canonical(conn, brand, reference)
+    return _digest({
+        "brand": brand,
+        "reference": reference,
+        "facts": spec.canonical,
+        "editor_note": spec.editor_note,
+        **_normalized_options(options),
+    })
+
+
+def payload_fingerprint(payload: Dict[str, Any], reference_text: str) -> str:
+    """生成結果を決める入力の指紋（payload の正規化部分 + 実際に使う参考テキストのハッシュ）"""
+    return _digest({
+        "product": payload.get("product"),
+        "facts": payload.get("facts"),
+        "tone": (payload.get("style") or {}).get("tone"),
+        "options": payload.get("options"),
+        "constraints": payload.get("constraints"),
+        "editor_note": payload.get("editor_note") or "",
+        "reference_text": hashlib.sha256((reference_text or "").encode("utf-8")).hexdigest(),
+    })
+
+
+def rewrite_block_reason(conn, source) -> str:
+    """言い換えできない理由（できるなら空文字）。source は generated_articles の行"""
+    try:
+        payload = json.loads(source["payload_json"]) if source["payload_json"] else {}
+    except Exception:
+        payload = {}
+    if int(payload.get("rewrite_depth", 0) or 0) >= 1:
+        return "この履歴は既に言い換え済みのため、再度の言い換えはできません（最大1回）"
+    already = conn.execute(
+        "SELECT 1 FROM generated_articles WHERE rewrite_parent_id = ? LIMIT 1", (source["id"],)
+    ).fetchone()
+    if already:
+        return "この履歴は既に言い換え済みのため、再度の言い換えはできません（最大1回）"
+    return ""
+
+
+# ----------------------------
+# 途中経過のバッファ（プロセス内）
+# ----------------------------
+_EVENTS_KEEP = 200  # 終わったジョブのバッファを残す数（再接続・遅れて購読した画面用）
+
+_events_cond = threading.Condition()
+_events: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+
+def _publish(job_id: int, kind: str, data: Any, finished: bool = False) -> None:
+    with _events_cond:
+        buf = _events.get(job_id)
+        if buf is None:
+            buf = _events[job_id] = {"events": [], "finished": False}
+            if len(_events) > _EVENTS_KEEP:
+                for old_id in [k for k, v in _events.items() if v["finished"]][:len(_events) - _EVENTS_KEEP]:
+                    del _events[old_id]
+        buf["events"].append((kind, data))
+        buf["finished"] = buf["finished"] or finished
+        _events_cond.notify_all()
+
+
+def wait_job_events(job_id: int, after: int,
+                    timeout: float) -> Optional[Tuple[int, List[Tuple[str, Any]], bool]]:
+    """
+    after 件目より後のイベントを (先頭の位置, イベント, ジョブが終わったか) で返す。
+    新しいものが無ければ timeout 秒まで待つ。after がバッファより先（再起動で作り直した等）なら最初から。
+    このプロセスにバッファが無いジョブは None（呼び出し側で get_generation_job をポーリング）
+    """
+    deadline = time.monotonic() + timeout
+    with _events_cond:
+        while True:
+            buf = _events.get(job_id)
+            if buf is None:
+                return None
+            events = buf["events"]
+            start = after if after <= len(events) else 0
+            if len(events) > start or buf["finished"]:
+                return start, events[start:], buf["finished"]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return start, [], False
+            _events_cond.wait(remaining)
+
+
+# ----------------------------
+# 登録
+# ----------------------------
+def _window() -> str:
+    return f"-{max(0, IDEMPOTENCY_WINDOW_SEC)} seconds"
+
+
+def _reusable_job(c, request_key: str) -> Optional[int]:
+    """同じ request_key で実行中、または期間内に完了したジョブ"""
+    row = c.execute(
+        "SELECT id FROM generation_jobs WHERE request_key = ? AND (status IN ('queued', 'running') "
+        "OR (status = 'done' AND finished_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?))) "
+        "ORDER BY id DESC LIMIT 1",
+        (request_key, _window())
+    ).fetchone()
+    return row["id"] if row else None
+
+
+def submit_generation(brand: str, reference: str, options: Dict[str, Any]) -> int:
+    """
+    通常生成のジョブを登録して job_id を返す。クォータ不足なら GenerationRejected。
+    同じ入力のジョブが実行中・期間内に完了済みなら、クォータを使わずそのジョブを返す
+    """
+    mk = month_key_jst()
+    options = _normalized_options(options)
+    conn = get_db_connection()
+    try:
+        request_key = generation_request_key(conn, brand, reference, options)
+    finally:
+        conn.close()
+
+    def _create(c) -> Any:
+        c.execute("BEGIN IMMEDIATE")
+        existing = _reusable_job(c, request_key)
+        if existing:
+            return existing, False
+        if not charge_quota(c, 1, mk):
+            return None
+        return c.execute(
+            "INSERT INTO generation_jobs "
+            "(kind, brand, reference, options_json, request_key, quota_month, quota_charged, created_at) "
+            f"VALUES ('generate', ?, ?, ?, ?, ?, 1, {_NOW})",
+            (brand, reference, json.dumps(options, ensure_ascii=False), request_key, mk)
+        ).lastrowid, True
+
+    return _enqueue(_create)
+
+
+def submit_rewrite(source_article_id: int) -> int:
+    """
+    言い換え再生成のジョブを登録して job_id を返す。
+    同じ履歴への言い換えは1回まで。実行中・期間内に完了したジョブがあればそれを返す
+    """
+    mk = month_key_jst()
+    request_key = f"rewrite:{source_article_id}"
+
+    def _create(c) -> Any:
+        c.execute("BEGIN IMMEDIATE")
+        existing = _reusable_job(c, request_key)
+        if existing:
+            return existing, False
+        source = c.execute("SELECT * FROM generated_articles WHERE id = ?", (source_article_id,)).fetchone()
+        if not source:
+            return "言い換え対象の履歴が見つかりません"
+        reason = rewrite_block_reason(c, source)
+        if reason:
+            return reason
+        if not charge_quota(c, 1, mk):
+            return None
+        return c.execute(
+            "INSERT INTO generation_jobs "
+            "(kind, brand, reference, source_article_id, request_key, quota_month, quota_charged, created_at) "
+            f"VALUES ('rewrite', ?, ?, ?, ?, ?, 1, {_NOW})",
+            (source["brand"], source["reference"], source_article_id, request_key, mk)
+        ).lastrowid, True
+
+    return _enqueue(_create)
+
+
+def _enqueue(create) -> int:
+    conn = get_db_connection()
+    try:
+        result = run_write(conn, create)
+    finally:
+        conn.close()
+    if result is None:
+        raise GenerationRejected("今月の生成回数の上限に達しました。管理者にお問い合わせください。")
+    if isinstance(result, str):
+        raise GenerationRejected(result)
+
+    job_id, created = result
+    if created:
+        _publish(job_id, "status", {"status": "queued"})
+        _executor.submit(_run_job, job_id)
+    return job_id
+
+
+def resume_pending_generation_jobs() -> None:
+    """
+    起動時に呼ぶ。
+    - running のうち heartbeat が JOB_LEASE_SEC 以上途切れたものは保存前に止まっている（保存と done は同時）ので
+      queued に戻して再実行。試行回数が上限に達していれば failed にしてクォータを返す。
+      heartbeat が新しいもの（別プロセスで実行中）はそのまま
+    - queued のジョブは再投入（実行は claim できた1か所だけ）
+    """
+    stale = f"status = 'running' AND {job_lease_expired_sql()}"
+    conn = get_db_connection()
+    try:
+        exhausted = conn.execute(
+            f"SELECT id, attempts FROM generation_jobs WHERE {stale} AND attempts >= ?", (JOB_MAX_ATTEMPTS,)
+        ).fetchall()
+        for r in exhausted:
+            try:
+                _fail_job(conn, r["id"], "interrupted", attempt=r["attempts"])
+            except LeaseLost:
+                pass  # 間に別プロセスが片付けた
+        run_write(conn, lambda c: c.execute(
+            f"UPDATE generation_jobs SET status = 'queued', owner = NULL, heartbeat_at = NULL WHERE {stale}"
+        ))
+        queued = [r["id"] for r in conn.execute(
+            "SELECT id FROM generation_jobs WHERE status = 'queued' ORDER BY id"
+        ).fetchall()]
+    finally:
+        conn.close()
+
+    for job_id in queued:
+        _publish(job_id, "status", {"status": "queued"})
+        _executor.submit(_run_job, job_id)
+
+
+# ----------------------------
+# 実行
+# ----------------------------
+def _run_job(job_id: int) -> None:
+    with generation_metrics.collect() as metrics:
+        _execute_job(job_id, metrics)
+
+
+def _execute_job(job_id: int, metrics: "generation_metrics.MetricsRecorder") -> None:
+    import llm_client as llmc
+
+    start_job_heartbeat()
+    conn = get_db_connection()
+    started = time.monotonic()
+    attempt = None
+    try:
+        claimed = run_write(conn, lambda c: c.execute(
+            f"UPDATE generation_jobs SET status = 'running', attempts = attempts + 1, owner = ?, "
+            f"heartbeat_at = {_NOW}, started_at = {_NOW} WHERE id = ? AND status = 'queued'", (JOB_OWNER, job_id)
+        ).rowcount)
+        if not claimed:
+            return
+        job = conn.execute(
+            "SELECT *, (julianday(started_at) - julianday(created_at)) * 86400000.0 AS queue_ms "
+            "FROM generation_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        attempt = job["attempts"]
+        _publish(job_id, "status", {"status": "running"})
+        generation_metrics.record("queue_wait", max(0.0, job["queue_ms"] or 0.0), detail=job["kind"])
+
+        if job["kind"] == "rewrite":
+            source = conn.execute(
+                "SELECT payload_json FROM generated_articles WHERE id = ?", (job["source_article_id"],)
+            ).fetchone()
+            if not source:
+                raise RuntimeError("言い換え対象の履歴が見つかりません")
+            payload = json.loads(source["payload_json"]) if source["payload_json"] else {}
+            rewrite_mode, parent_id = "force", job["source_article_id"]
+        else:
+            _urls, payload = build_generation_payload(conn, job["brand"], job["reference"],
+                                                      json.loads(job["options_json"] or "{}"))
+            rewrite_mode, parent_id = "none", None
+
+        ctx = llmc.prepare_article(payload)
+        fingerprint = None
+        if parent_id is None:
+            fingerprint = payload_fingerprint(payload, ctx["combined_reference_text"])
+            if _reuse_article(conn, job_id, attempt, fingerprint, metrics, started):
+                _publish(job_id, "done", get_generation_job(conn, job_id), finished=True)
+                return
+
+        intro_text, specs_text, ref_meta = llmc.generate_article(
+            payload, rewrite_mode=rewrite_mode, on_event=lambda kind, data: _publish(job_id, kind, data), ctx=ctx
+        )
+        annotate_payload(payload, ref_meta, rewrite_parent_id=parent_id)
+
+        def _save(c) -> Optional[str]:
+            c.execute("BEGIN IMMEDIATE")
+            if parent_id is not None and c.execute(
+                "SELECT 1 FROM generated_articles WHERE rewrite_parent_id = ? LIMIT 1", (parent_id,)
+            ).fetchone():
+                return "この履歴は既に言い換え済みです"
+            article_id = insert_generated_article(c, job["brand"], job["reference"], payload,
+                                                  intro_text, specs_text, content_fingerprint=fingerprint)
+            if not c.execute(
+                f"UPDATE generation_jobs SET status = 'done', article_id = ?, error = NULL, finished_at = {_NOW} "
+                f"WHERE {_CLAIMED}", (article_id, job_id, JOB_OWNER, attempt)
+            ).rowcount:
+                c.rollback()  # 記事の INSERT ごと取り消す
+                raise LeaseLost(job_id)
+            metrics.save(c, article_id, job_id, "done", (time.monotonic() - started) * 1000, job["kind"])
+            return None
+
+        conflict = run_write(conn, _save)
+        if conflict:
+            raise RuntimeError(conflict)
+        _publish(job_id, "done", get_generation_job(conn, job_id), finished=True)
+    except LeaseLost:
+        _lease_lost(job_id, attempt)
+    except Exception as e:
+        try:
+            conn.rollback()
+            if attempt is not None:
+                _fail_job(conn, job_id, f"{type(e).__name__}: {e}", metrics, started,
+                          attempt=attempt, owner=JOB_OWNER)
+        except LeaseLost:
+            _lease_lost(job_id, attempt)
+            return
+        except Exception:
+            pass
+        _publish(job_id, "error", {"error": f"{type(e).__name__}: {e}"}, finished=True)
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _lease_lost(job_id: int, attempt: Optional[int]) -> None:
+    """この実行の結果は捨てる。結果は引き継いだ実行が出すので、購読中の画面は DB のポーリングへ切り替える"""
+    logger.warning("generation job %s: lease lost at attempt %s; result discarded", job_id, attempt)
+    with _events_cond:
+        _events.pop(job_id, None)
+        _events_cond.notify_all()
+
+
+def _reuse_article(conn, job_id: int, attempt: int, fingerprint: str,
+                   metrics: Optional["generation_metrics.MetricsRecorder"] = None, started: float = 0.0) -> bool:
+    """
+    同じ content_fingerprint の記事が期間内にあれば、それを結果にして done にする（クォータは返す）。
+    無ければ False。計測は article_id = NULL で保存（この記事を作った生成の計測ではないため）。
+    attempt 回目の claim が既に他へ移っていれば LeaseLost
+    """
+    if IDEMPOTENCY_WINDOW_SEC <= 0:
+        return False
+
+    def _reuse(c) -> bool:
+        c.execute("BEGIN IMMEDIATE")
+        row = c.execute(
+            "SELECT id FROM generated_articles WHERE content_fingerprint = ? "
+            "AND created_at >= datetime('now', ?) ORDER BY id DESC LIMIT 1",
+            (fingerprint, _window())
+        ).fetchone()
+        if not row:
+            return False
+        job = c.execute(
+            f"SELECT quota_month, quota_charged, quota_refunded FROM generation_jobs WHERE {_CLAIMED}",
+            (job_id, JOB_OWNER, attempt)
+        ).fetchone()
+        if not job:
+            c.rollback()
+            raise LeaseLost(job_id)
+        refund_quota(c, job["quota_charged"] - job["quota_refunded"], job["quota_month"])
+        c.execute(
+            f"UPDATE generation_jobs SET status = 'done', article_id = ?, reused = 1, error = NULL, "
+            f"quota_refunded = quota_charged, finished_at = {_NOW} WHERE id = ?",
+            (row["id"], job_id)
+        )
+        if metrics is not None:
+            metrics.save(c, None, job_id, "reused", (time.monotonic() - started) * 1000)
+        return True
+
+    return run_write(conn, _reuse)
+
+
+def _fail_job(conn, job_id: int, error: str,
+              metrics: Optional["generation_metrics.MetricsRecorder"] = None, started: float = 0.0,
+              attempt: Optional[int] = None, owner: Optional[str] = None) -> None:
+    """
+    failed にしてクォータを1回分返す（返却は1ジョブにつき1回だけ）。計測は article_id = NULL で保存。
+    attempt（と owner）を渡したら、その回の running のままのときだけ。違えば LeaseLost
+    """
+    where, params = "id = ?", [job_id]
+    if attempt is not None:
+        where += " AND status = 'running' AND attempts = ?"
+        params.append(attempt)
+    if owner is not None:
+        where += " AND owner = ?"
+        params.append(owner)
+
+    def _fail(c) -> None:
+        c.execute("BEGIN IMMEDIATE")
+        job = c.execute(
+            f"SELECT quota_month, quota_charged, quota_refunded FROM generation_jobs WHERE {where}", params
+        ).fetchone()
+        if not job:
+            c.rollback()
+            raise LeaseLost(job_id)
+        c.execute(
+            f"UPDATE generation_jobs SET status = 'failed', error = ?, finished_at = {_NOW} WHERE id = ?",
+            (error, job_id)
+        )
+        if job and job["quota_charged"] and not job["quota_refunded"]:
+            refund_quota(c, job["quota_charged"], job["quota_month"])
+            c.execute("UPDATE generation_jobs SET quota_refunded = quota_charged WHERE id = ?", (job_id,))
+        if metrics is not None:
+            metrics.save(c, None, job_id, "failed", (time.monotonic() - started) * 1000, error.split(":")[0])
+
+    run_write(conn, _fail)
+
+
+# ----------------------------
+# 参照
+# ----------------------------
+def get_generation_job(conn, job_id: int) -> Optional[Dict[str, Any]]:
+    """ポーリング用の状態 dict（done なら保存した記事の本文・類似度も含む）"""
+    row = conn.execute("""
+        SELECT j.*,
+               (julianday(COALESCE(j.finished_at, 'now')) - julianday(j.started_at)) * 86400.0 AS elapsed_sec,
+               (SELECT COUNT(*) FROM generation_jobs q WHERE q.status = 'queued' AND q.id < j.id) AS ahead
+        FROM generation_jobs j WHERE j.id = ?
+    """, (job_id,)).fetchone()
+    if not row:
+        return None
+
+    out: Dict[str, Any] = {
+        "id": row["id"],
+        "kind": row["kind"],
+        "brand": row["brand"],
+        "reference": row["reference"],
+        "status": row["status"],
+        "queue_position": int(row["ahead"]) if row["status"] == "queued" else 0,
+        "attempts": row["attempts"],
+        "article_id": row["article_id"],
+        "reused": bool(row["reused"]),
+        "error": row["error"] or "",
+        "elapsed_sec": round(float(row["elapsed_sec"] or 0.0), 1),
+        "created_at": row["created_at"],
+    }
+    if row["status"] == "done" and row["article_id"]:
+        article = conn.execute(
+            "SELECT intro_text, specs_text, payload_json, rewrite_depth FROM generated_articles WHERE id = ?",
+            (row["article_id"],)
+        ).fetchone()
+        if article:
+            payload = json.loads(article["payload_json"]) if article["payload_json"] else {}
+            out.update({
+                "intro_text": article["intro_text"] or "",
+                "specs_text": article["specs_text"] or "",
+                "rewrite_depth": int(article["rewrite_depth"] or 0),
+                "similarity_percent": int(payload.get("similarity_percent", 0) or 0),
+                "similarity_level": payload.get("similarity_level") or "blue",
+                "selected_reference_url": payload.get("selected_reference_url") or "",
+                "selected_reference_reason": payload.get("selected_reference_reason") or "",
+            })
+    return out
+
@@ -0,0 +1,178 @@
+"""
+記事生成の計測（モデル呼び出し・参考ページ取得・CSE 検索ごとの待ち時間とトークン数）
+
+- collect() の中で record() されたものを1つの MetricsRecorder に集め、保存時に generation_metrics へ書く
+  （記事の保存と同じトランザクション。失敗・既存記事を使ったジョブは article_id = NULL）
+- スレッドプールに投げる処理は bind() で包むと、呼び出し元と同じ MetricsRecorder に記録される
+- collect() の外（バッチ生成・prefetch など）では record() は何もしない
+- /admin/generation_metrics で段階ごとの p50 / p95 / p99 を表示
+
+stage:
+  queue_wait     ジョブ登録から実行開始まで
+  discovery      参考URLの自動発見（保存済みの発見結果を使ったときは cache = hit）
+  cse            CSE の1クエリ（cache = hit / miss / inflight（実行中の同じクエリに相乗り））
+  references     参考ページの取得と採用URLの選定（全体）
+  page_fetch     参考ページ1本（cache = page_cache の結果、outcome = ok / 除外・失敗の理由）
+  model.generate / model.rewrite
+                 モデル呼び出し1回（attempt 2 以上は取り直し、outcome = ok / no_tool_use / invalid / hype / error）
+  article        1記事の合計（outcome = done / reused / failed）
+"""
+import contextlib
+import math
+import os
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+METRICS_DAYS = int(os.getenv("HOROLOGEN_METRICS_DAYS", "7"))  # 管理画面の集計期間の既定
+
+_FIELDS = ("stage", "detail", "latency_ms", "attempt", "outcome", "stop_reason", "input_tokens", "output_tokens",
+           "cache_read_input_tokens", "cache_creation_input_tokens", "cache")
+
+
+class MetricsRecorder:
+    """1回の生成で記録した行（複数スレッドから add される）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows: List[Dict[str, Any]] = []
+
+    def add(self, stage: str, latency_ms: float, **fields) -> None:
+        row = {"stage": stage, "latency_ms": round(float(latency_ms), 1), **fields}
+        with self._lock:
+            self.rows.append(row)
+
+    def save(self, c, article_id: Optional[int], job_id: Optional[int], outcome: str,
+             total_ms: float, detail: str = "") -> None:
+        """記録した行と1記事の合計（stage = article）を generation_metrics に書く（run_write の中で使う）"""
+        with self._lock:
+            rows = list(self.rows)
+        rows.append({"stage": "article", "latency_ms": round(float(total_ms), 1), "outcome": outcome, "detail": detail})
+        c.executemany(
+            "INSERT INTO generation_metrics (article_id, job_id, " + ", ".join(_FIELDS) + ") "
+            "VALUES (?, ?, " + ", ".join("?" for _ in _FIELDS) + ")",
+            [(article_id, job_id, *(_column(r, f) for f in _FIELDS)) for r in rows]
+        )
+
+
+def _column(row: Dict[str, Any], field: str) -> Any:
+    v = row.get(field)
+    if field in ("attempt",):
+        return int(v or 1)
+    if field.endswith("_tokens"):
+        return int(v or 0)
+    if field in ("detail", "outcome"):
+        return str(v or "")[:300]
+    return v
+
+
+_current: ContextVar[Optional[MetricsRecorder]] = ContextVar("horologen_metrics", default=None)
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[MetricsRecorder]:
+    recorder = MetricsRecorder()
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+def record(stage: str, latency_ms: float, **fields) -> None:
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.add(stage, latency_ms, **fields)
+
+
+def bind(fn):
+    """fn を今の MetricsRecorder に記録する形で包む（スレッドプールへ submit する前に）"""
+    recorder = _current.get()
+    if recorder is None:
+        return fn
+
+    def _run(*args, **kwargs):
+        token = _current.set(recorder)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return _run
+
+
+# ----------------------------
+# 集計（管理画面）
+# ----------------------------
+def _percentile(sorted_values: List[float], p: float) -> float:
+    """nearest-rank"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def stage_summary(conn, days: int = METRICS_DAYS) -> List[Dict[str, Any]]:
+    """段階ごとの件数・p50 / p95 / p99 / 最大・トークン数・キャッシュ率・取り直し・失敗"""
+    rows = conn.execute("""
+        SELECT stage, latency_ms, attempt, outcome, input_tokens, output_tokens,
+               cache_read_input_tokens, cache
+        FROM generation_metrics
+        WHERE created_at >= datetime('now', ?)
+        ORDER BY stage, latency_ms
+    """, (f"-{max(1, days)} days",)).fetchall()
+
+    groups: Dict[str, List[Any]] = {}
+    for r in rows:
+        groups.setdefault(r["stage"], []).append(r)
+
+    out = []
+    for stage, items in groups.items():
+        latencies = [float(r["latency_ms"]) for r in items]
+        n = len(items)
+        cached = [r for r in items if r["cache"]]
+        out.append({
+            "stage": stage,
+            "count": n,
+            "p50_ms": round(_percentile(latencies, 50), 1),
+            "p95_ms": round(_percentile(latencies, 95), 1),
+            "p99_ms": round(_percentile(latencies, 99), 1),
+            "max_ms": round(latencies[-1], 1),
+            "total_sec": round(sum(latencies) / 1000.0, 1),
+            "avg_input_tokens": round(sum(r["input_tokens"] for r in items) / n),
+            "avg_output_tokens": round(sum(r["output_tokens"] for r in items) / n),
+            "avg_cache_read_tokens": round(sum(r["cache_read_input_tokens"] for r in items) / n),
+            "cache_hit_percent": (
+                round(100.0 * sum(1 for r in cached if r["cache"] != "miss") / len(cached)) if cached else None
+            ),
+            "retries": sum(1 for r in items if (r["attempt"] or 1) > 1),
+            "not_ok": sum(1 for r in items if r["outcome"] and r["outcome"] not in ("ok", "done", "reused")),
+        })
+    order = {s: i for i, s in enumerate(("article", "queue_wait", "discovery", "cse", "references", "page_fetch",
+                                         "model.generate", "model.rewrite"))}
+    out.sort(key=lambda s: (order.get(s["stage"], len(order)), s["stage"]))
+    return out
+
+
+def recent_articles(conn, limit: int = 20) -> List[Dict[str, Any]]:
+    """直近の生成ごとの内訳（どこに時間を使ったか）"""
+    rows = conn.execute("""
+        SELECT job_id, MAX(article_id) AS article_id, MIN(created_at) AS created_at,
+               SUM(CASE WHEN stage = 'article' THEN latency_ms ELSE 0 END) AS total_ms,
+               MAX(CASE WHEN stage = 'article' THEN outcome END) AS outcome,
+               SUM(CASE WHEN stage = 'queue_wait' THEN latency_ms ELSE 0 END) AS queue_ms,
+               SUM(CASE WHEN stage = 'discovery' THEN latency_ms ELSE 0 END) AS discovery_ms,
+               SUM(CASE WHEN stage = 'references' THEN latency_ms ELSE 0 END) AS references_ms,
+               SUM(CASE WHEN stage LIKE 'model.%' THEN latency_ms ELSE 0 END) AS model_ms,
+               SUM(CASE WHEN stage LIKE 'model.%' THEN 1 ELSE 0 END) AS model_calls,
+               SUM(CASE WHEN stage LIKE 'model.%' AND attempt > 1 THEN 1 ELSE 0 END) AS retries,
+               SUM(input_tokens) AS input_tokens,
+               SUM(output_tokens) AS output_tokens,
+               SUM(cache_read_input_tokens) AS cache_read_input_tokens
+        FROM generation_metrics
+        WHERE job_id IS NOT NULL
+        GROUP BY job_id
+        ORDER BY job_id DESC
+        LIMIT ?
+    """, (limit,)).fetchall()
+    return [dict(r) for r in rows]
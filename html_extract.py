@@ -0,0 +1,516 @@
+import html.entities
+import logging
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+# ----------------------------
+# 参考ページの本文抽出（バックエンド切り替え式）
+#   手順はどのバックエンドでも同じ（もともとの BeautifulSoup 版と同じ規則）:
+#     1) DROP_TAGS の要素は中身ごと捨てる
+#     2) ROOT_SELECTORS を順に試し、最初に見つかった要素を本文ルートにする（無ければ文書全体）
+#     3) ルート配下の PART_TAGS 要素の文字列（空白区切り）のうち MIN_PART_CHARS 以上を行として採用
+#     4) 1行も無ければ、ルート配下の全文字列から MIN_PART_CHARS 以上の行を採用
+#   パーサーが作るイベント（開始タグ / 終了タグ / 文字列 / 区切り）を _TextCollector が1パスで処理する。
+#   ドメインごとの差分（ルート・除外要素・スペック表・ノイズ行）は ExtractProfile で渡す。
+#
+#   stream     : 標準ライブラリ html.parser をそのまま流す（木を作らない）。bs4 + html.parser と同じ木の規則で出力も同一
+#   lxml       : libxml2（HTML5 に近い補正をするので、閉じ忘れの <p> / <li> などでは行の切れ方が変わることがある）
+#   selectolax : lexbor（同上）
+#   bs4        : 従来の BeautifulSoup(html.parser) 実装（比較用）
+# HOROLOGEN_EXTRACTOR で指定（既定 auto = AUTO_EXTRACTORS のうち使えるもの）
+#   auto に入れるのは fixtures/extract の保存ページで bs4 と出力が一致するものだけ
+#   （python bench_extract.py --dir fixtures/extract --check）。lxml / selectolax は明示したときだけ使う
+# ----------------------------
+DROP_TAGS = frozenset(["script", "style", "noscript", "header", "footer", "nav", "aside"])
+ROOT_SELECTORS = ["main", "article", '[role="main"]', ".article", ".post", ".content", ".entry-content", ".post-content"]
+PART_TAGS = frozenset(["h1", "h2", "h3", "p", "li"])
+MIN_PART_CHARS = 15
+
+# bs4 の html.parser ビルダーと同じ扱い
+VOID_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+    "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+    "nextid", "spacer",
+])
+# この配下の文字列は別の型になり、通常の get_text() には含まれない（Script / Stylesheet / TemplateString / RubyText*）
+HIDDEN_TEXT_TAGS = frozenset(["script", "style", "template", "rt", "rp"])
+
+# spec_tables のとき「項目: 値」の1行にまとめる行要素と、その (項目セル, 値セル)
+SPEC_ROWS = {"tr": ("th", "td"), "dl": ("dt", "dd")}
+SPEC_CELLS = frozenset(["th", "td", "dt", "dd"])
+
+EXTRACTOR = os.getenv("HOROLOGEN_EXTRACTOR", "auto").strip().lower()
+# auto で選ぶバックエンド（優先順）。木を作るバックエンドは崩れたHTMLで bs4 と行の区切りが変わるので入れない
+AUTO_EXTRACTORS = ("stream",)
+
+logger = logging.getLogger(__name__)
+
+Attrs = Dict[str, str]
+
+
+@dataclass(frozen=True)
+class ExtractProfile:
+    """ドメイン別の抽出ルール（llm_client.EXTRACTION_PROFILES）。既定値のままなら従来どおりの抽出"""
+    name: str = "default"
+    root_selectors: Tuple[str, ...] = tuple(ROOT_SELECTORS)  # 先に試す。見つからなければ ROOT_SELECTORS
+    drop_tags: FrozenSet[str] = DROP_TAGS
+    drop_selectors: Tuple[str, ...] = ()   # 中身ごと捨てる要素（tag / .class / #id / [attr="v"]）
+    spec_tables: bool = False              # <tr><th><td> / <dl><dt><dd> を「項目: 値」の1行に
+    noise_patterns: Tuple[str, ...] = ()   # この正規表現に当たる行は捨てる
+    dedupe_lines: bool = False             # 同じ行の繰り返し（CTA・注意書きなど）は最初の1回だけ
+    max_chars: Optional[int] = None        # fetch_page_text の max_chars を上書き
+    max_bytes: Optional[int] = None        # 取得する本文の上限（http_client の既定を上書き）
+
+    @property
+    def key(self) -> str:
+        """ページキャッシュの抽出キー用（ルールを変えたら抽出し直される）"""
+        return f"{self.name}:{zlib.crc32(repr(self).encode('utf-8')):08x}"
+
+
+DEFAULT_PROFILE = ExtractProfile()
+
+Extractor = Callable[[str, ExtractProfile], Tuple[str, str]]
+
+_SELECTOR_RE = re.compile(r'([a-z0-9]*)(?:\.([\w-]+)|#([\w-]+)|\[([\w-]+)="([^"]*)"\])?')
+
+
+def _selector_matcher(selector: str) -> Callable[[str, Attrs], bool]:
+    """tag / .class / #id / [attr="v"]（tag との組み合わせ可）だけの簡易セレクタ"""
+    m = _SELECTOR_RE.fullmatch(selector.strip())
+    if not m or not any(m.groups()):
+        raise ValueError(f"unsupported selector: {selector!r}")
+    tag, cls, el_id, key, value = m.groups()
+    if cls:
+        cond = lambda attrs: cls in attrs.get("class", "").split()
+    elif el_id:
+        cond = lambda attrs: attrs.get("id") == el_id
+    elif key:
+        cond = lambda attrs: attrs.get(key) == value
+    else:
+        cond = lambda attrs: True
+    if tag:
+        return lambda name, attrs: name == tag and cond(attrs)
+    return lambda name, attrs: cond(attrs)
+
+
+@lru_cache(maxsize=64)
+def _compile(profile: ExtractProfile):
+    roots = list(profile.root_selectors) + [s for s in ROOT_SELECTORS if s not in profile.root_selectors]
+    return (
+        [(s, _selector_matcher(s)) for s in roots],
+        [_selector_matcher(s) for s in profile.drop_selectors],
+        [re.compile(p) for p in profile.noise_patterns],
+    )
+
+
+class _TextCollector:
+    """
+    開始 / 終了 / 文字列 / 区切りのイベントから抽出結果を組み立てる。
+    要素は出現順の番号（order）で管理し、子孫 = 開始後〜終了までに開始した要素、として扱う。
+    """
+
+    def __init__(self, profile: ExtractProfile = DEFAULT_PROFILE):
+        self.profile = profile
+        self.root_matchers, self.drop_matchers, self.noise = _compile(profile)
+        # 開いている要素: (name, order, 捨てる配下か, 最も内側の HIDDEN_TEXT_TAGS 祖先)
+        self.stack: List[Tuple[str, int, bool, Optional[str]]] = []
+        self.order = 0
+        # strip 済み・空でない文字列（文書順）と、その種類（None = 通常 / "cdata" / HIDDEN_TEXT_TAGS の名前）
+        self.strings: List[str] = []
+        self.kinds: List[Optional[str]] = []
+        self._buf: List[str] = []
+        # PART_TAGS 要素: [order, 最初の文字列 index, 最後の文字列 index(終端)]
+        self.parts: List[List[int]] = []
+        self._open_parts: Dict[int, List[int]] = {}
+        # ROOT_SELECTORS ごとの最初の一致: [order, 最後の子孫 order, 文字列開始, 文字列終端]
+        self.roots: List[Optional[List[int]]] = [None] * len(self.root_matchers)
+        self._open_roots: Dict[int, List[List[int]]] = {}
+        self.root_names: List[str] = [""] * len(self.root_matchers)
+        # spec_tables: 行要素 [order, 最後の子孫 order, 行の種類, セル一覧 [セル名, 文字列開始, 文字列終端]]
+        self.rows: List[list] = []
+        self._row_stack: List[list] = []
+        self._open_cells: Dict[int, list] = {}
+
+    # ---- events ----
+    def data(self, text: str) -> None:
+        self._buf.append(text)
+
+    def flush(self) -> None:
+        """文字列の区切り（タグ・コメントなど）"""
+        if not self._buf:
+            return
+        text = "".join(self._buf).strip()
+        self._buf = []
+        if text and not (self.stack and self.stack[-1][2]):
+            self.strings.append(text)
+            self.kinds.append(self.stack[-1][3] if self.stack else None)
+
+    def cdata(self, text: str) -> None:
+        """CDATA 区間（template / rt などの配下でも型は CData）"""
+        text = text.strip()
+        if text and not (self.stack and self.stack[-1][2]):
+            self.strings.append(text)
+            self.kinds.append("cdata")
+
+    def start(self, name: str, attrs: Attrs) -> None:
+        self.flush()
+        parent_drop = bool(self.stack) and self.stack[-1][2]
+        container = name if name in HIDDEN_TEXT_TAGS else (self.stack[-1][3] if self.stack else None)
+        drop = parent_drop or name in self.profile.drop_tags or any(m(name, attrs) for m in self.drop_matchers)
+        self.order += 1
+        self.stack.append((name, self.order, drop, container))
+        if drop:
+            return
+        if name in PART_TAGS:
+            part = [self.order, len(self.strings), -1]
+            self.parts.append(part)
+            self._open_parts[self.order] = part
+        if self.profile.spec_tables:
+            if name in SPEC_ROWS:
+                row = [self.order, -1, name, []]
+                self.rows.append(row)
+                self._row_stack.append(row)
+            elif name in SPEC_CELLS and self._row_stack and name in SPEC_ROWS[self._row_stack[-1][2]]:
+                cell = [name, len(self.strings), -1]
+                self._row_stack[-1][3].append(cell)
+                self._open_cells[self.order] = cell
+        for i, (_sel, match) in enumerate(self.root_matchers):
+            if self.roots[i] is None and match(name, attrs):
+                root = [self.order, -1, len(self.strings), -1]
+                self.roots[i] = root
+                self.root_names[i] = name
+                self._open_roots.setdefault(self.order, []).append(root)
+
+    def end(self, name: str) -> None:
+        """name の要素（最も内側）まで閉じる。開いていなければ無視（文字列の区切りにはなる）"""
+        self.flush()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == name:
+                break
+        else:
+            return
+        while len(self.stack) > i:
+            self._close(self.stack.pop()[1])
+
+    def _close(self, order: int) -> None:
+        part = self._open_parts.pop(order, None)
+        if part is not None:
+            part[2] = len(self.strings)
+        for root in self._open_roots.pop(order, ()):
+            root[1] = self.order
+            root[3] = len(self.strings)
+        cell = self._open_cells.pop(order, None)
+        if cell is not None:
+            cell[2] = len(self.strings)
+        if self._row_stack and self._row_stack[-1][0] == order:
+            self._row_stack.pop()[1] = self.order
+
+    def close(self) -> None:
+        self.flush()
+        while self.stack:
+            self._close(self.stack.pop()[1])
+
+    # ---- result ----
+    def result(self) -> Tuple[str, str]:
+        root = None
+        root_name = ""
+        method = "fallback:document"
+        for (sel, _match), r, name in zip(self.root_matchers, self.roots, self.root_names):
+            if r is not None:
+                root, root_name, method = r, name, f"selector:{sel}"
+                break
+        if root is None:
+            first, last, s0, s1 = 0, self.order, 0, len(self.strings)
+        else:
+            first, last, s0, s1 = root
+
+        strings, kinds = self.strings, self.kinds
+
+        def _text(p0: int, p1: int) -> str:
+            return " ".join(strings[j] for j in range(p0, p1) if kinds[j] in (None, "cdata"))
+
+        # (order, 行) を文書順に並べる。スペック表の行の中にある PART_TAGS は表の行に含める
+        items = []
+        row_spans = []
+        for row_order, row_last, kind, cells in self.rows:
+            if not (first < row_order <= last):
+                continue
+            row_spans.append((row_order, row_last))
+            label_tag, _value_tag = SPEC_ROWS[kind]
+            texts = [(cell_tag, _text(c0, c1)) for cell_tag, c0, c1 in cells]
+            if kind == "tr":
+                # <th>項目<td>値…（th が無い2列の表は1列目を項目とみなす）
+                labels = [t for tag, t in texts if tag == label_tag and t]
+                values = [t for tag, t in texts if tag != label_tag and t]
+                if not labels and len(values) == 2:
+                    labels, values = values[:1], values[1:]
+                if labels and values:
+                    items.append((row_order, f"{labels[0]}: {' / '.join(values)}"))
+                continue
+            label = ""
+            for tag, text in texts:
+                if tag == label_tag:
+                    label = text
+                elif text:
+                    items.append((row_order, f"{label}: {text}" if label else text))
+
+        for order, p0, p1 in self.parts:
+            if first < order <= last and not any(r0 < order <= r1 for r0, r1 in row_spans):
+                text = _text(p0, p1)
+                if len(text) >= MIN_PART_CHARS:
+                    items.append((order, text))
+        if row_spans:
+            items.sort(key=lambda x: x[0])
+        lines = [t for _o, t in items]
+
+        if not lines:
+            # get_text() が拾う型は要素ごとに決まる（template なら TemplateString だけ）
+            if root_name in HIDDEN_TEXT_TAGS:
+                picked = [strings[j] for j in range(s0, s1) if kinds[j] == root_name]
+            else:
+                picked = [strings[j] for j in range(s0, s1) if kinds[j] in (None, "cdata")]
+            text_all = "\n".join(picked)
+            lines = [l.strip() for l in text_all.splitlines() if len(l.strip()) >= MIN_PART_CHARS]
+
+        if self.noise:
+            lines = [l for l in lines if not any(r.search(l) for r in self.noise)]
+        if self.profile.dedupe_lines:
+            lines = list(dict.fromkeys(lines))
+        return "\n".join(lines).strip(), method
+
+
+# ----------------------------
+# stream: html.parser のイベントをそのまま流す
+# ----------------------------
+_ENTITIES: Dict[str, str] = {}
+for _k, _v in html.entities.html5.items():
+    _ENTITIES.setdefault(_k.rstrip(";"), _v)
+
+
+def _numeric_char(n: int) -> str:
+    # bs4（UnicodeDammit.numeric_character_reference）と同じ変換
+    if 0x80 <= n <= 0x9F:
+        try:
+            return bytes([n]).decode("windows-1252")
+        except UnicodeDecodeError:
+            return chr(n)
+    if n == 0 or 0xD800 <= n <= 0xDFFF or n > 0x10FFFF:
+        return "�"
+    return chr(n)
+
+
+class _StreamParser(HTMLParser):
+    def __init__(self, collector: _TextCollector):
+        super().__init__(convert_charrefs=False)
+        self.c = collector
+        self._closed_void: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs)
+        if tag in VOID_TAGS:
+            self.c.end(tag)
+            self._closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs)
+        self.c.end(tag)
+
+    def _start(self, tag, attrs):
+        d: Attrs = {}
+        for k, v in attrs:
+            d[k] = "" if v is None else v
+        self.c.start(tag, d)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void:
+            self._closed_void.remove(tag)
+        else:
+            self.c.end(tag)
+
+    def handle_data(self, data):
+        self.c.data(data)
+
+    def handle_charref(self, name):
+        self.c.data(_numeric_char(int(name[1:], 16) if name[:1] in ("x", "X") else int(name)))
+
+    def handle_entityref(self, name):
+        self.c.data(_ENTITIES.get(name, "&" + name))
+
+    def handle_comment(self, data):
+        self.c.flush()
+
+    def handle_decl(self, decl):
+        self.c.flush()
+
+    def handle_pi(self, data):
+        self.c.flush()
+
+    def unknown_decl(self, data):
+        self.c.flush()
+        if data.upper().startswith("CDATA["):
+            self.c.cdata(data[len("CDATA["):])
+
+
+def extract_stream(html_text: str, profile: ExtractProfile = DEFAULT_PROFILE) -> Tuple[str, str]:
+    c = _TextCollector(profile)
+    p = _StreamParser(c)
+    p.feed(html_text)
+    p.close()
+    c.close()
+    return c.result()
+
+
+# ----------------------------
+# 木を作るパーサー: 木をたどって同じイベントを流す
+# ----------------------------
+def _feed_tree(c: _TextCollector, events: Iterable[Tuple[str, Any, Any]]) -> Tuple[str, str]:
+    for kind, a, b in events:
+        if kind == "start":
+            c.start(a, b)
+        elif kind == "end":
+            c.end(a)
+        elif kind == "data":
+            c.data(a)
+        else:
+            c.flush()
+    c.close()
+    return c.result()
+
+
+def _lxml_events(root) -> Iterator[Tuple[str, Any, Any]]:
+    from lxml import etree
+    for event, el in etree.iterwalk(root, events=("start", "end", "comment", "pi")):
+        if event == "start":
+            yield "start", el.tag, {k: v or "" for k, v in el.attrib.items()}
+            if el.text:
+                yield "data", el.text, None
+        elif event == "end":
+            yield "end", el.tag, None
+            if el.tail:
+                yield "data", el.tail, None
+        else:
+            yield "boundary", None, None
+            if el.tail:
+                yield "data", el.tail, None
+
+
+_XML_DECL_RE = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+def extract_lxml(html_text: str, profile: ExtractProfile = DEFAULT_PROFILE) -> Tuple[str, str]:
+    import lxml.html
+    from lxml.etree import ParserError
+    try:
+        # lxml は encoding 宣言付きの str を受け付けない
+        root = lxml.html.document_fromstring(_XML_DECL_RE.sub("", html_text))
+    except (ParserError, ValueError):
+        return "", "fallback:document"
+    return _feed_tree(_TextCollector(profile), _lxml_events(root))
+
+
+def _lexbor_events(root) -> Iterator[Tuple[str, Any, Any]]:
+    todo = [("node", root)]
+    while todo:
+        kind, node = todo.pop()
+        if kind == "end":
+            yield "end", node, None
+            continue
+        if node.is_text_node:
+            yield "data", node.text_content or "", None
+            continue
+        if not node.is_element_node:
+            yield "boundary", None, None
+            continue
+        yield "start", node.tag, {k: v or "" for k, v in node.attributes.items()}
+        todo.append(("end", node.tag))
+        children = []
+        child = node.child
+        while child is not None:
+            children.append(child)
+            child = child.next
+        todo.extend(("node", ch) for ch in reversed(children))
+
+
+def extract_selectolax(html_text: str, profile: ExtractProfile = DEFAULT_PROFILE) -> Tuple[str, str]:
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(html_text)
+    if tree.root is None:
+        return "", "fallback:document"
+    return _feed_tree(_TextCollector(profile), _lexbor_events(tree.root))
+
+
+def extract_bs4(html_text: str, profile: ExtractProfile = DEFAULT_PROFILE) -> Tuple[str, str]:
+    """従来実装（比較用）。既定プロファイル以外は stream で処理する"""
+    if profile != DEFAULT_PROFILE:
+        return extract_stream(html_text, profile)
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_text, "html.parser")
+    for tag in soup(list(DROP_TAGS)):
+        tag.decompose()
+
+    root, method = soup, "fallback:document"
+    for selector in ROOT_SELECTORS:
+        el = soup.select_one(selector)
+        if el:
+            root, method = el, f"selector:{selector}"
+            break
+
+    parts = []
+    for el in root.find_all(list(PART_TAGS)):
+        text = el.get_text(" ", strip=True)
+        if len(text) >= MIN_PART_CHARS:
+            parts.append(text)
+
+    if not parts:
+        text_all = root.get_text("\n", strip=True)
+        parts = [l.strip() for l in text_all.splitlines() if len(l.strip()) >= MIN_PART_CHARS]
+
+    return "\n".join(parts).strip(), method
+
+
+# ----------------------------
+# registry
+# ----------------------------
+def _importable(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def available_extractors() -> Dict[str, Extractor]:
+    """使えるバックエンド（優先順）"""
+    out: Dict[str, Extractor] = {}
+    if _importable("selectolax.lexbor"):
+        out["selectolax"] = extract_selectolax
+    if _importable("lxml.html"):
+        out["lxml"] = extract_lxml
+    out["stream"] = extract_stream
+    if _importable("bs4"):
+        out["bs4"] = extract_bs4
+    return out
+
+
+def get_extractor(name: str = "") -> Tuple[str, Extractor]:
+    backends = available_extractors()
+    name = (name or EXTRACTOR).strip().lower()
+    if name in backends:
+        return name, backends[name]
+    if name not in ("", "auto"):
+        logger.warning("extractor '%s' is not available; using auto", name)
+    first = next(n for n in AUTO_EXTRACTORS if n in backends)
+    return first, backends[first]
+
+
+EXTRACTOR_NAME, _extract = get_extractor()
+
+
+def extract_text(html_text: str, profile: ExtractProfile = DEFAULT_PROFILE) -> Tuple[str, str]:
+    """(本文テキスト, method) を返す。method は selector:<sel> / fallback:document"""
+    return _extract(html_text, profile)
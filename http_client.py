@@ -0,0 +1,152 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ----------------------------
+# 共有 HTTP クライアント（参考ページ取得 / Google CSE）
+#   - プロセスで1つの Session。ホストごとに keep-alive の接続プールを持つ（urllib3 のプールはスレッドセーフ）
+#   - 429 / 5xx と接続エラーはジッタ付き指数バックオフで再試行（Retry-After があれば従う）
+#   - gzip / deflate は requests が展開。brotli パッケージがあれば br も受け付ける
+#   - レスポンス本文は HTTP_MAX_BYTES で打ち切る（巨大ページで固まらないように）
+# ----------------------------
+HTTP_POOL_HOSTS = int(os.getenv("HOROLOGEN_HTTP_POOL_HOSTS", "32"))
+HTTP_POOL_SIZE = int(os.getenv("HOROLOGEN_HTTP_POOL_SIZE", "8"))
+HTTP_RETRIES = int(os.getenv("HOROLOGEN_HTTP_RETRIES", "2"))
+HTTP_BACKOFF_SEC = float(os.getenv("HOROLOGEN_HTTP_BACKOFF_MS", "300")) / 1000.0
+HTTP_MAX_BYTES = int(float(os.getenv("HOROLOGEN_HTTP_MAX_MB", "5")) * 1024 * 1024)
+USER_AGENT = "HoroloGen/1.0"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+try:
+    import brotli  # noqa: F401  urllib3 が br を展開できる
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+class _Client:
+    def __init__(self):
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING})
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.truncated = 0
+
+    def _count(self, **deltas) -> None:
+        with self._lock:
+            for k, v in deltas.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    @staticmethod
+    def _read_capped(resp: requests.Response, max_bytes: int) -> bool:
+        """本文を max_bytes まで読み込んで resp.content に入れる。打ち切ったら True"""
+        chunks = []
+        size = 0
+        truncated = False
+        try:
+            for chunk in resp.iter_content(64 * 1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    truncated = True
+                    break
+        finally:
+            resp.close()
+        resp._content = b"".join(chunks)[:max_bytes]
+        resp._content_consumed = True
+        return truncated
+
+    @staticmethod
+    def _backoff(attempt: int, resp: Optional[requests.Response]) -> float:
+        retry_after = resp.headers.get("Retry-After", "") if resp is not None else ""
+        if retry_after.isdigit():
+            return min(float(retry_after), 10.0)
+        return HTTP_BACKOFF_SEC * (2 ** attempt) * (0.5 + random.random())
+
+    def get(self, url: str, timeout: float = 15, max_bytes: Optional[int] = None,
+            retries: Optional[int] = None, **kwargs) -> requests.Response:
+        """
+        requests.get 相当。再試行し尽くした 429 / 5xx はそのレスポンスを返す（raise_for_status は呼び出し側）。
+        本文を打ち切った場合は resp.truncated = True。
+        """
+        max_bytes = HTTP_MAX_BYTES if max_bytes is None else max_bytes
+        retries = HTTP_RETRIES if retries is None else retries
+        attempt = 0
+        while True:
+            self._count(requests=1)
+            try:
+                resp = self.session.get(url, timeout=timeout, stream=True, **kwargs)
+            except requests.ConnectionError:
+                if attempt >= retries:
+                    self._count(errors=1)
+                    raise
+                self._count(retries=1)
+                time.sleep(self._backoff(attempt, None))
+                attempt += 1
+                continue
+
+            if resp.status_code in RETRY_STATUSES and attempt < retries:
+                resp.close()
+                self._count(retries=1)
+                time.sleep(self._backoff(attempt, resp))
+                attempt += 1
+                continue
+
+            resp.truncated = self._read_capped(resp, max_bytes)
+            if resp.truncated:
+                self._count(truncated=1)
+            return resp
+
+    def stats(self) -> Dict[str, Any]:
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        with pools.lock:
+            keys = list(pools.keys())
+        for key in keys:
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # num_requests / num_connections は urllib3 の接続プールが数えている
+            reqs = getattr(pool, "num_requests", 0)
+            conns = getattr(pool, "num_connections", 0)
+            hosts[f"{pool.scheme}://{pool.host}"] = {
+                "requests": reqs,
+                "connections": conns,
+                "reused": max(0, reqs - conns),
+            }
+        total_reqs = sum(h["requests"] for h in hosts.values())
+        total_conns = sum(h["connections"] for h in hosts.values())
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "truncated": self.truncated,
+                "connections_opened": total_conns,
+                "reuse_rate": round(1 - total_conns / total_reqs, 4) if total_reqs else 0.0,
+                "accept_encoding": ACCEPT_ENCODING,
+                "hosts": hosts,
+            }
+
+
+_client = _Client()
+
+
+def http_get(url: str, timeout: float = 15, max_bytes: Optional[int] = None,
+             retries: Optional[int] = None, **kwargs) -> requests.Response:
+    return _client.get(url, timeout=timeout, max_bytes=max_bytes, retries=retries, **kwargs)
+
+
+def http_stats() -> Dict[str, Any]:
+    return _client.stats()
@@ -0,0 +1,283 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from werkzeug.utils import secure_filename
+
+from models import JOB_OWNER, get_db_connection, job_lease_expired_sql, run_write, start_job_heartbeat
+from csv_import import check_csv_columns, import_csv, open_csv_stream
+import bulk_import
+from autocomplete import refresh_autocomplete_index
+
+# ----------------------------
+# Background import jobs
+#   - POST はファイルを保存してジョブ登録するだけ（即リダイレクト）
+#   - 取込本体は csv_import.import_csv をワーカースレッドで実行
+#   - 進捗は import_jobs テーブルに書き、/admin/upload/jobs/<id> でポーリング
+#   - 実行中は owner（models.JOB_OWNER）と heartbeat_at を持つ（heartbeat はチャンクの commit ごとにも更新）。
+#     起動時に failed にするのは heartbeat の途切れた running だけ（別プロセスで取込中のものは触らない）
+# ----------------------------
+# SQLite の書き込みは1本なので、取込ワーカーも1本で直列化する
+IMPORT_WORKERS = int(os.getenv("HOROLOGEN_IMPORT_WORKERS", "1"))
+
+# 秒未満まで記録（rows/sec・ETA の算出用）
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+_executor = ThreadPoolExecutor(max_workers=max(1, IMPORT_WORKERS), thread_name_prefix="horologen-import")
+
+
+class ImportRejected(Exception):
+    """ヘッダ不正などでジョブ登録前に弾いたもの（メッセージは画面表示用）"""
+
+
+def submit_import(file_storage, upload_folder: str) -> int:
+    """アップロードを保存してジョブを登録し、job_id を返す"""
+    filename = file_storage.filename or 'upload.csv'
+    stored_path = os.path.join(upload_folder, f"{uuid.uuid4().hex}_{secure_filename(filename) or 'upload.csv'}")
+    file_storage.save(stored_path)
+
+    # ヘッダだけ先に検証（不正ならジョブにしない）
+    try:
+        with open(stored_path, 'rb') as f:
+            column_error = check_csv_columns(open_csv_stream(f).fieldnames)
+    except UnicodeDecodeError:
+        column_error = 'CSVファイルはUTF-8で保存してください'
+    if column_error:
+        _remove_quietly(stored_path)
+        raise ImportRejected(column_error)
+
+    conn = get_db_connection()
+    try:
+        job_id = run_write(conn, lambda c: c.execute(
+            "INSERT INTO import_jobs (filename, stored_path, total_bytes) VALUES (?, ?, ?)",
+            (filename, stored_path, os.path.getsize(stored_path))
+        ).lastrowid)
+    finally:
+        conn.close()
+
+    _executor.submit(_run_job, job_id)
+    return job_id
+
+
+def submit_bulk_import(file_storages: List[Any], upload_folder: str) -> List[int]:
+    """
+    複数CSV / ZIP を保存し、CSVファイルごとにジョブを登録する。
+    パース・差分算出は bulk_import のワーカープロセスで並列、書き込みはこのワーカーで直列。
+    """
+    batch_dir = os.path.join(upload_folder, f"bulk_{uuid.uuid4().hex}")
+    os.makedirs(batch_dir, exist_ok=True)
+
+    saved = []
+    for i, fs in enumerate(file_storages):
+        name = fs.filename or f'upload_{i}'
+        path = os.path.join(batch_dir, f"{i:03d}_{secure_filename(name) or 'upload'}")
+        fs.save(path)
+        saved.append((path, name))
+
+    files = bulk_import.expand_inputs(saved, batch_dir)
+    for path, _name in saved:
+        if path not in {p for p, _ in files}:
+            _remove_quietly(path)  # 展開済みの ZIP 本体
+    if not files:
+        raise ImportRejected('CSVファイルが含まれていません')
+
+    conn = get_db_connection()
+    try:
+        def _insert_jobs(c) -> List[int]:
+            return [
+                c.execute(
+                    "INSERT INTO import_jobs (filename, stored_path, total_bytes) VALUES (?, ?, ?)",
+                    (name, path, os.path.getsize(path))
+                ).lastrowid
+                for path, name in files
+            ]
+
+        job_ids = run_write(conn, _insert_jobs)
+    finally:
+        conn.close()
+
+    _executor.submit(_run_bulk, job_ids, files)
+    return job_ids
+
+
+def resume_pending_jobs() -> None:
+    """
+    起動時に呼ぶ。
+    - running のうち heartbeat が JOB_LEASE_SEC 以上途切れたものは、途中までcommit済みのため failed 扱い
+      （再実行すると統計がずれる）。heartbeat が新しいもの（別プロセスで取込中）はそのまま
+    - queued のジョブは再投入（実行は claim できた1か所だけ）
+    """
+    conn = get_db_connection()
+    try:
+        _update_job(
+            conn,
+            f"UPDATE import_jobs SET status = 'failed', error = 'interrupted', finished_at = {_NOW} "
+            f"WHERE status = 'running' AND {job_lease_expired_sql()}"
+        )
+        queued = [r['id'] for r in conn.execute(
+            "SELECT id FROM import_jobs WHERE status = 'queued' ORDER BY id"
+        ).fetchall()]
+    finally:
+        conn.close()
+
+    for job_id in queued:
+        _executor.submit(_run_job, job_id)
+
+
+def _run_job(job_id: int) -> None:
+    start_job_heartbeat()
+    conn = get_db_connection()
+    try:
+        job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not job or job['status'] != 'queued':
+            return
+        if not _claim(conn, job_id):
+            return  # 別プロセスが先に開始した
+
+        with open(job['stored_path'], 'rb') as f:
+            def _progress(stats: Dict[str, Any]) -> None:
+                _update_job(
+                    conn,
+                    f"UPDATE import_jobs SET processed_rows = ?, processed_bytes = ?, heartbeat_at = {_NOW} "
+                    "WHERE id = ?",
+                    (stats['total_rows'], f.tell(), job_id)
+                )
+
+            stats = import_csv(conn, open_csv_stream(f), job['filename'], progress=_progress)
+
+        _update_job(
+            conn,
+            "UPDATE import_jobs SET status = 'done', processed_rows = ?, processed_bytes = total_bytes, "
+            f"upload_id = ?, finished_at = {_NOW} WHERE id = ?",
+            (stats['total_rows'], stats.get('upload_id'), job_id)
+        )
+        refresh_autocomplete_index(conn)
+        _remove_quietly(job['stored_path'])
+    except Exception as e:
+        try:
+            conn.rollback()
+            _update_job(
+                conn,
+                f"UPDATE import_jobs SET status = 'failed', error = ?, finished_at = {_NOW} WHERE id = ?",
+                (f'{type(e).__name__}: {e}', job_id)
+            )
+        except Exception:
+            pass
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _run_bulk(job_ids: List[int], files: List[Any]) -> None:
+    start_job_heartbeat()
+    conn = get_db_connection()
+
+    def _start(i: int) -> None:
+        _claim(conn, job_ids[i])
+
+    def _done(i: int, result: Dict[str, Any]) -> None:
+        stats = result['stats']
+        if result['column_error'] or result['error']:
+            _update_job(
+                conn,
+                f"UPDATE import_jobs SET status = 'failed', error = ?, upload_id = ?, finished_at = {_NOW} "
+                "WHERE id = ?",
+                (result['column_error'] or result['error'], stats.get('upload_id'), job_ids[i])
+            )
+        else:
+            _update_job(
+                conn,
+                "UPDATE import_jobs SET status = 'done', processed_rows = ?, processed_bytes = total_bytes, "
+                f"upload_id = ?, finished_at = {_NOW} WHERE id = ?",
+                (stats['total_rows'], stats.get('upload_id'), job_ids[i])
+            )
+            refresh_autocomplete_index(conn)
+        _remove_quietly(files[i][0])
+
+    try:
+        # パース中の待ち時間もジョブ側で running と分かるように先頭だけ先に開始
+        if job_ids:
+            _start(0)
+        bulk_import.run_bulk_import(files, on_file_start=_start, on_file_done=_done)
+    except Exception as e:
+        try:
+            conn.rollback()
+            _update_job(
+                conn,
+                f"UPDATE import_jobs SET status = 'failed', error = ?, finished_at = {_NOW} "
+                f"WHERE id IN ({', '.join('?' for _ in job_ids)}) AND status IN ('queued', 'running')",
+                (f'{type(e).__name__}: {e}', *job_ids)
+            )
+        except Exception:
+            pass
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        try:
+            os.rmdir(os.path.dirname(files[0][0]))
+        except (OSError, IndexError):
+            pass
+
+
+def _claim(conn, job_id: int) -> bool:
+    """queued → running（owner はこのプロセス）。既に他で始まっていれば False"""
+    return run_write(conn, lambda c: c.execute(
+        f"UPDATE import_jobs SET status = 'running', owner = ?, heartbeat_at = {_NOW}, started_at = {_NOW} "
+        "WHERE id = ? AND status = 'queued'", (JOB_OWNER, job_id)
+    ).rowcount) > 0
+
+
+def _update_job(conn, sql: str, params: tuple = ()) -> None:
+    """ジョブ状態の UPDATE（取込のチャンク書き込みとロックが競合しても再試行する）"""
+    run_write(conn, lambda c: c.execute(sql, params))
+
+
+def get_job(conn, job_id: int) -> Optional[Dict[str, Any]]:
+    """ポーリング用の進捗 dict（rows/sec と ETA 付き）"""
+    row = conn.execute("""
+        SELECT j.*,
+               (julianday(COALESCE(j.finished_at, 'now')) - julianday(j.started_at)) * 86400.0 AS elapsed_sec
+        FROM import_jobs j WHERE j.id = ?
+    """, (job_id,)).fetchone()
+    if not row:
+        return None
+
+    elapsed = float(row['elapsed_sec'] or 0.0)
+    rows_done = int(row['processed_rows'] or 0)
+    bytes_done = int(row['processed_bytes'] or 0)
+    total_bytes = int(row['total_bytes'] or 0)
+
+    rows_per_sec = (rows_done / elapsed) if elapsed > 0 else 0.0
+    eta_sec = None
+    if row['status'] == 'running' and elapsed > 0 and bytes_done > 0:
+        eta_sec = max(0.0, (total_bytes - bytes_done) / (bytes_done / elapsed))
+    elif row['status'] == 'done':
+        eta_sec = 0.0
+
+    return {
+        'id': row['id'],
+        'filename': row['filename'],
+        'status': row['status'],
+        'processed_rows': rows_done,
+        'processed_bytes': bytes_done,
+        'total_bytes': total_bytes,
+        'percent': int(bytes_done * 100 / total_bytes) if total_bytes else 0,
+        'rows_per_sec': round(rows_per_sec, 1),
+        'eta_sec': round(eta_sec, 1) if eta_sec is not None else None,
+        'elapsed_sec': round(elapsed, 1),
+        'upload_id': row['upload_id'],
+        'error': row['error'] or '',
+        'created_at': row['created_at'],
+    }
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
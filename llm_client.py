@@ -1,13 +1,21 @@
 import json
+import logging
 import os
 import re
-import requests
-from bs4 import BeautifulSoup
-from anthropic import Anthropic
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from anthropic import Anthropic, APIConnectionError
+
+import generation_metrics
+import page_cache
+from html_extract import EXTRACTOR_NAME, DEFAULT_PROFILE, ExtractProfile, extract_text as extract_html_text
+from http_client import http_get
 
 from urllib.parse import urlparse
 from typing import Tuple, Optional, Dict, Any, List
 
+logger = logging.getLogger(__name__)
+
 
 # ----------------------------
 # Anthropic client
@@ -16,7 +24,33 @@ MODEL = os.getenv("HOROLOGEN_CLAUDE_MODEL", "claude-sonnet-4-5")
 _api_key = os.getenv("ANTHROPIC_API_KEY")
 if not _api_key:
     raise RuntimeError("ANTHROPIC_API_KEY が未設定です（export してから起動してください）")
-client = Anthropic(api_key=_api_key)
+# 1回のモデル呼び出しの待ち時間の上限（SDK 既定の 600 秒だと詰まった呼び出しが記事全体の待ち時間を決めてしまう）
+LLM_TIMEOUT_SEC = float(os.getenv("HOROLOGEN_LLM_TIMEOUT_SEC", "120"))
+# SDK の自動再試行は使わない（隠れた再試行で呼び出し回数・待ち時間が予算の外で増えるので、
+# 一時的な API エラーの再試行も下の ARTICLE_RETRY_BUDGET から払い、llm_attempts に残す）
+client = Anthropic(api_key=_api_key, timeout=LLM_TIMEOUT_SEC, max_retries=0)
+
+# 取り直しは1記事あたりこの回数まで（tool 出力が使えなかった・一時的な API エラー。通常生成・言い換えで共有）
+ARTICLE_RETRY_BUDGET = int(os.getenv("HOROLOGEN_ARTICLE_RETRY_BUDGET", "1"))
+# 一時的な API エラーで取り直す前に待つ秒数（retry-after があればそれを、この上限まで）
+LLM_RETRY_WAIT_SEC = float(os.getenv("HOROLOGEN_LLM_RETRY_WAIT_SEC", "1"))
+LLM_RETRY_WAIT_MAX_SEC = 10.0
+
+
+def _retryable_api_error(e: Exception) -> bool:
+    """SDK が自動で再試行していたのと同じもの（接続エラー・タイムアウト・408 / 409 / 429 / 5xx）"""
+    if isinstance(e, APIConnectionError):
+        return True
+    status = getattr(e, "status_code", None)
+    return status in (408, 409, 429) or (status or 0) >= 500
+
+
+def _retry_wait_sec(e: Exception) -> float:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return min(LLM_RETRY_WAIT_MAX_SEC, max(0.0, float(headers.get("retry-after", ""))))
+    except ValueError:
+        return LLM_RETRY_WAIT_SEC
 
 
 # ----------------------------
@@ -185,7 +219,7 @@ TONE_PROFILES = {
 }
 
 
-def build_system(tone: str, has_reference_text: bool) -> str:
+def _tone_section(tone: str, has_reference_text: bool) -> str:
     profile = TONE_PROFILES.get(tone) or TONE_PROFILES.get("practical") or TONE_PROFILES["practical"]
     if has_reference_text:
         lo, hi = profile["chars_with_url"]
@@ -195,9 +229,7 @@ def build_system(tone: str, has_reference_text: bool) -> str:
         depth_note = "reference_url本文が薄い/ないため、深掘りを抑制し、安全な範囲でまとめる。"
 
     return (
-        SYSTEM_BASE
-        + "\n"
-        + profile["instructions"]
+        profile["instructions"]
         + f"\n【intro_text の文字数】\n- 目安：{lo}〜{hi}文字\n- {depth_note}\n"
         + "\n【intro_text の構成】\n"
           "- 段落ごとに1テーマ（読み物として自然に）\n"
@@ -205,6 +237,53 @@ def build_system(tone: str, has_reference_text: bool) -> str:
     )
 
 
+def build_system(tone: str, has_reference_text: bool) -> str:
+    return SYSTEM_BASE + "\n" + _tone_section(tone, has_reference_text)
+
+
+# ----------------------------
+# Prompt caching
+#   - 送る順は tools → system → messages。固定部分ほど前に置き、区切りに cache_control を付ける
+#     1) SYSTEM_BASE（ARTICLE_TOOL を含めて全生成で共通）
+#     2) トーン別の指示（トーン × 参考本文の有無で 8 通り）
+#     3) user プロンプト本体（tool 出力不正時の再試行で共通）
+#   - 言い換えの追加指示は区切りの後ろに別ブロックで足す（system が変わるので、読めるのは 1) 2) まで）
+#   - 最小長（モデルごとに約1024トークン）に満たない区切りはキャッシュされないだけで害はない
+# ----------------------------
+PROMPT_CACHE_ENABLED = os.getenv("HOROLOGEN_PROMPT_CACHE", "on").strip().lower() not in ("0", "off", "false")
+_CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def _text_block(text: str, cache: bool = False) -> Dict[str, Any]:
+    block: Dict[str, Any] = {"type": "text", "text": text}
+    if cache and PROMPT_CACHE_ENABLED:
+        block["cache_control"] = _CACHE_CONTROL
+    return block
+
+
+def build_system_blocks(tone: str, has_reference_text: bool) -> List[Dict[str, Any]]:
+    """build_system と同じ内容をキャッシュ区切り付きのブロックで"""
+    return [
+        _text_block(SYSTEM_BASE + "\n", cache=True),
+        _text_block(_tone_section(tone, has_reference_text), cache=True),
+    ]
+
+
+def _system_with(system: List[Dict[str, Any]], extra: str) -> List[Dict[str, Any]]:
+    """キャッシュ済みの system の後ろに追加指示を足す（元のリストは変えない）"""
+    return list(system) + [_text_block(extra)]
+
+
+def _user_content(u_prompt: Any) -> List[Dict[str, Any]]:
+    if isinstance(u_prompt, str):
+        return [_text_block(u_prompt, cache=True)]
+    return list(u_prompt)
+
+
+def _user_with(u_prompt: Any, extra: str) -> List[Dict[str, Any]]:
+    return _user_content(u_prompt) + [_text_block(extra)]
+
+
 # ----------------------------
 # Trust source registry
 # ----------------------------
@@ -242,6 +321,70 @@ TRUST_SOURCES: Dict[str, Dict[str, Any]] = {
 }
 
 
+# ----------------------------
+# Extraction profiles（TRUST_SOURCES と同じドメイン単位・同じホスト判定）
+#   汎用セレクタより先に試すルート、捨てる要素、スペック表の「項目: 値」化、ノイズ行、
+#   送る文字数（max_chars）と取得する本文の上限（max_bytes）をドメインごとに持つ
+# ----------------------------
+_SHOP_NOISE = (
+    r"^(シェア|ツイート|お気に入り|カートに入れる|カートに追加|お問い合わせ|店舗在庫|来店予約|ログイン|会員登録)",
+    r"(?i)^(share|tweet|add to (cart|bag|wishlist)|sign in|log in|subscribe|newsletter|accept (all )?cookies)",
+)
+_MEDIA_NOISE = _SHOP_NOISE + (
+    r"(?i)^(related|more from|read more|you may also like|advertisement|sponsored)",
+    r"^(関連記事|あわせて読みたい|人気記事|広告|PR)",
+)
+_MEDIA_DROP = (".related", ".related-posts", ".newsletter", ".comments", "#comments", ".share", ".sns", ".breadcrumb")
+
+_BRAND_PROFILE = dict(spec_tables=True, dedupe_lines=True, noise_patterns=_SHOP_NOISE,
+                      drop_selectors=(".breadcrumb", "form"), max_bytes=3 * 1024 * 1024)
+_RETAIL_PROFILE = dict(spec_tables=True, dedupe_lines=True, noise_patterns=_SHOP_NOISE,
+                       drop_selectors=(".breadcrumb", "form", ".recommend", ".ranking"),
+                       max_chars=6000, max_bytes=2 * 1024 * 1024)
+_MEDIA_PROFILE = dict(root_selectors=("article",), spec_tables=True, dedupe_lines=True,
+                      noise_patterns=_MEDIA_NOISE, drop_selectors=_MEDIA_DROP,
+                      max_chars=6000, max_bytes=1536 * 1024)
+
+EXTRACTION_PROFILES: Dict[str, ExtractProfile] = {
+    # A: ブランド公式（スペック表が本体。事実として使うので文字数は既定のまま）
+    **{d: ExtractProfile(name=d, **_BRAND_PROFILE) for d in (
+        "omegawatches.com", "omegawatches.jp", "cartier.com", "grand-seiko.com", "iwc.com", "panerai.com",
+    )},
+    # B: 正規店/販売店（context のみ。おすすめ・ランキング枠は捨てる）
+    **{d: ExtractProfile(name=d, **_RETAIL_PROFILE) for d in (
+        "eye-eye-isuzu.co.jp", "rasin.co.jp", "evance.co.jp",
+    )},
+    # C: 時計専門メディア（記事本文のみ。関連記事・コメント・購読枠は捨てる）
+    **{d: ExtractProfile(name=d, **_MEDIA_PROFILE) for d in (
+        "webchronos.net", "hodinkee.com", "monochrome-watches.com", "timeandtidewatches.com",
+        "fratellowatches.com", "watchesbysjx.com", "revolutionwatch.com", "swisswatches-magazine.com",
+        "wornandwound.com",
+    )},
+    # D: マーケット（出品詳細の表だけで足りる）
+    "chrono24.com": ExtractProfile(name="chrono24.com", spec_tables=True, dedupe_lines=True,
+                                   noise_patterns=_SHOP_NOISE, drop_selectors=(".breadcrumb", "form"),
+                                   max_chars=3000, max_bytes=1024 * 1024),
+    # E: UGC
+    "wikipedia.org": ExtractProfile(name="wikipedia.org", root_selectors=("#mw-content-text",), spec_tables=True,
+                                    drop_selectors=(".reference", ".mw-editsection", ".navbox", ".reflist",
+                                                    "#toc", ".toc", ".hatnote"),
+                                    max_chars=5000, max_bytes=2 * 1024 * 1024),
+    "note.com": ExtractProfile(name="note.com", **{**_MEDIA_PROFILE, "max_chars": 5000}),
+}
+
+
+def _match_host(host: str, registry: Dict[str, Any]) -> Optional[Any]:
+    """host が registry のドメイン（またはそのサブドメイン）なら値を返す"""
+    for domain, value in registry.items():
+        if host == domain or host.endswith("." + domain):
+            return value
+    return None
+
+
+def get_extract_profile(host: str) -> ExtractProfile:
+    return _match_host((host or "").lower(), EXTRACTION_PROFILES) or DEFAULT_PROFILE
+
+
 def get_source_policy(url: str) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
     if not url:
         return False, "", None
@@ -255,10 +398,9 @@ def get_source_policy(url: str) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
     except Exception:
         return False, "", None
 
-    for domain, policy in TRUST_SOURCES.items():
-        if host == domain or host.endswith("." + domain):
-            return True, host, policy
-
+    policy = _match_host(host, TRUST_SOURCES)
+    if policy is not None:
+        return True, host, policy
     return False, host, None
 
 
@@ -295,7 +437,65 @@ def _ref_hit(url: str, text: str, reference: str) -> bool:
 # ----------------------------
 # URL本文取得（安全版 / debug付き）
 # ----------------------------
-def fetch_page_text(url: str, max_chars: int = 8000, min_chars: int = 600) -> Tuple[str, bool, Dict[str, Any]]:
+# 参考URLは並列に取得する。全体の締め切りと、1ホストあたりのタイムアウト
+FETCH_DEADLINE_SEC = float(os.getenv("HOROLOGEN_FETCH_DEADLINE_SEC", "15"))
+FETCH_TIMEOUT_SEC = float(os.getenv("HOROLOGEN_FETCH_TIMEOUT_SEC", "8"))
+
+
+# 抽出ロジックを変えたら上げる（キャッシュ済みの抽出結果を作り直す）
+EXTRACT_VERSION = 1
+
+
+def _extract_text(html: str, meta: Dict[str, Any], max_chars: int, min_chars: int,
+                  profile: ExtractProfile = DEFAULT_PROFILE) -> Tuple[str, bool]:
+    """HTML から本文テキストを抜き出す。meta の method / extracted_* / filtered_reason を埋める"""
+    text, meta["method"] = extract_html_text(html, profile)
+
+    if not text:
+        meta["filtered_reason"] = "no_text_extracted"
+        return "", False
+
+    if len(text) > max_chars:
+        text = text[:max_chars]
+
+    meta["extracted_chars"] = len(text)
+    meta["extracted_preview"] = _safe_preview(text, 220)
+
+    ok = len(text) >= min_chars
+    if not ok and not meta["filtered_reason"]:
+        meta["filtered_reason"] = "too_short"
+    return text, ok
+
+
+# キャッシュに残す抽出結果の meta（URLごとの取得状況は毎回作り直す）
+_EXTRACT_META_KEYS = ("method", "extracted_chars", "extracted_preview", "filtered_reason")
+
+
+def _from_cache(entry: "page_cache.CachedPage", meta: Dict[str, Any], extract_key: str,
+                max_chars: int, min_chars: int, profile: ExtractProfile,
+                state: str) -> Tuple[str, bool, Dict[str, Any]]:
+    meta["fetch_ok"] = True
+    if state == "hit":
+        meta["status"] = entry.status
+    meta["cache"] = state
+    meta["cache_age_sec"] = int(entry.age_sec) if state != "revalidated" else 0
+    meta["cache_hits"] = entry.hit_count + 1
+    if entry.extract_key == extract_key:
+        for k in _EXTRACT_META_KEYS:
+            if k in entry.meta:
+                meta[k] = entry.meta[k]
+        text, ok = entry.text, entry.ok
+    else:
+        # 抽出条件だけ変わった：本文はキャッシュから、解析だけやり直す
+        text, ok = _extract_text(entry.html(), meta, max_chars, min_chars, profile)
+        meta["cache"] = state + "+reparsed"
+        page_cache.store_extraction(entry.url, extract_key, text, ok, {k: meta[k] for k in _EXTRACT_META_KEYS})
+    page_cache.mark_hit(entry.url, revalidated=(state == "revalidated"))
+    return text, ok, meta
+
+
+def fetch_page_text(url: str, max_chars: int = 8000, min_chars: int = 600,
+                    timeout: float = 15) -> Tuple[str, bool, Dict[str, Any]]:
     meta: Dict[str, Any] = {
         "url": url,
         "allowed": False,
@@ -306,6 +506,7 @@ def fetch_page_text(url: str, max_chars: int = 8000, min_chars: int = 600) -> Tu
         "extracted_chars": 0,
         "extracted_preview": "",
         "filtered_reason": "",
+        "cache": "miss",
     }
 
     url = (url or "").strip()
@@ -320,65 +521,155 @@ def fetch_page_text(url: str, max_chars: int = 8000, min_chars: int = 600) -> Tu
         meta["filtered_reason"] = "untrusted_domain"
         return "", False, meta
 
+    profile = get_extract_profile(host)
+    meta["profile"] = profile.name
+    max_chars = profile.max_chars or max_chars
+
+    # ページキャッシュ：TTL 内ならネットワークも解析もしない
+    extract_key = f"v{EXTRACT_VERSION}:{EXTRACTOR_NAME}:{profile.key}:{max_chars}:{min_chars}"
+    entry = page_cache.lookup(url)
+    if entry is not None and entry.fresh:
+        return _from_cache(entry, meta, extract_key, max_chars, min_chars, profile, "hit")
+
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
     try:
-        resp = requests.get(url, timeout=15, headers={"User-Agent": "HoroloGen/1.0"})
+        resp = http_get(url, timeout=timeout, headers=headers, max_bytes=profile.max_bytes)
         meta["status"] = getattr(resp, "status_code", None)
+        if resp.status_code == 304 and entry is not None:
+            return _from_cache(entry, meta, extract_key, max_chars, min_chars, profile, "revalidated")
         resp.raise_for_status()
         meta["fetch_ok"] = True
+        if getattr(resp, "truncated", False):
+            meta["body_truncated"] = True
         if not resp.encoding or resp.encoding.lower() == "iso-8859-1":
             resp.encoding = resp.apparent_encoding
     except Exception as e:
         meta["filtered_reason"] = f"request_failed:{type(e).__name__}"
         return "", False, meta
 
-    soup = BeautifulSoup(resp.text, "html.parser")
-    for tag in soup(["script", "style", "noscript", "header", "footer", "nav", "aside"]):
-        tag.decompose()
-
-    # できるだけ本文っぽいところを拾う
-    candidates = []
-    for selector in ["main", "article", '[role="main"]', ".article", ".post", ".content", ".entry-content", ".post-content"]:
-        el = soup.select_one(selector)
-        if el:
-            candidates.append((selector, el))
+    text, ok = _extract_text(resp.text, meta, max_chars, min_chars, profile)
+    page_cache.store(
+        url,
+        status=resp.status_code,
+        etag=resp.headers.get("ETag", ""),
+        last_modified=resp.headers.get("Last-Modified", ""),
+        encoding=resp.encoding or "",
+        body=resp.content,
+        extract_key=extract_key,
+        text=text,
+        ok=ok,
+        meta={k: meta[k] for k in _EXTRACT_META_KEYS},
+    )
+    return text, ok, meta
 
-    if candidates:
-        sel, root = candidates[0]
-        meta["method"] = f"selector:{sel}"
-    else:
-        root = soup
-        meta["method"] = "fallback:document"
 
-    parts = []
-    for el in root.find_all(["h1", "h2", "h3", "p", "li"]):
-        text = el.get_text(" ", strip=True)
-        if not text:
-            continue
-        if len(text) < 15:
+def _parse_host_timeouts(raw: str) -> Dict[str, float]:
+    """HOROLOGEN_FETCH_HOST_TIMEOUTS="omegawatches.jp=12,chrono24.com=5" → {host: 秒}"""
+    out: Dict[str, float] = {}
+    for item in (raw or "").split(","):
+        host, _, sec = item.partition("=")
+        host = host.strip().lower()
+        try:
+            if host:
+                out[host] = float(sec)
+        except ValueError:
             continue
-        parts.append(text)
+    return out
 
-    if not parts:
-        text_all = root.get_text("\n", strip=True)
-        lines = [l.strip() for l in text_all.splitlines() if len(l.strip()) >= 15]
-        parts = lines
 
-    text = "\n".join(parts).strip()
+FETCH_HOST_TIMEOUTS = _parse_host_timeouts(os.getenv("HOROLOGEN_FETCH_HOST_TIMEOUTS", ""))
 
-    if not text:
-        meta["filtered_reason"] = "no_text_extracted"
-        return "", False, meta
 
-    if len(text) > max_chars:
-        text = text[:max_chars]
+def _host_timeout(host: str) -> float:
+    sec = _match_host(host, FETCH_HOST_TIMEOUTS)
+    return FETCH_TIMEOUT_SEC if sec is None else sec
 
-    meta["extracted_chars"] = len(text)
-    meta["extracted_preview"] = _safe_preview(text, 220)
 
-    ok = len(text) >= min_chars
-    if not ok and not meta["filtered_reason"]:
-        meta["filtered_reason"] = "too_short"
-    return text, ok, meta
+def _unfetched_meta(url: str, reason: str, latency_ms: int) -> Dict[str, Any]:
+    allowed, host, _policy = get_source_policy(url)
+    return {
+        "url": url,
+        "allowed": bool(allowed),
+        "host": host,
+        "fetch_ok": False,
+        "status": None,
+        "method": "",
+        "extracted_chars": 0,
+        "extracted_preview": "",
+        "filtered_reason": reason,
+        "latency_ms": latency_ms,
+        "ref_hit": False,
+    }
+
+
+def fetch_reference_pages(urls: List[str], reference: str,
+                          deadline_sec: Optional[float] = None) -> List[Tuple[str, str, bool, Dict[str, Any]]]:
+    """
+    参考URLを並列に取得し、urls と同じ順で (url, text, ok, meta) を返す。
+    - 各URLのタイムアウトはホスト別（既定 FETCH_TIMEOUT_SEC）、全体は deadline_sec で打ち切る
+    - ok かつ ref_hit のページが取れた時点で、残りは待たない
+    - meta["latency_ms"] に取得にかかった時間、meta["ref_hit"] に型番一致を入れる
+    """
+    if not urls:
+        return []
+    deadline_sec = FETCH_DEADLINE_SEC if deadline_sec is None else deadline_sec
+    started = time.monotonic()
+
+    def _one(u: str) -> Tuple[str, bool, Dict[str, Any]]:
+        t0 = time.monotonic()
+        _allowed, host, _policy = get_source_policy(u)
+        remaining = max(0.5, deadline_sec - (t0 - started))
+        text, ok, meta = fetch_page_text(u, timeout=min(_host_timeout(host), remaining))
+        meta["latency_ms"] = int((time.monotonic() - t0) * 1000)
+        meta["ref_hit"] = bool(_ref_hit(u, text, reference))
+        generation_metrics.record("page_fetch", meta["latency_ms"], detail=host,
+                                  cache=meta.get("cache") if meta.get("allowed") else None,
+                                  outcome="ok" if ok else (meta.get("filtered_reason") or f"status:{meta.get('status')}"))
+        return text, ok, meta
+
+    results: Dict[int, Tuple[str, bool, Dict[str, Any]]] = {}
+    pool = ThreadPoolExecutor(max_workers=len(urls), thread_name_prefix="horologen-fetch")
+    futures = {pool.submit(generation_metrics.bind(_one), u): i for i, u in enumerate(urls)}
+    pending = set(futures)
+    stop_reason = "deadline_exceeded"
+    try:
+        while pending:
+            remaining = deadline_sec - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            hit = False
+            for f in done:
+                i = futures[f]
+                try:
+                    results[i] = f.result()
+                except Exception as e:
+                    elapsed = int((time.monotonic() - started) * 1000)
+                    results[i] = ("", False, _unfetched_meta(urls[i], f"fetch_error:{type(e).__name__}", elapsed))
+                text, ok, meta = results[i]
+                hit = hit or (ok and meta.get("ref_hit"))
+            if hit and pending:
+                stop_reason = "skipped_after_ref_hit"
+                break
+    finally:
+        # 走っている取得は待たずに返す（スレッドは各自のタイムアウトで終わる）
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = int((time.monotonic() - started) * 1000)
+    out = []
+    for i, u in enumerate(urls):
+        if i in results:
+            text, ok, meta = results[i]
+        else:
+            text, ok, meta = "", False, _unfetched_meta(u, stop_reason, elapsed)
+        out.append((u, text or "", bool(ok), meta))
+    return out
 
 
 # ----------------------------
@@ -685,12 +976,84 @@ def _pick_tool_input(message) -> Dict[str, Any]:
 
     return {}
 
-def _is_valid_article_dict(d: Dict[str, Any]) -> bool:
-    if not isinstance(d, dict):
-        return False
-    it = (d.get("intro_text") or "").strip()
-    st = (d.get("specs_text") or "").strip()
-    return bool(it) and bool(st)
+# ----------------------------
+# Streaming: tool 入力（部分JSON）から intro_text を逐次取り出す
+# ----------------------------
+_INTRO_KEY_RE = re.compile(r'(?<!\\)"intro_text"\s*:\s*"')
+_JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class IntroDeltaDecoder:
+    """
+    input_json_delta の partial_json を順に feed し、intro_text の文字列値のうち新しく確定した部分を返す。
+    エスケープ（\\uXXXX のサロゲートペアを含む）が途中で切れている場合は次の feed まで持ち越す。
+    表示用の先出しで、最終的な値は確定した tool 入力を使う。
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = -1      # intro_text の値の中の、次に読む位置（-1 = まだキーが来ていない）
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        if self.done or not chunk:
+            return ""
+        self.buf += chunk
+        if self.pos < 0:
+            m = _INTRO_KEY_RE.search(self.buf)
+            if not m:
+                return ""
+            self.pos = m.end()
+
+        out = []
+        buf, i, n = self.buf, self.pos, len(self.buf)
+        while i < n:
+            c = buf[i]
+            if c == '"':
+                self.done = True
+                break
+            if c != '\\':
+                out.append(c)
+                i += 1
+                continue
+            if i + 1 >= n:
+                break
+            e = buf[i + 1]
+            if e != 'u':
+                out.append(_JSON_ESCAPES.get(e, e))
+                i += 2
+                continue
+            if i + 6 > n:
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # 上位サロゲート：続く \\uXXXX（下位）と組にする
+                if i + 12 > n:
+                    break
+                low = int(buf[i + 8:i + 12], 16) if buf[i + 6:i + 8] == '\\u' else 0
+                if 0xDC00 <= low < 0xE000:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+            out.append(chr(code))
+            i += 6
+        self.pos = i
+        return "".join(out)
+
+
+def _stream_message(params: Dict[str, Any], on_event) -> Any:
+    """messages.stream で受けながら intro_text の差分を on_event("delta", text) に流し、最終メッセージを返す"""
+    decoder = IntroDeltaDecoder()
+    with client.messages.stream(**params) as stream:
+        for event in stream:
+            if event.type != "content_block_delta":
+                continue
+            delta = event.delta
+            if getattr(delta, "type", None) == "input_json_delta":
+                text = decoder.feed(getattr(delta, "partial_json", "") or "")
+                if text:
+                    on_event("delta", text)
+        return stream.get_final_message()
 
 
 # ----------------------------
@@ -729,13 +1092,72 @@ def similarity_level(pct: int) -> str:
 
 
 # ----------------------------
-# Main entry: generate_article
-# rewrite_mode:
-#   "none"  : 通常生成
-#   "force" : 必ず1回だけ「言い換え再生成」
-#   "auto"  : 類似が高いときだけ1回だけ言い換え
+# Generation steps（generate_article とバッチ生成で共通）
 # ----------------------------
-def generate_article(payload: dict, rewrite_mode: str = "none") -> tuple[str, str, Dict[str, Any]]:
+def build_payload(brand: str, reference: str, facts: Dict[str, Any], editor_note: str,
+                  reference_urls: List[str], tone: str = "practical",
+                  include_brand_profile: bool = False, include_wearing_scenes: bool = False) -> dict:
+    """generate_article に渡す payload（単発生成・バッチ生成で共通）"""
+    return {
+        'product': {'brand': brand, 'reference': reference},
+        'facts': facts,
+        'style': {'tone': tone, 'writing_variant_id': 1},
+        'options': {
+            'include_brand_profile': include_brand_profile,
+            'include_wearing_scenes': include_wearing_scenes
+        },
+        'constraints': {'target_intro_chars': 1500, 'max_specs_chars': 1000},
+        'editor_note': editor_note,
+        'reference_urls': reference_urls,
+        'reference_url': reference_urls[0] if reference_urls else "",
+    }
+
+
+def article_request_params(system: Any, u_prompt: Any, temperature: float = 0.3) -> Dict[str, Any]:
+    """
+    messages.create / Message Batches の params（tool_use で固定JSON出力）。
+    system / u_prompt は文字列またはブロックのリスト（文字列の user プロンプトはキャッシュ区切り付きにする）
+    """
+    return dict(
+        model=MODEL,
+        max_tokens=2300,
+        temperature=temperature,
+        system=system,
+        messages=[{"role": "user", "content": _user_content(u_prompt)}],
+        tools=[ARTICLE_TOOL],
+        tool_choice={"type": "tool", "name": "return_article"},
+    )
+
+
+_USAGE_KEYS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+
+def message_usage(message) -> Dict[str, int]:
+    """応答の usage（オブジェクト / dict どちらでも）。キャッシュ項目が無い SDK では 0"""
+    usage = getattr(message, "usage", None)
+    if usage is None and isinstance(message, dict):
+        usage = message.get("usage")
+    out = {}
+    for k in _USAGE_KEYS:
+        v = usage.get(k) if isinstance(usage, dict) else getattr(usage, k, None)
+        out[k] = int(v or 0)
+    return out
+
+
+def add_usage(total: Dict[str, int], message, latency_ms: int = 0) -> None:
+    """1回のモデル呼び出し分を total に足す（payload_json の llm_usage 用）"""
+    for k, v in message_usage(message).items():
+        total[k] = total.get(k, 0) + v
+    total["calls"] = total.get("calls", 0) + 1
+    total["latency_ms"] = total.get("latency_ms", 0) + int(latency_ms)
+
+
+def prepare_article(payload: dict) -> Dict[str, Any]:
+    """
+    参考URLの取得・採用URL選定・本文結合・プロンプト組み立てまで。
+    戻り値 ctx は JSON 化できる dict（バッチ生成では結果の回収まで DB に保存する）。
+    payload["reference_url"] は採用URLに書き換わる。
+    """
     product = payload.get("product", {}) or {}
     ref_code = (product.get("reference") or "").strip()
 
@@ -773,13 +1195,13 @@ def generate_article(payload: dict, rewrite_mode: str = "none") -> tuple[str, st
             "preview": "",
             "filtered_reason": "no_reference_urls_in_payload",
             "ref_hit": False,
+            "latency_ms": 0,
         })
 
-    # 1) 取得
-    for u in reference_urls:
-        text, ok, meta = fetch_page_text(u)
-        hit = _ref_hit(u, text, ref_code)
-        meta["ref_hit"] = bool(hit)
+    # 1) 取得（並列 / 締め切り付き）
+    fetch_t0 = time.monotonic()
+    for u, text, ok, meta in fetch_reference_pages(reference_urls, ref_code):
+        hit = bool(meta.get("ref_hit"))
 
         per_url_texts.append({"url": u, "text": text or ""})
 
@@ -790,16 +1212,22 @@ def generate_article(payload: dict, rewrite_mode: str = "none") -> tuple[str, st
             "fetch_ok": meta.get("fetch_ok"),
             "status": meta.get("status"),
             "method": meta.get("method"),
+            "profile": meta.get("profile", ""),
             "chars": meta.get("extracted_chars", 0),
             "ok": bool(ok),
             "preview": meta.get("extracted_preview", ""),
             "filtered_reason": meta.get("filtered_reason", ""),
-            "ref_hit": bool(hit),
+            "ref_hit": hit,
+            "latency_ms": meta.get("latency_ms", 0),
+            "cache": meta.get("cache", ""),
+            "cache_age_sec": meta.get("cache_age_sec"),
+            "cache_hits": meta.get("cache_hits", 0),
         })
 
         if len(text) > len(best_text):
             best_text = text
             best_url = u
+    fetch_ms = int((time.monotonic() - fetch_t0) * 1000)
 
     # 2) 採用URL選定（ref_hit優先 → ok優先 → 最長）
     for item in per_url_debug:
@@ -840,88 +1268,31 @@ def generate_article(payload: dict, rewrite_mode: str = "none") -> tuple[str, st
         total += len(block)
 
     combined_reference_text = "\n\n---\n\n".join(combined_blocks).strip()
+    generation_metrics.record("references", fetch_ms, detail=f"{len(reference_urls)} urls",
+                              outcome="ok" if chosen_url else "no_reference")
 
     # build_user_prompt が表示に使う代表URL
     payload["reference_url"] = chosen_url
 
     has_ref = bool(len(combined_reference_text) >= 400)
     tone = (payload.get("style", {}) or {}).get("tone", "practical")
-    system = build_system(tone, has_reference_text=has_ref)
+    system = build_system_blocks(tone, has_reference_text=has_ref)
     user_prompt = build_user_prompt(payload, combined_reference_text)
 
-    def _call_claude(sys_text: str, u_prompt: str, temperature: float = 0.3):
-        return client.messages.create(
-            model=MODEL,
-            max_tokens=2300,
-            temperature=temperature,
-            system=sys_text,
-            messages=[{"role": "user", "content": u_prompt}],
-            tools=[ARTICLE_TOOL],
-            tool_choice={"type": "tool", "name": "return_article"},
-        )
-
-    def _extract_once(sys_text: str, u_prompt: str, temperature: float = 0.3) -> Dict[str, Any]:
-        # 1) tools を使って通常実行
-        msg = _call_claude(sys_text, u_prompt, temperature=temperature)
-        print(f"[HoroloGen] MODEL={MODEL}")
-        data = _pick_tool_input(msg)
-        if isinstance(data, dict) and data:
-            return data
-
-        # LOG: tool_use が無い/空の場合の診断ログ（原因追跡用）
-        if not data:
-            try:
-                blocks = getattr(msg, "content", None) or []
-                types = []
-                tool_names = []
-                for b in blocks:
-                    if isinstance(b, dict):
-                        types.append(b.get("type"))
-                        if b.get("type") == "tool_use":
-                            tool_names.append(b.get("name"))
-                    else:
-                        types.append(getattr(b, "type", None))
-                        if getattr(b, "type", None) == "tool_use":
-                            tool_names.append(getattr(b, "name", None))
-                preview = (_message_text(msg) or "")[:500]
-                print(f"[HoroloGen] WARN: tool_use missing/empty. stop_reason={getattr(msg,'stop_reason',None)} content_types={types} tool_names={tool_names} text_preview={preview}")
-            except Exception:
-                pass
-
-        # 2) tool_use が無い場合：textからJSONを拾う保険
-        txt = _message_text(msg)
-        data2 = _extract_json_object_from_text(txt)
-        if _is_valid_article_dict(data2):
-            return data2
-
-        # 3) 最終保険：tools無しで「JSONだけ出せ」で再試行して拾う
-        sys2 = sys_text + "\n\n【重要】ツール出力が失敗した場合は、本文にJSONのみで返してください。"
-        u2 = u_prompt + "\n\n【出力形式】必ずJSONのみ。キーは intro_text と specs_text の2つ。余計な文章は禁止。"
-        try:
-            msg2 = client.messages.create(
-                model=MODEL,
-                max_tokens=2300,
-                temperature=temperature,
-                system=sys2,
-                messages=[{"role": "user", "content": u2}],
-            )
-            txt2 = _message_text(msg2)
-            data3 = _extract_json_object_from_text(txt2)
-            if _is_valid_article_dict(data3):
-                return data3
-        except Exception:
-            pass
-
-        # ダメなら空を返す（呼び元で例外）
-        return {}
+    return {
+        "per_url_debug": per_url_debug,
+        "chosen_url": chosen_url,
+        "chosen_reason": chosen_reason,
+        "chosen_chars": len(chosen_text or ""),
+        "combined_reference_text": combined_reference_text,
+        "fetch_ms": fetch_ms,
+        "system": system,
+        "user_prompt": user_prompt,
+    }
 
-    # 4) 通常生成（tool不正に備えて最大2回）
-    data = _extract_once(system, user_prompt, temperature=0.3)
-    if not _is_valid_article_dict(data):
-        data2 = _extract_once(system, user_prompt, temperature=0.3)
-        if _is_valid_article_dict(data2):
-            data = data2
 
+def article_texts(data: Dict[str, Any], payload: dict) -> Tuple[str, str]:
+    """tool 出力から (intro, specs)。specs 欠損は canonical から補い、不正・煽り表現は ValueError"""
     intro = (data.get("intro_text") or "").strip()
     specs = (data.get("specs_text") or "").strip()
 
@@ -937,12 +1308,177 @@ def generate_article(payload: dict, rewrite_mode: str = "none") -> tuple[str, st
     hits = validate_no_hype(intro)
     if hits:
         raise ValueError(f"煽り表現が検出されました: {hits}")
+    return intro, specs
+
 
-    # 5) 類似度
+_REPAIR_PROMPT = """
+
+[修正指示]
+直前の出力は次の理由で使えませんでした：{reason}
+上の指示はそのままに、必ず return_article ツールで intro_text と specs_text の両方を返してください。
+"""
+
+
+def check_article(message, payload: dict) -> Tuple[Optional[Tuple[str, str]], str, str]:
+    """
+    応答から (intro, specs) を取り出す。使えなければ (None, 分類, 理由)。
+    分類: "no_tool_use"（tool 入力も本文の JSON も無い）/ "invalid"（本文が空）/ "hype"（煽り表現）
+    """
+    data = _pick_tool_input(message)
+    if not data:
+        data = _extract_json_object_from_text(_message_text(message))
+    if not data:
+        try:
+            types = [b.get("type") if isinstance(b, dict) else getattr(b, "type", None)
+                     for b in (getattr(message, "content", None) or [])]
+            preview = (_message_text(message) or "")[:500]
+            logger.warning("tool_use missing/empty. stop_reason=%s content_types=%s text_preview=%s",
+                           getattr(message, "stop_reason", None), types, preview)
+        except Exception:
+            pass
+        return None, "no_tool_use", "return_article ツールの呼び出しがありませんでした"
+
+    intro = (data.get("intro_text") or "").strip()
+    if not intro:
+        return None, "invalid", f"intro_text が空でした（keys={list(data.keys())}）"
+    hits = validate_no_hype(intro)
+    if hits:
+        return None, "hype", f"煽り表現が検出されました: {hits}"
+    try:
+        return article_texts(data, payload), "ok", ""
+    except ValueError as e:
+        return None, "invalid", str(e)
+
+
+def build_ref_meta(ctx: Dict[str, Any], sim_before: int, sim_after: int, rewrite_applied: bool) -> Dict[str, Any]:
+    combined_reference_text = ctx["combined_reference_text"]
+    return {
+        "selected_reference_url": ctx["chosen_url"],
+        "selected_reference_reason": ctx["chosen_reason"],
+        "selected_reference_chars": ctx["chosen_chars"],
+        "combined_reference_chars": len(combined_reference_text or ""),
+        "combined_reference_preview": _safe_preview(combined_reference_text, 360),
+        "reference_urls_debug": ctx["per_url_debug"],
+        "reference_fetch_ms": ctx["fetch_ms"],
+
+        # similarity (final)
+        "similarity_percent": int(sim_after),
+        "similarity_level": str(similarity_level(sim_after)),
+
+        # debug
+        "similarity_before_percent": int(sim_before),
+        "similarity_before_level": str(similarity_level(sim_before)),
+        "rewrite_applied": bool(rewrite_applied),
+    }
+
+
+def finish_article(message, payload: dict, ctx: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+    """応答メッセージから言い換え無しで仕上げる（バッチ生成の結果回収用）"""
+    texts, _outcome, reason = check_article(message, payload)
+    if texts is None:
+        raise ValueError(reason)
+    intro, specs = texts
+    sim = similarity_percent(intro, ctx["combined_reference_text"])
+    ref_meta = build_ref_meta(ctx, sim, sim, False)
+    usage: Dict[str, int] = {}
+    add_usage(usage, message)
+    ref_meta["llm_usage"] = usage
+    ref_meta["llm_attempts"] = [{"stage": "generate", "strategy": "batch", "outcome": "ok", **message_usage(message)}]
+    return intro, specs, ref_meta
+
+
+# ----------------------------
+# Main entry: generate_article
+# rewrite_mode:
+#   "none"  : 通常生成
+#   "force" : 必ず1回だけ「言い換え再生成」
+#   "auto"  : 類似が高いときだけ1回だけ言い換え
+# ----------------------------
+def generate_article(payload: dict, rewrite_mode: str = "none", on_event=None,
+                     ctx: Optional[Dict[str, Any]] = None) -> tuple[str, str, Dict[str, Any]]:
+    """
+    on_event(kind, data) を渡すとストリーミングで呼び出し、途中経過を通知する:
+      "references" 参考URLの取得・選定が終わった（data: 採用URL・理由・取得時間）
+      "attempt"    モデル呼び出しを開始（再試行・言い換えでは表示中の本文を捨てる）
+      "delta"      intro_text の追加分（data: str）
+    煽り表現チェック・類似度は最後の応答がそろってから（戻り値は非ストリーミングと同じ）
+    ctx は prepare_article(payload) 済みなら渡す（参考ページを取り直さない）
+    """
+    if ctx is None:
+        ctx = prepare_article(payload)
+    system = ctx["system"]
+    user_prompt = ctx["user_prompt"]
+    combined_reference_text = ctx["combined_reference_text"]
+
+    if on_event:
+        on_event("references", {
+            "selected_reference_url": ctx["chosen_url"],
+            "selected_reference_reason": ctx["chosen_reason"],
+            "reference_fetch_ms": ctx["fetch_ms"],
+        })
+
+    usage: Dict[str, int] = {}
+    attempts: List[Dict[str, Any]] = []  # 呼び出しごとの段階・方法・結果・待ち時間・トークン数
+    budget = [ARTICLE_RETRY_BUDGET]
+
+    def _call_claude(sys_text: Any, u_prompt: Any, temperature: float):
+        params = article_request_params(sys_text, u_prompt, temperature)
+        if on_event:
+            on_event("attempt", {"n": usage.get("calls", 0) + 1})
+            msg = _stream_message(params, on_event)
+        else:
+            msg = client.messages.create(**params)
+        return msg
+
+    def _structured(stage: str, sys_text: Any, u_prompt: Any,
+                    temperature: float) -> Tuple[Optional[Tuple[str, str]], str]:
+        """
+        tool を強制して (intro, specs) を取る。使えなければ、残りの予算があるうちは
+        同じ前置き（キャッシュ区切りそのまま）に修正指示を足して取り直す。使い切ったら (None, 理由)。
+        一時的な API エラーも同じ予算で同じプロンプトを取り直す（使い切ったら例外のまま）
+        """
+        prompt, strategy, n = u_prompt, "tool", 0
+        while True:
+            n += 1
+            t0 = time.monotonic()
+            try:
+                msg = _call_claude(sys_text, prompt, temperature)
+            except Exception as e:
+                latency_ms = (time.monotonic() - t0) * 1000
+                generation_metrics.record(f"model.{stage}", latency_ms, attempt=n,
+                                          outcome="error", detail=f"{strategy}:{type(e).__name__}")
+                attempts.append({"stage": stage, "strategy": strategy, "outcome": "error",
+                                 "error": type(e).__name__, "latency_ms": int(latency_ms)})
+                if not _retryable_api_error(e) or budget[0] <= 0:
+                    raise
+                budget[0] -= 1
+                time.sleep(_retry_wait_sec(e))
+                continue
+            latency_ms = (time.monotonic() - t0) * 1000
+            add_usage(usage, msg, latency_ms)
+            texts, outcome, reason = check_article(msg, payload)
+            stop_reason = getattr(msg, "stop_reason", None)
+            attempts.append({"stage": stage, "strategy": strategy, "outcome": outcome, "stop_reason": stop_reason,
+                             "latency_ms": int(latency_ms), **message_usage(msg)})
+            generation_metrics.record(f"model.{stage}", latency_ms, attempt=n, outcome=outcome, detail=strategy,
+                                      stop_reason=stop_reason, **message_usage(msg))
+            if texts is not None:
+                return texts, ""
+            if budget[0] <= 0:
+                return None, reason
+            budget[0] -= 1
+            prompt, strategy = _user_with(u_prompt, _REPAIR_PROMPT.format(reason=reason)), "repair"
+
+    # 通常生成（予算内で1回まで取り直し）
+    texts, reason = _structured("generate", system, user_prompt, 0.3)
+    if texts is None:
+        raise ValueError(reason)
+    intro, specs = texts
+
+    # 類似度
     sim_before = similarity_percent(intro, combined_reference_text)
-    lvl_before = similarity_level(sim_before)
 
-    # 6) 言い換え再生成（任意/自動/強制）
+    # 言い換え再生成（任意/自動/強制）
     do_rewrite = False
     if rewrite_mode == "force":
         do_rewrite = True
@@ -950,12 +1486,11 @@ def generate_article(payload: dict, rewrite_mode: str = "none") -> tuple[str, st
         do_rewrite = True
 
     sim_after = sim_before
-    lvl_after = lvl_before
 
     if do_rewrite:
-        rewrite_system = system + "\n\n【言い換え再生成（重要）】\n- reference_url本文の表現の“言い回し”は流用しない\n- 構成と文のつながりを組み替え、同義の言い換えを徹底する\n- 固有名詞・型番・数値は保持する\n"
+        rewrite_system = _system_with(system, "\n\n【言い換え再生成（重要）】\n- reference_url本文の表現の“言い回し”は流用しない\n- 構成と文のつながりを組み替え、同義の言い換えを徹底する\n- 固有名詞・型番・数値は保持する\n")
 
-        rewrite_user = user_prompt + f"""
+        rewrite_user = _user_with(user_prompt, f"""
 
 [追加指示：言い換え再生成]
 - 直前に作った intro_text のドラフトを渡すので、意味を保持しつつ大きく言い換えてください。
@@ -964,44 +1499,17 @@ def generate_article(payload: dict, rewrite_mode: str = "none") -> tuple[str, st
 
 [直前のintro_textドラフト]
 {intro}
-"""
-        data_r = _extract_once(rewrite_system, rewrite_user, temperature=0.4)
-        if not _is_valid_article_dict(data_r):
-            data_r2 = _extract_once(rewrite_system, rewrite_user, temperature=0.4)
-            if _is_valid_article_dict(data_r2):
-                data_r = data_r2
-
-        intro_r = (data_r.get("intro_text") or "").strip()
-        specs_r = (data_r.get("specs_text") or "").strip()
-
-        if intro_r:
-            intro = intro_r
-        if specs_r:
-            specs = specs_r
-
-        hits2 = validate_no_hype(intro)
-        if hits2:
-            raise ValueError(f"煽り表現が検出されました: {hits2}")
-
-        sim_after = similarity_percent(intro, combined_reference_text)
-        lvl_after = similarity_level(sim_after)
-
-    ref_meta = {
-        "selected_reference_url": chosen_url,
-        "selected_reference_reason": chosen_reason,
-        "selected_reference_chars": len(chosen_text or ""),
-        "combined_reference_chars": len(combined_reference_text or ""),
-        "combined_reference_preview": _safe_preview(combined_reference_text, 360),
-        "reference_urls_debug": per_url_debug,
-
-        # similarity (final)
-        "similarity_percent": int(sim_after),
-        "similarity_level": str(lvl_after),
-
-        # debug
-        "similarity_before_percent": int(sim_before),
-        "similarity_before_level": str(lvl_before),
-        "rewrite_applied": bool(do_rewrite),
-    }
+""")
+        texts_r, reason_r = _structured("rewrite", rewrite_system, rewrite_user, 0.4)
+        if texts_r is not None:
+            intro, specs = texts_r
+            sim_after = similarity_percent(intro, combined_reference_text)
+        elif rewrite_mode == "force":
+            raise ValueError(reason_r)
+        else:
+            do_rewrite = False  # 自動の言い換えは、使えなければドラフトのまま
 
+    ref_meta = build_ref_meta(ctx, sim_before, sim_after, do_rewrite)
+    ref_meta["llm_usage"] = usage
+    ref_meta["llm_attempts"] = attempts
     return intro, specs, ref_meta
@@ -1,7 +1,28 @@
 import sqlite3
+import logging
 import os
+import queue
+import random
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import quote
 
-DB_PATH = '/Users/misaki/Desktop/HoroloGen/horologen.db'
+logger = logging.getLogger(__name__)
+
+# DB ファイルの場所（既定: このファイルと同じディレクトリの horologen.db）
+DB_PATH = os.getenv("HOROLOGEN_DB_PATH", "").strip() or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "horologen.db"
+)
+
+# 検索（GET）用の読み取り接続
+#   primary  : 既定。書き込みと同じ DB・同じプール
+#   ro       : 同じ DB ファイルを mode=ro の URI で開く別プール（誤って書き込めない）
+#   snapshot : backup API で定期的に複製したスナップショットを読む（書き込み側と完全に分離）
+READ_MODE = os.getenv("HOROLOGEN_READ_MODE", "primary").strip().lower()
+SNAPSHOT_PATH = os.getenv("HOROLOGEN_SNAPSHOT_PATH", "").strip()
+SNAPSHOT_REFRESH_SEC = float(os.getenv("HOROLOGEN_SNAPSHOT_REFRESH_SEC", "30"))
 
 # 必須CSVカラム
 REQUIRED_CSV_COLUMNS = [
@@ -11,9 +32,54 @@ REQUIRED_CSV_COLUMNS = [
     'case_thickness_mm', 'lug_width_mm', 'remarks'
 ]
 
+# 仕様フィールド（brand / reference 以外）
+PRODUCT_FIELDS = [c for c in REQUIRED_CSV_COLUMNS if c not in ('brand', 'reference')]
+
+# ----------------------------
+# Storage profile（HOROLOGEN_DB_PROFILE で選択、各値は環境変数で上書き可）
+#   wal      : 既定。読み取りが書き込みをブロックしない / commit は fsync 少なめ
+#   rollback : 従来のロールバックジャーナル
+# ----------------------------
+STORAGE_PROFILES = {
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # KiB 指定（= 64MB）
+        "busy_timeout": 5000,
+    },
+    "rollback": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "busy_timeout": 5000,
+    },
+}
+
+
+def _load_storage_profile() -> dict:
+    name = os.getenv("HOROLOGEN_DB_PROFILE", "wal").strip().lower()
+    profile = dict(STORAGE_PROFILES.get(name) or STORAGE_PROFILES["wal"])
+    for key in profile:
+        override = os.getenv(f"HOROLOGEN_DB_{key.upper()}", "").strip()
+        if override:
+            profile[key] = override
+    return profile
+
+
+STORAGE_PROFILE = _load_storage_profile()
+
+# 書き込みの再試行（database is locked / busy のとき指数バックオフ＋ジッタ）
+WRITE_RETRIES = int(os.getenv("HOROLOGEN_DB_WRITE_RETRIES", "5"))
+WRITE_BACKOFF_SEC = float(os.getenv("HOROLOGEN_DB_WRITE_BACKOFF_MS", "50")) / 1000.0
+
+
 def init_db():
     """データベースを初期化"""
     conn = sqlite3.connect(DB_PATH)
+    # journal_mode は DB ファイルに永続化されるので初期化時に1回だけ
+    conn.execute(f"PRAGMA journal_mode = {STORAGE_PROFILE['journal_mode']}")
     cursor = conn.cursor()
 
     # master_products テーブル
@@ -82,10 +148,32 @@ def init_db():
             changed_count INTEGER DEFAULT 0,
             override_conflict_count INTEGER DEFAULT 0,
             sample_diffs TEXT,
+            status TEXT NOT NULL DEFAULT 'done',     -- running / done / failed（取込開始時に running で作る）
+            error TEXT,
             uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
 
+    # import_jobs テーブル（バックグラウンドCSV取込ジョブ）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            stored_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',   -- queued / running / done / failed
+            total_bytes INTEGER DEFAULT 0,
+            processed_bytes INTEGER DEFAULT 0,
+            processed_rows INTEGER DEFAULT 0,
+            upload_id INTEGER,                       -- master_uploads.id（完了時）
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            owner TEXT,                              -- 実行中のプロセス（JOB_OWNER）
+            heartbeat_at TIMESTAMP                   -- owner が生きている印（JOB_HEARTBEAT_SEC ごと・チャンクごと）
+        )
+    ''')
+
     # 既存テーブルへカラム追加（存在しない場合のみ）
     def _add_column_safe(table: str, coldef: str):
         try:
@@ -96,9 +184,12 @@ def init_db():
     _add_column_safe('master_uploads', 'changed_count INTEGER DEFAULT 0')
     _add_column_safe('master_uploads', 'override_conflict_count INTEGER DEFAULT 0')
     _add_column_safe('master_uploads', 'sample_diffs TEXT')
+    _add_column_safe('master_uploads', "status TEXT NOT NULL DEFAULT 'done'")
+    _add_column_safe('master_uploads', 'error TEXT')
     _add_column_safe('product_overrides', 'editor_note TEXT')
     _add_column_safe('generated_articles', 'rewrite_depth INTEGER DEFAULT 0')
     _add_column_safe('generated_articles', 'rewrite_parent_id INTEGER')
+    _add_column_safe('generated_articles', 'content_fingerprint TEXT')  # 生成入力の指紋（generation_jobs）
 
     # generated_articles テーブル（記事生成履歴）
     cursor.execute("""
@@ -114,6 +205,8 @@ def init_db():
             rewrite_depth INTEGER DEFAULT 0,
             rewrite_parent_id INTEGER,
 
+            content_fingerprint TEXT,        -- 生成入力の指紋（generation_jobs の重複判定）
+
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
@@ -131,12 +224,654 @@ def init_db():
         CREATE INDEX IF NOT EXISTS idx_generated_articles_brand_ref_created
         ON generated_articles (brand, reference, created_at DESC)
     """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_generated_articles_fingerprint
+        ON generated_articles (content_fingerprint, created_at)
+    """)
+
+    # cse_query_cache テーブル（Google CSE の検索結果。正規化したクエリ単位）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cse_query_cache (
+            query_key TEXT PRIMARY KEY,      -- 正規化クエリ + "|" + 件数
+            query TEXT NOT NULL,
+            urls_json TEXT NOT NULL,
+            fetched_at REAL NOT NULL         -- time.time()
+        )
+    """)
+
+    # discovered_reference_urls テーブル（商品ごとの自動発見URL。ホワイトリスト適用後）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS discovered_reference_urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            brand TEXT NOT NULL,
+            reference TEXT NOT NULL,
+            urls_json TEXT NOT NULL,
+            reason TEXT,
+            discovered_at REAL NOT NULL,     -- time.time()
+            UNIQUE(brand, reference)
+        )
+    """)
+
+    # generation_batches テーブル（Message Batches API での一括生成）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS generation_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,                    -- 対象の指定（brand / collection / csv）
+            options_json TEXT NOT NULL DEFAULT '{}', -- tone / include_* オプション
+            status TEXT NOT NULL DEFAULT 'preparing', -- preparing / submitting / submitted / collected / failed
+            api_batch_id TEXT,                       -- Anthropic の batch id
+            submit_token TEXT,                       -- custom_id の先頭（送信の途中で落ちたときの照合用）
+            submit_started_at TIMESTAMP,             -- batches.create を呼ぶ直前（UTC）
+            total INTEGER NOT NULL DEFAULT 0,
+            succeeded INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            quota_month TEXT NOT NULL,               -- クォータを消費した月（返却も同じ月へ）
+            quota_charged INTEGER NOT NULL DEFAULT 0,
+            quota_refunded INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            submitted_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+
+    _add_column_safe('generation_batches', 'submit_token TEXT')
+    _add_column_safe('generation_batches', 'submit_started_at TIMESTAMP')
+
+    # generation_batch_items テーブル（バッチ内の1商品 = 1リクエスト）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS generation_batch_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id INTEGER NOT NULL,
+            brand TEXT NOT NULL,
+            reference TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending / submitted / succeeded / failed
+            payload_json TEXT,
+            context_json TEXT,                       -- llm_client.prepare_article の結果（回収時に使う）
+            content_fingerprint TEXT,                -- generation_jobs.payload_fingerprint（準備時。記事にも保存）
+            article_id INTEGER,                      -- generated_articles.id（成功時）
+            error TEXT,
+            UNIQUE(batch_id, brand, reference)
+        )
+    """)
+    _add_column_safe('generation_batch_items', 'content_fingerprint TEXT')
+
+    # generation_jobs テーブル（画面からの生成・言い換えをワーカーで実行するジョブ）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,                      -- generate / rewrite
+            brand TEXT NOT NULL,
+            reference TEXT NOT NULL,
+            options_json TEXT NOT NULL DEFAULT '{}', -- 生成フォームの入力（tone / include_* / reference_urls）
+            source_article_id INTEGER,               -- rewrite の対象（generated_articles.id）
+            status TEXT NOT NULL DEFAULT 'queued',   -- queued / running / done / failed
+            attempts INTEGER NOT NULL DEFAULT 0,     -- 実行回数（再起動で再実行した分を含む）
+            article_id INTEGER,                      -- generated_articles.id（完了時）
+            quota_month TEXT NOT NULL,               -- クォータを消費した月（返却も同じ月へ）
+            quota_charged INTEGER NOT NULL DEFAULT 0,
+            quota_refunded INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            owner TEXT,                              -- 実行中のプロセス（JOB_OWNER）
+            heartbeat_at TIMESTAMP                   -- owner が生きている印（JOB_HEARTBEAT_SEC ごと）
+        )
+    """)
+    _add_column_safe('generation_jobs', 'request_key TEXT')                    # 二重送信の判定（generation_jobs）
+    _add_column_safe('generation_jobs', 'reused INTEGER NOT NULL DEFAULT 0')   # 既存の記事を結果にした
+    for jobs_table in JOB_TABLES:
+        _add_column_safe(jobs_table, 'owner TEXT')
+        _add_column_safe(jobs_table, 'heartbeat_at TIMESTAMP')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs (status, id)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_generation_jobs_request_key ON generation_jobs (request_key, id)'
+    )
+
+    # generation_metrics テーブル（生成1回分の計測。モデル呼び出し・ページ取得・CSE ごとに1行）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS generation_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            article_id INTEGER,                      -- generated_articles.id（失敗・既存記事の再利用は NULL）
+            job_id INTEGER,                          -- generation_jobs.id
+            stage TEXT NOT NULL,                     -- generation_metrics.py の stage 一覧
+            detail TEXT NOT NULL DEFAULT '',         -- ホスト・クエリ・例外名など
+            latency_ms REAL NOT NULL,
+            attempt INTEGER NOT NULL DEFAULT 1,      -- モデル呼び出し: 段階内の何回目か（2 以上は取り直し）
+            outcome TEXT NOT NULL DEFAULT '',
+            stop_reason TEXT,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            cache_read_input_tokens INTEGER NOT NULL DEFAULT 0,
+            cache_creation_input_tokens INTEGER NOT NULL DEFAULT 0,
+            cache TEXT,                              -- ページ取得・CSE: hit / miss / revalidated / inflight など
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_generation_metrics_stage_created ON generation_metrics (stage, created_at)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_generation_metrics_job ON generation_metrics (job_id)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_generation_metrics_article ON generation_metrics (article_id)'
+    )
+
+    # canonical_products テーブル（正規スペックの実体化。トリガーで常に最新）
+    # 派生データなので、列構成が古ければ作り直してバックフィルする
+    existing_cols = {r[1] for r in cursor.execute('PRAGMA table_info(canonical_products)').fetchall()}
+    if existing_cols and not set(CANONICAL_COLUMNS + ['id']) <= existing_cols:
+        cursor.execute('DROP TABLE IF EXISTS canonical_fts')
+        cursor.execute('DROP TABLE canonical_products')
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS canonical_products ('
+        'id INTEGER PRIMARY KEY, '  # canonical_fts の rowid
+        'brand TEXT NOT NULL, reference TEXT NOT NULL, '
+        "reference_norm TEXT NOT NULL DEFAULT '', "  # 区切り文字を除いて大文字化（product_search.normalize_reference）
+        + ''.join(f"{f} TEXT NOT NULL DEFAULT '', " for f in PRODUCT_FIELDS)
+        + 'overridden_mask INTEGER NOT NULL DEFAULT 0, '  # bit i = PRODUCT_FIELDS[i] がオーバーライド値
+        'has_master INTEGER NOT NULL DEFAULT 0, '
+        'has_override INTEGER NOT NULL DEFAULT 0, '
+        "editor_note TEXT NOT NULL DEFAULT '', "
+        'updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, '
+        'UNIQUE (brand, reference)'
+        ')'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_canonical_products_reference ON canonical_products (reference)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_canonical_products_ref_norm ON canonical_products (reference_norm)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_canonical_products_brand_ref_norm '
+        'ON canonical_products (brand, reference_norm)'
+    )
+
+    # canonical_fts（リファレンス・コレクション・キャリバーの全文検索。外部コンテンツ = canonical_products）
+    cursor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS canonical_fts USING fts5('
+        + ', '.join(CANONICAL_FTS_COLUMNS)
+        + ", brand UNINDEXED, content='canonical_products', content_rowid='id')"
+    )
+
+    # 行があるあいだ master_products / canonical_products のトリガーを止める（CSV取込のトランザクション内だけで使う）
+    cursor.execute('CREATE TABLE IF NOT EXISTS canonical_trigger_pause (id INTEGER PRIMARY KEY)')
+    cursor.execute('DELETE FROM canonical_trigger_pause')
+
+    # フィールド構成が変わっても追従するよう、トリガーは毎回作り直す
+    for name, ddl in _canonical_triggers() + _canonical_fts_triggers():
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(ddl)
+    if cursor.execute('SELECT 1 FROM canonical_products LIMIT 1').fetchone() is None:
+        rebuild_canonical_products(conn)
 
     conn.commit()
     conn.close()
 
+
+# ----------------------------
+# canonical_products の SQL（フィールド一覧から組み立て）
+#   値 = オーバーライドが空でなければオーバーライド、なければマスタ（app の表示と同じ規則）
+# ----------------------------
+CANONICAL_COLUMNS = ['brand', 'reference', 'reference_norm'] + PRODUCT_FIELDS + [
+    'overridden_mask', 'has_master', 'has_override', 'editor_note', 'updated_at'
+]
+
+# 全文検索の対象列（canonical_products の列名と同じ）
+CANONICAL_FTS_COLUMNS = ['reference', 'reference_norm', 'collection', 'movement_caliber']
+
+# リファレンス正規化で取り除く区切り文字（llm_client._normalize_ref_variants と同じ集合）
+REFERENCE_SEPARATORS = ' \t\r\n.-_/'
+
+
+def reference_norm_sql(expr: str) -> str:
+    """SQL 式 expr を区切り文字なし・大文字に正規化する SQL 式（upper() は ASCII のみ。product_search.normalize_reference も同じ）"""
+    for ch in REFERENCE_SEPARATORS:
+        expr = f"replace({expr}, char({ord(ch)}), '')"
+    return f'upper({expr})'
+
+
+def _canonical_select(keys_sql: str) -> str:
+    """keys_sql（brand, reference 列を持つ SELECT）の各キーについて canonical_products の行を返す SELECT"""
+    return (
+        'SELECT k.brand, k.reference, ' + reference_norm_sql('k.reference') + ', '
+        + ''.join(f"COALESCE(NULLIF(o.{f}, ''), m.{f}, ''), " for f in PRODUCT_FIELDS)
+        + '(' + ' | '.join(f"((IFNULL(o.{f}, '') <> '') << {i})" for i, f in enumerate(PRODUCT_FIELDS)) + '), '
+        "(m.id IS NOT NULL), (o.id IS NOT NULL), IFNULL(o.editor_note, ''), CURRENT_TIMESTAMP "
+        f'FROM ({keys_sql}) k '
+        'LEFT JOIN master_products m ON m.brand = k.brand AND m.reference = k.reference '
+        'LEFT JOIN product_overrides o ON o.brand = k.brand AND o.reference = k.reference '
+        'WHERE m.id IS NOT NULL OR o.id IS NOT NULL'
+    )
+
+
+def _canonical_refresh(row: str) -> str:
+    """トリガー本体: row（NEW / OLD）のキーを再計算し、元データが無くなっていれば削除"""
+    keys = f'SELECT {row}.brand AS brand, {row}.reference AS reference'
+    # INSERT OR REPLACE は外側の文（UPSERT 等）の衝突解決に上書きされるため ON CONFLICT で書く
+    return (
+        'INSERT INTO canonical_products (' + ', '.join(CANONICAL_COLUMNS) + ') '
+        + _canonical_select(keys) + ' '
+        'ON CONFLICT(brand, reference) DO UPDATE SET '
+        + ', '.join(f'{c} = excluded.{c}' for c in CANONICAL_COLUMNS[2:]) + '; '
+        f'DELETE FROM canonical_products WHERE brand = {row}.brand AND reference = {row}.reference '
+        f'AND NOT EXISTS (SELECT 1 FROM master_products WHERE brand = {row}.brand AND reference = {row}.reference) '
+        f'AND NOT EXISTS (SELECT 1 FROM product_overrides WHERE brand = {row}.brand AND reference = {row}.reference);'
+    )
+
+
+# CSV取込（sync_canonical_keys）がまとめて反映するあいだは行ごとのトリガーを動かさない
+_NOT_PAUSED = 'NOT EXISTS (SELECT 1 FROM canonical_trigger_pause)'
+
+
+def _canonical_triggers() -> list:
+    triggers = []
+    for table, short in (('master_products', 'master'), ('product_overrides', 'override')):
+        triggers += [
+            (f'trg_canonical_{short}_ins',
+             f'CREATE TRIGGER trg_canonical_{short}_ins AFTER INSERT ON {table} WHEN {_NOT_PAUSED} '
+             f'BEGIN {_canonical_refresh("NEW")} END'),
+            (f'trg_canonical_{short}_upd',
+             f'CREATE TRIGGER trg_canonical_{short}_upd AFTER UPDATE ON {table} WHEN {_NOT_PAUSED} '
+             f'BEGIN {_canonical_refresh("NEW")} END'),
+            # キー自体が変わった場合は旧キー側も
+            (f'trg_canonical_{short}_rekey',
+             f'CREATE TRIGGER trg_canonical_{short}_rekey AFTER UPDATE OF brand, reference ON {table} '
+             'WHEN OLD.brand IS NOT NEW.brand OR OLD.reference IS NOT NEW.reference '
+             f'BEGIN {_canonical_refresh("OLD")} END'),
+            (f'trg_canonical_{short}_del',
+             f'CREATE TRIGGER trg_canonical_{short}_del AFTER DELETE ON {table} '
+             f'BEGIN {_canonical_refresh("OLD")} END'),
+        ]
+    return triggers
+
+
+def _canonical_fts_triggers() -> list:
+    """canonical_fts を canonical_products に追従させる（FTS5 外部コンテンツの定型）"""
+    cols = CANONICAL_FTS_COLUMNS + ['brand']
+    new_vals = ', '.join(f'new.{c}' for c in cols)
+    old_vals = ', '.join(f'old.{c}' for c in cols)
+    col_list = ', '.join(cols)
+    delete_old = (
+        f"INSERT INTO canonical_fts (canonical_fts, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});"
+    )
+    insert_new = f'INSERT INTO canonical_fts (rowid, {col_list}) VALUES (new.id, {new_vals});'
+    return [
+        ('trg_canonical_fts_ins',
+         f'CREATE TRIGGER trg_canonical_fts_ins AFTER INSERT ON canonical_products WHEN {_NOT_PAUSED} '
+         f'BEGIN {insert_new} END'),
+        ('trg_canonical_fts_del',
+         f'CREATE TRIGGER trg_canonical_fts_del AFTER DELETE ON canonical_products WHEN {_NOT_PAUSED} '
+         f'BEGIN {delete_old} END'),
+        # 検索対象の列が変わったときだけ索引を更新（価格だけの更新などでは触らない）
+        ('trg_canonical_fts_upd',
+         f'CREATE TRIGGER trg_canonical_fts_upd AFTER UPDATE OF {col_list} ON canonical_products '
+         f'WHEN {_NOT_PAUSED} AND (' + ' OR '.join(f'old.{c} IS NOT new.{c}' for c in cols) + ') '
+         f'BEGIN {delete_old} {insert_new} END'),
+    ]
+
+
+def write_with_canonical_sync(cursor, write_sql: str, keys_sql: str) -> None:
+    """
+    write_sql（master_products への set-based な書き込み）を行ごとのトリガーを止めて実行し、
+    keys_sql（brand, reference 列を持つ SELECT）のキーについて canonical_products と canonical_fts を
+    まとめて反映する。書き込みトランザクション（BEGIN IMMEDIATE）の中で呼ぶこと
+    （止めている状態は commit 前に戻すので、他の接続からは見えない）。
+    行の削除は扱わない（CSV取込は行を消さない）
+    """
+    cursor.execute('INSERT OR IGNORE INTO canonical_trigger_pause (id) VALUES (1)')
+    cursor.execute(write_sql)
+    sync_canonical_keys(cursor, keys_sql)
+    cursor.execute('DELETE FROM canonical_trigger_pause')
+
+
+def sync_canonical_keys(cursor, keys_sql: str) -> None:
+    """keys_sql のキーの canonical_products を1文で再計算し、検索対象の列が変わった行だけ全文索引を差し替える"""
+    cols = CANONICAL_FTS_COLUMNS + ['brand']
+    col_list = ', '.join(cols)
+    cursor.execute('DROP TABLE IF EXISTS temp.canonical_before')
+    cursor.execute(
+        f'CREATE TEMP TABLE canonical_before AS SELECT c.id, {", ".join(f"c.{c}" for c in cols)} '
+        f'FROM canonical_products c JOIN ({keys_sql}) k ON c.brand = k.brand AND c.reference = k.reference'
+    )
+    cursor.execute(
+        'INSERT INTO canonical_products (' + ', '.join(CANONICAL_COLUMNS) + ') '
+        + _canonical_select(keys_sql) + ' '
+        'ON CONFLICT(brand, reference) DO UPDATE SET '
+        + ', '.join(f'{c} = excluded.{c}' for c in CANONICAL_COLUMNS[2:])
+    )
+    changed = ' OR '.join(f'b.{c} IS NOT c.{c}' for c in cols)
+    cursor.execute(
+        f"INSERT INTO canonical_fts (canonical_fts, rowid, {col_list}) "
+        f"SELECT 'delete', b.id, {', '.join(f'b.{c}' for c in cols)} "
+        f'FROM temp.canonical_before b JOIN canonical_products c ON c.id = b.id WHERE {changed}'
+    )
+    cursor.execute(
+        f'INSERT INTO canonical_fts (rowid, {col_list}) '
+        f'SELECT c.id, {", ".join(f"c.{c}" for c in cols)} '
+        f'FROM canonical_products c JOIN ({keys_sql}) k ON c.brand = k.brand AND c.reference = k.reference '
+        f'LEFT JOIN temp.canonical_before b ON b.id = c.id '
+        f'WHERE b.id IS NULL OR {changed}'
+    )
+    cursor.execute('DROP TABLE temp.canonical_before')
+
+
+def rebuild_canonical_products(conn) -> None:
+    """canonical_products と全文索引を全件作り直す（初回のバックフィル・整合性の復旧用。commit は呼び出し側）"""
+    conn.execute('DELETE FROM canonical_products')
+    conn.execute(
+        'INSERT INTO canonical_products (' + ', '.join(CANONICAL_COLUMNS) + ') '
+        + _canonical_select(
+            'SELECT brand, reference FROM master_products '
+            'UNION SELECT brand, reference FROM product_overrides'
+        )
+    )
+    conn.execute("INSERT INTO canonical_fts (canonical_fts) VALUES ('rebuild')")
+
+
+def overridden_fields_from_mask(mask: int) -> frozenset:
+    return frozenset(f for i, f in enumerate(PRODUCT_FIELDS) if mask & (1 << i))
+
+
+def iter_canonical_products(conn, brand: str = None, batch_size: int = 1000):
+    """canonical_products を (brand, reference) 順に1回のスキャンで返す（一覧・エクスポート用）"""
+    if brand:
+        cur = conn.execute(
+            'SELECT * FROM canonical_products WHERE brand = ? ORDER BY brand, reference', (brand,)
+        )
+    else:
+        cur = conn.execute('SELECT * FROM canonical_products ORDER BY brand, reference')
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+# ----------------------------
+# Connection pool
+#   - 接続時の PRAGMA 設定は接続ごとに1回だけ
+#   - Flask のリクエストでは get_db() で1リクエスト1接続、teardown でプールへ返却
+# ----------------------------
+POOL_SIZE = int(os.getenv("HOROLOGEN_DB_POOL_SIZE", "8"))
+
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=max(1, POOL_SIZE))
+
+
+def _connect() -> sqlite3.Connection:
+    # プールに戻した接続は別スレッドのリクエストでも使う（同時に使うのは常に1スレッド）
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for name, value in _connection_pragmas():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def _connection_pragmas() -> list:
+    """接続ごとに1回だけ設定する PRAGMA"""
+    p = STORAGE_PROFILE
+    return [
+        ("busy_timeout", int(p["busy_timeout"])),
+        ("synchronous", p["synchronous"]),
+        ("mmap_size", int(p["mmap_size"])),
+        ("cache_size", int(p["cache_size"])),
+        ("temp_store", "MEMORY"),
+    ]
+
+
+def is_locked_error(e: Exception) -> bool:
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def run_write(conn: sqlite3.Connection, fn, *args, **kwargs):
+    """
+    fn(conn, *args, **kwargs) を実行して commit し、戻り値を返す。
+    database is locked / busy のときは rollback して再試行する（fn は再実行されても安全であること）。
+    """
+    attempt = 0
+    while True:
+        try:
+            result = fn(conn, *args, **kwargs)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            if not is_locked_error(e) or attempt >= WRITE_RETRIES:
+                raise
+            time.sleep(WRITE_BACKOFF_SEC * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+
+def acquire_connection() -> sqlite3.Connection:
+    """プールから接続を取り出す（空なら新規に張る）"""
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+
+def release_connection(conn: sqlite3.Connection) -> None:
+    """接続をプールへ返す（未確定のトランザクションは破棄。満杯なら閉じる）"""
+    _return_to_pool(_pool, conn)
+
+
+def _return_to_pool(pool: queue.LifoQueue, conn: sqlite3.Connection) -> None:
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+    except sqlite3.Error:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def get_db() -> sqlite3.Connection:
+    """現在の Flask app context に紐づく接続（1リクエスト1接続）"""
+    from flask import g
+    conn = g.get('horologen_db')
+    if conn is None:
+        conn = acquire_connection()
+        g.horologen_db = conn
+    return conn
+
+
+def close_db(exc=None) -> None:
+    from flask import g
+    conn = g.pop('horologen_db', None)
+    if conn is not None:
+        release_connection(conn)
+    read_conn = g.pop('horologen_read_db', None)
+    if read_conn is not None:
+        release_read_connection(read_conn)
+
+
+def init_app(app) -> None:
+    app.teardown_appcontext(close_db)
+
+
 def get_db_connection():
-    """データベース接続を取得"""
-    conn = sqlite3.connect(DB_PATH)
+    """データベース接続を取得（リクエスト外のワーカー・CLI用。使い終わったら close() する）"""
+    return _connect()
+
+
+# ----------------------------
+# バックグラウンドジョブの持ち主（JOB_TABLES）
+#   - running にしたプロセスが owner に JOB_OWNER を書き、heartbeat_at を JOB_HEARTBEAT_SEC ごとに更新する
+#   - heartbeat_at が JOB_LEASE_SEC より古い running だけを「止まったジョブ」として扱う
+#     （別プロセスで実行中のジョブは起動時の再開処理でも触らない）
+# ----------------------------
+JOB_TABLES = ("generation_jobs", "import_jobs")
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+JOB_HEARTBEAT_SEC = float(os.getenv("HOROLOGEN_JOB_HEARTBEAT_SEC", "10"))
+JOB_LEASE_SEC = float(os.getenv("HOROLOGEN_JOB_LEASE_SEC", "60"))
+
+_heartbeat_lock = threading.Lock()
+_heartbeat_started = False
+
+
+def job_lease_expired_sql() -> str:
+    """running の行のうち owner の heartbeat が途切れたものの条件（WHERE に AND でつなぐ）"""
+    return (
+        "COALESCE(heartbeat_at, started_at, created_at) < "
+        f"strftime('%Y-%m-%d %H:%M:%f', 'now', '-{max(JOB_LEASE_SEC, JOB_HEARTBEAT_SEC * 2):g} seconds')"
+    )
+
+
+def start_job_heartbeat() -> None:
+    """このプロセスが running にしたジョブの heartbeat_at を更新し続ける（最初の呼び出しでスレッドを起動）"""
+    global _heartbeat_started
+    with _heartbeat_lock:
+        if _heartbeat_started:
+            return
+        _heartbeat_started = True
+    threading.Thread(target=_heartbeat_loop, name="horologen-job-heartbeat", daemon=True).start()
+
+
+def _heartbeat_loop() -> None:
+    def _beat(c) -> None:
+        for table in JOB_TABLES:
+            c.execute(
+                f"UPDATE {table} SET heartbeat_at = strftime('%Y-%m-%d %H:%M:%f', 'now') "
+                "WHERE owner = ? AND status = 'running'", (JOB_OWNER,)
+            )
+
+    while True:
+        time.sleep(JOB_HEARTBEAT_SEC)
+        try:
+            conn = get_db_connection()
+            try:
+                run_write(conn, _beat)
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning("job heartbeat failed: %s: %s", type(e).__name__, e)
+
+
+# ----------------------------
+# Read connections（HOROLOGEN_READ_MODE）
+#   - 書き込み（インポート・オーバーライド・生成結果の保存）は常に get_db()
+#   - snapshot は世代番号で管理し、古い世代の接続はプールへ戻さず閉じる
+# ----------------------------
+_read_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=max(1, POOL_SIZE))
+
+_snapshot_lock = threading.Lock()
+_snapshot_state = {"generation": 0, "refreshed_at": 0.0, "refreshing": False}
+
+
+def _snapshot_path() -> str:
+    return SNAPSHOT_PATH or DB_PATH + ".snapshot"
+
+
+def refresh_snapshot() -> None:
+    """primary を backup API でスナップショットへ複製し、差し替える"""
+    dest = _snapshot_path()
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    src = sqlite3.connect(DB_PATH)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst)
+        # 読み取り専用で開くので -wal / -shm を作らない形式にしておく
+        dst.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, dest)
+    with _snapshot_lock:
+        _snapshot_state["generation"] += 1
+        _snapshot_state["refreshed_at"] = time.time()
+
+
+def _refresh_snapshot_in_background() -> None:
+    try:
+        refresh_snapshot()
+    except Exception as e:
+        logger.warning("snapshot refresh failed: %s: %s", type(e).__name__, e)
+    finally:
+        with _snapshot_lock:
+            _snapshot_state["refreshing"] = False
+
+
+def _ensure_snapshot() -> int:
+    """スナップショットの世代番号を返す。古ければ裏で更新を1本だけ走らせる（初回のみ同期）"""
+    with _snapshot_lock:
+        generation = _snapshot_state["generation"]
+        stale = time.time() - _snapshot_state["refreshed_at"] >= SNAPSHOT_REFRESH_SEC
+        start = stale and generation > 0 and not _snapshot_state["refreshing"]
+        if start:
+            _snapshot_state["refreshing"] = True
+    if generation == 0:
+        refresh_snapshot()
+        return _snapshot_state["generation"]
+    if start:
+        threading.Thread(target=_refresh_snapshot_in_background, daemon=True).start()
+    return generation
+
+
+class _ReadConnection(sqlite3.Connection):
+    generation = 0
+
+
+def readonly_uri(path: str) -> str:
+    """sqlite3.connect(..., uri=True) で path を読み取り専用で開く URI（# ? % 空白などはエスケープ）"""
+    return f"file:{quote(path)}?mode=ro"
+
+
+def _connect_read(generation: int) -> sqlite3.Connection:
+    path = _snapshot_path() if READ_MODE == "snapshot" else DB_PATH
+    conn = sqlite3.connect(readonly_uri(path), uri=True,
+                           check_same_thread=False, factory=_ReadConnection)
     conn.row_factory = sqlite3.Row
+    for name, value in _connection_pragmas():
+        if name != "synchronous":
+            conn.execute(f"PRAGMA {name} = {value}")
+    conn.execute("PRAGMA query_only = ON")
+    conn.generation = generation
+    return conn
+
+
+def acquire_read_connection() -> sqlite3.Connection:
+    generation = _ensure_snapshot() if READ_MODE == "snapshot" else 0
+    while True:
+        try:
+            conn = _read_pool.get_nowait()
+        except queue.Empty:
+            return _connect_read(generation)
+        if conn.generation == generation:
+            return conn
+        conn.close()
+
+
+def release_read_connection(conn: sqlite3.Connection) -> None:
+    if READ_MODE == "snapshot" and conn.generation != _snapshot_state["generation"]:
+        conn.close()
+        return
+    _return_to_pool(_read_pool, conn)
+
+
+def get_read_db() -> sqlite3.Connection:
+    """
+    検索など読み取り専用の処理で使う接続（1リクエスト1接続）。
+    READ_MODE が primary のときは get_db() と同じ接続を返す。
+    """
+    if READ_MODE not in ("ro", "snapshot"):
+        return get_db()
+    from flask import g
+    conn = g.get('horologen_read_db')
+    if conn is None:
+        conn = acquire_read_connection()
+        g.horologen_read_db = conn
     return conn
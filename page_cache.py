@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from models import DB_PATH, STORAGE_PROFILE
+
+# ----------------------------
+# 参考URLのページキャッシュ（ディスク / SQLite）
+#   - URL ごとに生のレスポンス本文（zlib 圧縮）と抽出済みテキストを保持
+#   - TTL 内はネットワークも HTML 解析もしない
+#   - TTL 切れは ETag / Last-Modified で条件付き GET（304 なら本文・抽出結果をそのまま使う）
+#   - 合計サイズが上限を超えたら、最後に使われたのが古いものから削除（確認は store の N 回に1回）
+#   - 本文の展開は html() を呼んだときだけ（抽出済みテキストを使うヒットでは展開しない）
+#   - 本体 DB とは別ファイル（生成中の取得が書き込みロックを取り合わないように）
+# ----------------------------
+PAGE_CACHE_PATH = os.getenv("HOROLOGEN_PAGE_CACHE_PATH", "").strip() or DB_PATH + ".pages"
+PAGE_CACHE_TTL_SEC = float(os.getenv("HOROLOGEN_PAGE_CACHE_TTL_SEC", "86400"))
+PAGE_CACHE_MAX_BYTES = int(float(os.getenv("HOROLOGEN_PAGE_CACHE_MAX_MB", "256")) * 1024 * 1024)
+PAGE_CACHE_ENABLED = os.getenv("HOROLOGEN_PAGE_CACHE", "on").strip().lower() not in ("0", "off", "false")
+# 合計サイズの確認（SUM の全件走査）は store のこの回数に1回（上限の超過はおおよそ N ページ分まで）
+PAGE_CACHE_EVICT_EVERY = max(1, int(os.getenv("HOROLOGEN_PAGE_CACHE_EVICT_EVERY", "32")))
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+_store_lock = threading.Lock()
+_stores_since_evict = PAGE_CACHE_EVICT_EVERY - 1  # 起動後の最初の store では確認する
+
+
+@dataclass
+class CachedPage:
+    url: str
+    status: Optional[int]
+    etag: str
+    last_modified: str
+    encoding: str
+    packed_body: bytes  # zlib 圧縮のまま（body で展開）
+    extract_key: str
+    text: str
+    ok: bool
+    meta: Dict[str, Any]
+    fetched_at: float
+    validated_at: float
+    hit_count: int
+    _body: Optional[bytes] = field(default=None, repr=False)
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = zlib.decompress(self.packed_body) if self.packed_body else b""
+        return self._body
+
+    @property
+    def age_sec(self) -> float:
+        return time.time() - self.validated_at
+
+    @property
+    def fresh(self) -> bool:
+        return self.age_sec < PAGE_CACHE_TTL_SEC
+
+    def html(self) -> str:
+        return self.body.decode(self.encoding or "utf-8", errors="replace")
+
+
+def _init(conn: sqlite3.Connection) -> None:
+    conn.execute(f"PRAGMA journal_mode = {STORAGE_PROFILE['journal_mode']}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS page_cache (
+            url TEXT PRIMARY KEY,
+            status INTEGER,
+            etag TEXT NOT NULL DEFAULT '',
+            last_modified TEXT NOT NULL DEFAULT '',
+            encoding TEXT NOT NULL DEFAULT '',
+            body BLOB,                               -- zlib(レスポンス本文)
+            extract_key TEXT NOT NULL DEFAULT '',    -- 抽出条件（変わったら body から抽出し直す）
+            text TEXT NOT NULL DEFAULT '',
+            ok INTEGER NOT NULL DEFAULT 0,
+            meta_json TEXT NOT NULL DEFAULT '{}',
+            size_bytes INTEGER NOT NULL DEFAULT 0,
+            fetched_at REAL NOT NULL,
+            validated_at REAL NOT NULL,
+            last_hit_at REAL NOT NULL,
+            hit_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_page_cache_last_hit ON page_cache (last_hit_at)")
+    conn.commit()
+
+
+def _conn() -> sqlite3.Connection:
+    """スレッドごとに1本（取得はスレッドプールから呼ばれる）"""
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(PAGE_CACHE_PATH, timeout=int(STORAGE_PROFILE["busy_timeout"]) / 1000.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA synchronous = {STORAGE_PROFILE['synchronous']}")
+        with _init_lock:
+            if not _initialized:
+                _init(conn)
+                _initialized = True
+        _local.conn = conn
+    return conn
+
+
+def lookup(url: str) -> Optional[CachedPage]:
+    if not PAGE_CACHE_ENABLED:
+        return None
+    try:
+        row = _conn().execute("SELECT * FROM page_cache WHERE url = ?", (url,)).fetchone()
+    except sqlite3.Error as e:
+        logger.warning("page_cache lookup failed: %s: %s", type(e).__name__, e)
+        return None
+    if row is None:
+        return None
+    try:
+        meta = json.loads(row["meta_json"] or "{}")
+    except ValueError:
+        meta = {}
+    return CachedPage(
+        url=row["url"],
+        status=row["status"],
+        etag=row["etag"],
+        last_modified=row["last_modified"],
+        encoding=row["encoding"],
+        packed_body=row["body"] or b"",
+        extract_key=row["extract_key"],
+        text=row["text"],
+        ok=bool(row["ok"]),
+        meta=meta,
+        fetched_at=row["fetched_at"],
+        validated_at=row["validated_at"],
+        hit_count=row["hit_count"],
+    )
+
+
+def _write(fn) -> None:
+    conn = _conn()
+    try:
+        fn(conn)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.warning("page_cache write failed: %s: %s", type(e).__name__, e)
+
+
+def store(url: str, status: Optional[int], etag: str, last_modified: str, encoding: str, body: bytes,
+          extract_key: str, text: str, ok: bool, meta: Dict[str, Any]) -> None:
+    if not PAGE_CACHE_ENABLED:
+        return
+    global _stores_since_evict
+    packed = zlib.compress(body or b"", 6)
+    size = len(packed) + len((text or "").encode("utf-8"))
+    now = time.time()
+    with _store_lock:
+        _stores_since_evict += 1
+        check_size = _stores_since_evict >= PAGE_CACHE_EVICT_EVERY
+        if check_size:
+            _stores_since_evict = 0
+
+    def _store(conn):
+        conn.execute("""
+            INSERT INTO page_cache
+            (url, status, etag, last_modified, encoding, body, extract_key, text, ok, meta_json,
+             size_bytes, fetched_at, validated_at, last_hit_at, hit_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT(url) DO UPDATE SET
+                status = excluded.status, etag = excluded.etag, last_modified = excluded.last_modified,
+                encoding = excluded.encoding, body = excluded.body, extract_key = excluded.extract_key,
+                text = excluded.text, ok = excluded.ok, meta_json = excluded.meta_json,
+                size_bytes = excluded.size_bytes, fetched_at = excluded.fetched_at,
+                validated_at = excluded.validated_at, last_hit_at = excluded.last_hit_at
+        """, (url, status, etag or "", last_modified or "", encoding or "", packed, extract_key,
+              text or "", int(bool(ok)), json.dumps(meta, ensure_ascii=False), size, now, now, now))
+        if check_size:
+            _evict(conn)
+
+    _write(_store)
+
+
+def store_extraction(url: str, extract_key: str, text: str, ok: bool, meta: Dict[str, Any]) -> None:
+    """本文はそのままで、抽出結果だけ差し替える（抽出条件が変わったとき）"""
+    if not PAGE_CACHE_ENABLED:
+        return
+    _write(lambda conn: conn.execute(
+        "UPDATE page_cache SET extract_key = ?, text = ?, ok = ?, meta_json = ? WHERE url = ?",
+        (extract_key, text or "", int(bool(ok)), json.dumps(meta, ensure_ascii=False), url)
+    ))
+
+
+def mark_hit(url: str, revalidated: bool = False) -> None:
+    if not PAGE_CACHE_ENABLED:
+        return
+    now = time.time()
+    if revalidated:
+        sql, params = ("UPDATE page_cache SET hit_count = hit_count + 1, last_hit_at = ?, validated_at = ? "
+                       "WHERE url = ?", (now, now, url))
+    else:
+        sql, params = "UPDATE page_cache SET hit_count = hit_count + 1, last_hit_at = ? WHERE url = ?", (now, url)
+    _write(lambda conn: conn.execute(sql, params))
+
+
+def _evict(conn: sqlite3.Connection) -> None:
+    """合計サイズが上限を超えていたら、上限の 90% まで LRU で削除"""
+    total = conn.execute("SELECT IFNULL(SUM(size_bytes), 0) FROM page_cache").fetchone()[0]
+    if total <= PAGE_CACHE_MAX_BYTES:
+        return
+    target = int(PAGE_CACHE_MAX_BYTES * 0.9)
+    victims = []
+    for row in conn.execute("SELECT url, size_bytes FROM page_cache ORDER BY last_hit_at"):
+        if total <= target:
+            break
+        victims.append((row["url"],))
+        total -= row["size_bytes"]
+    conn.executemany("DELETE FROM page_cache WHERE url = ?", victims)
+
+
+def page_cache_stats() -> Dict[str, Any]:
+    if not PAGE_CACHE_ENABLED:
+        return {"enabled": False}
+    row = _conn().execute(
+        "SELECT COUNT(*) AS n, IFNULL(SUM(size_bytes), 0) AS bytes, IFNULL(SUM(hit_count), 0) AS hits "
+        "FROM page_cache"
+    ).fetchone()
+    return {
+        "enabled": True,
+        "path": PAGE_CACHE_PATH,
+        "entries": row["n"],
+        "size_bytes": row["bytes"],
+        "max_bytes": PAGE_CACHE_MAX_BYTES,
+        "ttl_sec": PAGE_CACHE_TTL_SEC,
+        "hits": row["hits"],
+    }
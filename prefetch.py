@@ -0,0 +1,185 @@
+"""
+参考URLの事前発見・ページの事前取得（カタログ全体のキャッシュ温め）
+
+    python prefetch.py                          # 発見結果が無い / 期限切れの商品すべて
+    python prefetch.py --brand omega --limit 200
+    python prefetch.py --workers 8 --per-host 2 --host-interval-ms 1000
+
+- master_products を走査し、discovered_reference_urls が新しくない商品だけを対象にする
+- 商品ごとに url_discovery.discover_reference_urls → llm_client.fetch_page_text（結果はそれぞれのキャッシュに残る）
+- 商品単位の並列数は --workers、ページ取得はホストごとに同時数（--per-host）と間隔（--host-interval-ms）を制限
+- CSE の同時数は url_discovery 側（HOROLOGEN_CSE_CONCURRENCY）で制限される
+- 生成画面では参考URL未入力時に同じキャッシュを引くため、初回生成でも検索・取得を待たない
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import page_cache
+import url_discovery
+from models import get_db_connection
+
+
+class HostLimiter:
+    """ホストごとの同時接続数と、リクエスト開始の最小間隔"""
+
+    def __init__(self, per_host: int, interval_sec: float):
+        self.per_host = max(1, per_host)
+        self.interval_sec = max(0.0, interval_sec)
+        self._lock = threading.Lock()
+        self._slots: Dict[str, threading.Semaphore] = {}
+        self._next_at: Dict[str, float] = {}
+
+    def acquire(self, host: str) -> None:
+        with self._lock:
+            sem = self._slots.setdefault(host, threading.Semaphore(self.per_host))
+        sem.acquire()
+        # 開始時刻を予約してから待つ（同じホストの待ち同士が同時に起きないように）
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at.get(host, 0.0))
+            self._next_at[host] = start + self.interval_sec
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, host: str) -> None:
+        self._slots[host].release()
+
+
+def select_targets(conn, brand: str = "", limit: int = 0, refresh: bool = False) -> List[Tuple[str, str]]:
+    """発見結果が未保存・期限切れの (brand, reference)。refresh=True なら全件"""
+    now = time.time()
+    sql = (
+        "SELECT m.brand, m.reference FROM master_products m "
+        "LEFT JOIN discovered_reference_urls d ON d.brand = m.brand AND d.reference = m.reference "
+        "WHERE 1 = 1"
+    )
+    params: List[Any] = []
+    if brand:
+        sql += " AND m.brand = ?"
+        params.append(brand)
+    if not refresh:
+        sql += (
+            " AND (d.id IS NULL"
+            " OR (d.urls_json != '[]' AND d.discovered_at < ?)"
+            " OR (d.urls_json = '[]' AND d.discovered_at < ?))"
+        )
+        params += [now - url_discovery.DISCOVERY_TTL_SEC, now - url_discovery.DISCOVERY_EMPTY_TTL_SEC]
+    sql += " ORDER BY m.brand, m.reference"
+    if limit > 0:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [(r["brand"], r["reference"]) for r in conn.execute(sql, params)]
+
+
+def _prefetch_one(brand: str, reference: str, limiter: HostLimiter, refresh: bool,
+                  fetch_pages: bool) -> Dict[str, Any]:
+    # llm_client は anthropic を読み込むため、ページ取得するときだけ import
+    import llm_client as llmc
+
+    out: Dict[str, Any] = {"brand": brand, "reference": reference, "urls": [], "reason": "",
+                           "fetched": 0, "warm": 0, "failed": 0}
+    conn = get_db_connection()
+    try:
+        urls, debug = url_discovery.discover_reference_urls(brand, reference, max_urls=3, conn=conn,
+                                                            refresh=refresh)
+    finally:
+        conn.close()
+    out["urls"] = urls
+    out["reason"] = debug.get("auto_url_reason", "")
+    if not fetch_pages:
+        return out
+
+    for u in urls:
+        cached = page_cache.lookup(u)
+        if cached is not None and cached.fresh:
+            out["warm"] += 1
+            continue
+        host = (urlparse(u).hostname or "").lower()
+        limiter.acquire(host)
+        try:
+            _text, ok, _meta = llmc.fetch_page_text(u, timeout=llmc._host_timeout(host))
+        except Exception as e:
+            print(f"[prefetch] {u}: {type(e).__name__}: {e}", file=sys.stderr)
+            ok = False
+        finally:
+            limiter.release(host)
+        out["fetched" if ok else "failed"] += 1
+    return out
+
+
+def run_prefetch(targets: List[Tuple[str, str]], workers: int = 4, per_host: int = 2,
+                 host_interval_sec: float = 1.0, refresh: bool = False, fetch_pages: bool = True,
+                 on_done=None) -> Dict[str, Any]:
+    """targets を並列に処理して集計を返す。on_done(result) は1商品ごとに呼ばれる"""
+    limiter = HostLimiter(per_host, host_interval_sec)
+    totals = {"products": 0, "with_urls": 0, "urls": 0, "fetched": 0, "warm": 0, "failed": 0, "errors": 0}
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="horologen-prefetch") as ex:
+        futures = [ex.submit(_prefetch_one, b, r, limiter, refresh, fetch_pages) for b, r in targets]
+        for fut in futures:
+            totals["products"] += 1
+            try:
+                res = fut.result()
+            except Exception as e:
+                totals["errors"] += 1
+                print(f"[prefetch] {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            totals["with_urls"] += 1 if res["urls"] else 0
+            totals["urls"] += len(res["urls"])
+            for k in ("fetched", "warm", "failed"):
+                totals[k] += res[k]
+            if on_done:
+                on_done(res)
+    return totals
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description='参考URLの事前発見とページの事前取得')
+    ap.add_argument('--brand', default='', help='対象ブランド（既定: 全ブランド）')
+    ap.add_argument('--limit', type=int, default=0, help='最大商品数（0 = 無制限）')
+    ap.add_argument('--workers', type=int, default=4, help='並列に処理する商品数')
+    ap.add_argument('--per-host', type=int, default=2, help='同じホストへの同時接続数')
+    ap.add_argument('--host-interval-ms', type=int, default=1000, help='同じホストへのリクエスト間隔')
+    ap.add_argument('--refresh', action='store_true', help='発見結果が新しい商品も再検索する')
+    ap.add_argument('--no-pages', action='store_true', help='URL の発見だけ行い、ページは取得しない')
+    ap.add_argument('--dry-run', action='store_true', help='対象商品の件数だけ表示')
+    args = ap.parse_args(argv)
+
+    from models import init_db
+    init_db()
+
+    conn = get_db_connection()
+    try:
+        targets = select_targets(conn, brand=args.brand, limit=args.limit, refresh=args.refresh)
+    finally:
+        conn.close()
+    print(f'targets={len(targets)}')
+    if args.dry_run or not targets:
+        return 0
+
+    t0 = time.perf_counter()
+    done = [0]
+
+    def _progress(res: Dict[str, Any]) -> None:
+        done[0] += 1
+        print(f'[{done[0]}/{len(targets)}] {res["brand"]} {res["reference"]}: {res["reason"]} '
+              f'urls={len(res["urls"])} fetched={res["fetched"]} warm={res["warm"]} failed={res["failed"]}')
+
+    totals = run_prefetch(targets, workers=args.workers, per_host=args.per_host,
+                          host_interval_sec=args.host_interval_ms / 1000.0, refresh=args.refresh,
+                          fetch_pages=not args.no_pages, on_done=_progress)
+    elapsed = time.perf_counter() - t0
+    print(' '.join(f'{k}={v}' for k, v in totals.items()) + f' elapsed={elapsed:.1f}s')
+    print(f'cse={url_discovery.cse_stats()}')
+    return 1 if totals["errors"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import difflib
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from models import REFERENCE_SEPARATORS, reference_norm_sql
+
+# ----------------------------
+# Product search（canonical_products + canonical_fts）
+#   優先順:
+#     0) リファレンス完全一致
+#     1) 正規化リファレンス一致（"3103042" / "310-30-42" → 310.30.42）
+#     2) 正規化リファレンスの前方一致（インデックスの範囲検索）
+#     3) 全文検索（リファレンスの区切り単位・コレクション・キャリバーの前方一致、bm25 順）
+#        ※ 0〜2 の後ろに重複を除いて続ける（0〜2 で必要件数に達したときは実行しない）
+#   一致が無いときは正規化リファレンスの近傍から候補（suggestions）を返す
+# ----------------------------
+SEARCH_MAX_PER_PAGE = 100
+# 全文検索は短すぎる語だと対象が膨らむので、この文字数以上のときだけ
+FTS_MIN_QUERY_CHARS = 2
+# 最後の語がこの文字数未満なら前方一致にしない（"De"* のような語で全件近くに当たるのを避ける）
+FTS_PREFIX_MIN_CHARS = 3
+# 一致がこの件数を超える語（コレクション名だけ等）は bm25 で並べず索引順で返す（全件のスコア計算を避ける）
+FTS_RANK_MAX_MATCHES = 5000
+
+_SEPARATOR_RE = re.compile('[' + re.escape(REFERENCE_SEPARATORS) + ']')
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# bm25 の列の重み（reference, reference_norm, collection, movement_caliber, brand）
+_BM25_WEIGHTS = '10.0, 10.0, 3.0, 3.0, 0.0'
+
+_RESULT_COLUMNS = (
+    'c.brand, c.reference, c.reference_norm, c.collection, c.movement_caliber, '
+    'c.price_jpy, c.has_master, c.has_override'
+)
+
+MATCH_LABELS = {
+    0: 'exact',
+    1: 'normalized',
+    2: 'prefix',
+    3: 'fulltext',
+}
+
+
+# SQLite の upper() は ASCII だけを大文字にするので、Python 側も ASCII だけにする（str.upper() は Unicode 全体）
+_ASCII_UPPER = str.maketrans('abcdefghijklmnopqrstuvwxyz', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+def normalize_reference(reference: str) -> str:
+    """
+    区切り文字（空白 . - _ /）を除いて ASCII だけ大文字化（models.reference_norm_sql と同じ結果）。
+    DB に触れないメモリ上の索引（autocomplete）用。検索は normalize_reference_db で列と同じ SQL 式を使う
+    """
+    return _SEPARATOR_RE.sub('', reference or '').translate(_ASCII_UPPER)
+
+
+def normalize_reference_db(conn, reference: str) -> str:
+    """canonical_products.reference_norm を作るのと同じ SQL 式で正規化する（照合する両辺を同じ関数で）"""
+    return conn.execute('SELECT ' + reference_norm_sql('?'), (reference or '',)).fetchone()[0]
+
+
+def _fts_query(q: str) -> str:
+    """入力を FTS5 のフレーズ前方一致に変換（記号は区切りとして扱い、構文として解釈させない）"""
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens:
+        return ''
+    phrase = '"' + ' '.join(tokens) + '"'
+    return phrase + '*' if len(tokens[-1]) >= FTS_PREFIX_MIN_CHARS else phrase
+
+
+def _brand_clause(brand: Optional[str]) -> str:
+    return ' AND c.brand = ?' if brand else ''
+
+
+def _brand_params(brand: Optional[str]) -> tuple:
+    return (brand,) if brand else ()
+
+
+def _row_order(row) -> tuple:
+    return (row['brand'], row['reference'])
+
+
+def _tiers(conn, q: str, norm: str, brand: Optional[str], limit: int):
+    """
+    各段の結果を順に返す（(tier, rows)）。呼び出し側で必要件数に達したら打ち切る
+    （重複は呼び出し側で除くので、全文検索の結果はリファレンスの段の後ろに並ぶ）。
+    """
+    bc, bp = _brand_clause(brand), _brand_params(brand)
+
+    # 完全一致・正規化一致は件数が少ないので並べ替えは Python 側で
+    # （SQL で ORDER BY すると、並び順目当てに (brand, reference) の索引が選ばれて走査になる）
+    yield 0, sorted(conn.execute(
+        f'SELECT {_RESULT_COLUMNS} FROM canonical_products c WHERE c.reference = ?{bc} LIMIT ?',
+        (q, *bp, limit)
+    ).fetchall(), key=_row_order)
+
+    if not norm:
+        return
+
+    yield 1, sorted(conn.execute(
+        f'SELECT {_RESULT_COLUMNS} FROM canonical_products c WHERE c.reference_norm = ?{bc} LIMIT ?',
+        (norm, *bp, limit)
+    ).fetchall(), key=_row_order)
+
+    # 'ABC' < x < 'ABC\uffff' でインデックスの範囲検索になる（LIKE は大文字小文字の設定次第でインデックスを使わない）
+    yield 2, conn.execute(
+        f'SELECT {_RESULT_COLUMNS} FROM canonical_products c '
+        f'WHERE c.reference_norm > ? AND c.reference_norm < ?{bc} '
+        'ORDER BY c.reference_norm, c.brand LIMIT ?',
+        (norm, norm + '\uffff', *bp, limit)
+    ).fetchall()
+
+    match = _fts_query(q)
+    if match and len(norm) >= FTS_MIN_QUERY_CHARS:
+        n_matches = conn.execute(
+            'SELECT COUNT(*) FROM (SELECT rowid FROM canonical_fts WHERE canonical_fts MATCH ? LIMIT ?)',
+            (match, FTS_RANK_MAX_MATCHES + 1)
+        ).fetchone()[0]
+        order = 'ORDER BY score' if n_matches <= FTS_RANK_MAX_MATCHES else 'ORDER BY canonical_fts.rowid'
+        yield 3, conn.execute(
+            f'SELECT {_RESULT_COLUMNS}, bm25(canonical_fts, {_BM25_WEIGHTS}) AS score '
+            'FROM canonical_fts JOIN canonical_products c ON c.id = canonical_fts.rowid '
+            f'WHERE canonical_fts MATCH ?{bc} '
+            f'{order} LIMIT ?',
+            (match, *bp, limit)
+        ).fetchall()
+
+
+def _row_dict(row, tier: int) -> Dict[str, Any]:
+    return {
+        'brand': row['brand'],
+        'reference': row['reference'],
+        'collection': row['collection'],
+        'movement_caliber': row['movement_caliber'],
+        'price_jpy': row['price_jpy'],
+        'has_master': bool(row['has_master']),
+        'has_override': bool(row['has_override']),
+        'match': MATCH_LABELS[tier],
+    }
+
+
+def suggest_references(conn, q: str, brand: Optional[str] = None, limit: int = 5) -> List[Dict[str, Any]]:
+    """一致が無いときの候補。正規化リファレンスの並びで前後の近傍を取り、類似度順に返す"""
+    norm = normalize_reference_db(conn, q)
+    if not norm:
+        return []
+    bc, bp = _brand_clause(brand), _brand_params(brand)
+    window = max(limit * 4, 20)
+    rows = conn.execute(
+        f'SELECT {_RESULT_COLUMNS} FROM canonical_products c WHERE c.reference_norm >= ?{bc} '
+        'ORDER BY c.reference_norm LIMIT ?',
+        (norm, *bp, window)
+    ).fetchall()
+    rows += conn.execute(
+        f'SELECT {_RESULT_COLUMNS} FROM canonical_products c WHERE c.reference_norm < ?{bc} '
+        'ORDER BY c.reference_norm DESC LIMIT ?',
+        (norm, *bp, window)
+    ).fetchall()
+
+    scored = sorted(
+        rows,
+        key=lambda r: -difflib.SequenceMatcher(None, norm, r['reference_norm']).ratio()
+    )
+    out, seen = [], set()
+    for r in scored:
+        key = (r['brand'], r['reference'])
+        if key in seen:
+            continue
+        seen.add(key)
+        d = _row_dict(r, 3)
+        d['match'] = 'suggestion'
+        out.append(d)
+        if len(out) >= limit:
+            break
+    return out
+
+
+def search_products(conn, q: str, brand: Optional[str] = None,
+                    page: int = 1, per_page: int = 20) -> Dict[str, Any]:
+    """
+    リファレンス / コレクション / キャリバーで検索し、優先度順にページングした結果を返す。
+    結果が0件なら suggestions に近いリファレンスを入れる。
+    """
+    t0 = time.perf_counter()
+    q = (q or '').strip()
+    brand = (brand or '').strip() or None
+    page = max(1, int(page or 1))
+    per_page = max(1, min(int(per_page or 20), SEARCH_MAX_PER_PAGE))
+
+    results: List[Dict[str, Any]] = []
+    has_more = False
+    if q:
+        norm = normalize_reference_db(conn, q)
+        need = page * per_page + 1  # 次ページ有無の判定用に1件多く
+        seen = set()
+        for tier, rows in _tiers(conn, q, norm, brand, need):
+            for r in rows:
+                key = (r['brand'], r['reference'])
+                if key in seen:
+                    continue
+                seen.add(key)
+                results.append(_row_dict(r, tier))
+            if len(results) >= need:
+                break
+        start = (page - 1) * per_page
+        has_more = len(results) > start + per_page
+        results = results[start:start + per_page]
+
+    suggestions = []
+    if q and not results and page == 1:
+        suggestions = suggest_references(conn, q, brand)
+
+    return {
+        'query': q,
+        'brand': brand or '',
+        'page': page,
+        'per_page': per_page,
+        'has_more': has_more,
+        'results': results,
+        'suggestions': suggestions,
+        'elapsed_ms': round((time.perf_counter() - t0) * 1000, 2),
+    }
@@ -0,0 +1,63 @@
+import os
+from datetime import datetime, timedelta
+
+# ----------------------------
+# Quota (service-wide monthly limit)
+#   - app の単発生成とバッチ生成で共有
+#   - charge_quota は呼び出し側のトランザクション内で使う（バッチ登録と同じ1トランザクションで消費するため）
+# ----------------------------
+PLAN_MODE = os.getenv("HOROLOGEN_PLAN", "limited").strip().lower()  # "limited" / "unlimited"
+MONTHLY_LIMIT = int(os.getenv("HOROLOGEN_MONTHLY_LIMIT", "30"))
+
+
+def month_key_jst() -> str:
+    dt = datetime.utcnow() + timedelta(hours=9)
+    return dt.strftime("%Y-%m")
+
+
+def get_monthly_usage(conn, mk: str = "") -> int:
+    row = conn.execute(
+        "SELECT used_count FROM monthly_generation_usage WHERE month_key = ?",
+        (mk or month_key_jst(),)
+    ).fetchone()
+    return int(row["used_count"]) if row else 0
+
+
+def remaining_quota(conn) -> int:
+    if PLAN_MODE == "unlimited":
+        return 10**9  # display only
+    used = get_monthly_usage(conn)
+    return max(0, MONTHLY_LIMIT - used)
+
+
+def charge_quota(conn, n: int, mk: str = "") -> bool:
+    """
+    BEGIN IMMEDIATE 済みのトランザクション内で呼ぶ。
+    limited: used + n が上限を超えるなら False（何も書かない）。OK なら used_count += n
+    unlimited: 常に True（記録もしない）
+    """
+    if PLAN_MODE == "unlimited":
+        return True
+    mk = mk or month_key_jst()
+    used = get_monthly_usage(conn, mk)
+    if used + n > MONTHLY_LIMIT:
+        return False
+    conn.execute(
+        "INSERT INTO monthly_generation_usage (month_key, used_count) VALUES (?, ?) "
+        "ON CONFLICT(month_key) DO UPDATE SET "
+        "used_count = used_count + excluded.used_count, updated_at = CURRENT_TIMESTAMP",
+        (mk, n)
+    )
+    return True
+
+
+def refund_quota(conn, n: int, mk: str) -> None:
+    """消費済みの n 回を戻す（バッチで生成できなかった分）。mk は消費した月"""
+    if PLAN_MODE == "unlimited" or n <= 0:
+        return
+    conn.execute(
+        "UPDATE monthly_generation_usage "
+        "SET used_count = MAX(0, used_count - ?), updated_at = CURRENT_TIMESTAMP "
+        "WHERE month_key = ?",
+        (n, mk)
+    )
@@ -0,0 +1,201 @@
+"""
+一括生成（generation_batches）の通し確認。fake_anthropic_server.py を立ち上げ、一時 DB で
+create_batch → submit_batch → collect_batch を実行する。
+
+    python smoke_batches.py
+    python smoke_batches.py --items 5 --keep-db
+
+確認すること:
+  normal     そのまま送って回収（全件 succeeded・記事が content_fingerprint 付きで保存される）
+  crash      batches.create の直後（submitted を記録する前）に落ちた → 起動時の resume_pending_batches が
+             batches.list から同じ batch を見つけて使う（送り直さない）
+  lost       batches.create の応答が失われた → submitting のまま、回収時の照合で同じ batch を使う
+
+失敗すれば AssertionError で終了コード 1。
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_server(port: int, *extra: str) -> subprocess.Popen:
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(here, 'fake_anthropic_server.py'), '--port', str(port), *extra],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('fake_anthropic_server did not start')
+
+
+def _api_batch_count() -> int:
+    import llm_client as llmc
+    return sum(1 for _b in llmc.client.messages.batches.list(limit=100))
+
+
+def _batch_row(batch_id: int):
+    from models import get_db_connection
+    conn = get_db_connection()
+    try:
+        return conn.execute('SELECT * FROM generation_batches WHERE id = ?', (batch_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def _assert_collected(status, n_items: int) -> None:
+    from models import get_db_connection
+    assert status['status'] == 'collected', status
+    assert status['succeeded'] == n_items, status
+    assert all(it['article_id'] for it in status['items']), status['items']
+    conn = get_db_connection()
+    try:
+        missing = conn.execute(
+            'SELECT COUNT(*) FROM generated_articles WHERE id IN (%s) AND content_fingerprint IS NULL'
+            % ','.join('?' * n_items), [it['article_id'] for it in status['items']]
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert missing == 0, f'{missing} articles without content_fingerprint'
+
+
+def run(items: int, poll_sec: float) -> None:
+    import generation_batches as gb
+    from models import get_db_connection, init_db, run_write
+
+    init_db()
+    targets = [('smoke', f'SMK-{i:03d}') for i in range(items)]
+
+    def _seed(c) -> None:
+        c.executemany(
+            "INSERT OR IGNORE INTO master_products (brand, reference, collection) VALUES (?, ?, 'Smoke')", targets
+        )
+
+    conn = get_db_connection()
+    try:
+        run_write(conn, _seed)
+    finally:
+        conn.close()
+    options = {'tone': 'practical'}
+
+    # normal
+    before = _api_batch_count()
+    batch_id = gb.create_batch(targets, 'smoke:normal', options)
+    status = gb.submit_batch(batch_id)
+    assert status['status'] == 'submitted', status
+    assert status['submit_token'] and status['api_batch_id'], status
+    status = gb.wait_for_batch(batch_id, poll_sec)
+    _assert_collected(status, items)
+    assert _api_batch_count() == before + 1
+    print(f'normal  batch {batch_id}: {status["status"]} succeeded={status["succeeded"]}')
+
+    # crash: submitted を記録する前に落ちる
+    before = _api_batch_count()
+    batch_id = gb.create_batch(targets, 'smoke:crash', options)
+    original = gb._mark_submitted
+
+    def _crash(*_args, **_kwargs):
+        raise KeyboardInterrupt('simulated crash after batches.create')
+
+    gb._mark_submitted = _crash
+    try:
+        gb.submit_batch(batch_id)
+        raise AssertionError('crash was not simulated')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gb._mark_submitted = original
+    assert _batch_row(batch_id)['status'] == 'submitting'
+    assert _api_batch_count() == before + 1
+
+    gb.resume_pending_batches()  # 再起動時と同じ（処理中の候補しか無ければ submitting のまま）
+    status = gb.wait_for_batch(batch_id, poll_sec)
+    _assert_collected(status, items)
+    assert _api_batch_count() == before + 1, 'resubmitted instead of reconciling'
+    print(f'crash   batch {batch_id}: {status["status"]} succeeded={status["succeeded"]} (no resubmit)')
+
+
+def run_lost(items: int, poll_sec: float) -> None:
+    """応答を返さないサーバで1回だけ作成する"""
+    import generation_batches as gb
+
+    targets = [('smoke', f'SMK-{i:03d}') for i in range(items)]
+    before = _api_batch_count()
+    batch_id = gb.create_batch(targets, 'smoke:lost', {'tone': 'practical'})
+    status = gb.submit_batch(batch_id)
+    assert status['status'] in ('submitting', 'submitted'), status
+    status = gb.wait_for_batch(batch_id, poll_sec)
+    _assert_collected(status, items)
+    assert _api_batch_count() == before + 1, 'resubmitted instead of reconciling'
+    print(f'lost    batch {batch_id}: {status["status"]} succeeded={status["succeeded"]} (no resubmit)')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--items', type=int, default=3)
+    ap.add_argument('--batch-delay', type=float, default=1.0)
+    ap.add_argument('--poll-sec', type=float, default=0.3)
+    ap.add_argument('--keep-db', action='store_true')
+    ap.add_argument('--scenario', choices=['main', 'lost'], default='', help='（内部用）このプロセスで実行するもの')
+    args = ap.parse_args()
+
+    if args.scenario == 'main':
+        run(args.items, args.poll_sec)
+        return
+    if args.scenario == 'lost':
+        run_lost(args.items, args.poll_sec)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix='horologen-smoke-')
+    port, lost_port = _free_port(), _free_port()
+    servers = [
+        _start_server(port, '--batch-delay', str(args.batch_delay)),
+        _start_server(lost_port, '--batch-delay', str(args.batch_delay), '--lose-create-every', '1'),
+    ]
+    env = dict(
+        os.environ,
+        HOROLOGEN_DB_PATH=os.path.join(tmpdir, 'smoke.db'),
+        ANTHROPIC_API_KEY='dummy',
+        GOOGLE_CSE_API_KEY='',
+        GOOGLE_CSE_CX='',
+        HOROLOGEN_MONTHLY_LIMIT='1000',
+    )
+    common = ['--items', str(args.items), '--poll-sec', str(args.poll_sec)]
+    code = 0
+    try:
+        # 接続先は import 時に決まるので、サーバごとに別プロセスで（DB は共有）
+        for scenario, p in (('main', port), ('lost', lost_port)):
+            code = subprocess.call(
+                [sys.executable, os.path.abspath(__file__), '--scenario', scenario, *common],
+                env={**env, 'ANTHROPIC_BASE_URL': f'http://127.0.0.1:{p}'},
+            )
+            if code:
+                break
+    finally:
+        for proc in servers:
+            proc.terminate()
+            proc.wait()
+    if args.keep_db:
+        print(f'db: {env["HOROLOGEN_DB_PATH"]}')
+    print('ok' if code == 0 else 'FAILED')
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+generation_jobs の二重送信・クォータ返却・再開の確認（一時 DB、llm_client はスタブ）
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import threading
+import types
+import unittest
+
+_TMPDIR = tempfile.mkdtemp(prefix="horologen-test-")
+os.environ["HOROLOGEN_DB_PATH"] = os.path.join(_TMPDIR, "test.db")
+os.environ["HOROLOGEN_PLAN"] = "limited"
+os.environ["HOROLOGEN_MONTHLY_LIMIT"] = "100"
+os.environ["HOROLOGEN_JOB_HEARTBEAT_SEC"] = "3600"  # heartbeat_at はテストから直接書き換える
+os.environ["HOROLOGEN_GENERATION_WORKERS"] = "2"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _StubLLM(types.ModuleType):
+    """generation_jobs が使う llm_client の関数だけ。generate_article の呼び出しを数え、gate で止められる"""
+
+    def __init__(self):
+        super().__init__("llm_client")
+        self.calls = 0
+        self.fail_with = None
+        self.gate = None          # threading.Event: set されるまで generate_article を止める
+        self.entered = threading.Event()
+
+    def build_payload(self, brand, reference, canonical, editor_note, reference_urls, tone="practical",
+                      include_brand_profile=False, include_wearing_scenes=False):
+        return {
+            "product": {"brand": brand, "reference": reference},
+            "facts": canonical,
+            "style": {"tone": tone},
+            "options": {"brand_profile": include_brand_profile, "wearing_scenes": include_wearing_scenes},
+            "constraints": {},
+            "editor_note": editor_note,
+            "reference_urls": list(reference_urls),
+        }
+
+    def prepare_article(self, payload):
+        return {"combined_reference_text": "reference text for " + payload["product"]["reference"]}
+
+    def generate_article(self, payload, rewrite_mode="none", on_event=None, ctx=None):
+        self.calls += 1
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(10)
+        if self.fail_with is not None:
+            raise self.fail_with
+        return "intro", "specs", {"similarity_percent": 10, "similarity_level": "blue"}
+
+
+llm = _StubLLM()
+sys.modules["llm_client"] = llm
+
+import generation_jobs as gj  # noqa: E402
+import models  # noqa: E402
+from quota import get_monthly_usage, month_key_jst  # noqa: E402
+
+URLS = ["https://example.com/a"]
+
+
+def _query(sql, params=()):
+    conn = models.get_db_connection()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _usage() -> int:
+    conn = models.get_db_connection()
+    try:
+        return get_monthly_usage(conn, month_key_jst())
+    finally:
+        conn.close()
+
+
+class GenerationJobsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        models.init_db()
+
+    def setUp(self):
+        llm.calls = 0
+        llm.fail_with = None
+        llm.gate = None
+        llm.entered.clear()
+        self._reference = f"REF-{self.id().rsplit('.', 1)[-1]}"
+        self._runs = 0
+        self._runs_cond = threading.Condition()
+        run_job = gj._run_job
+
+        def _counted(job_id):
+            try:
+                run_job(job_id)
+            finally:
+                with self._runs_cond:
+                    self._runs += 1
+                    self._runs_cond.notify_all()
+
+        gj._run_job = _counted
+        self.addCleanup(setattr, gj, "_run_job", run_job)
+
+    def _wait_runs(self, n: int) -> None:
+        with self._runs_cond:
+            self.assertTrue(self._runs_cond.wait_for(lambda: self._runs >= n, 10))
+
+    def _submit(self, **options) -> int:
+        return gj.submit_generation("TestBrand", self._reference, {"reference_urls": URLS, **options})
+
+    def _articles(self) -> int:
+        return _query("SELECT COUNT(*) AS n FROM generated_articles WHERE reference = ?",
+                      (self._reference,))[0]["n"]
+
+    def test_duplicate_submit_returns_same_job_with_one_charge(self):
+        before = _usage()
+        llm.gate = threading.Event()
+        first = self._submit(tone="luxury")
+        second = self._submit(tone="luxury")
+        self.assertEqual(first, second)
+        self.assertEqual(_usage(), before + 1)
+
+        llm.gate.set()
+        self._wait_runs(1)
+        self.assertEqual(_query("SELECT status FROM generation_jobs WHERE id = ?", (first,))[0]["status"], "done")
+        self.assertEqual(self._submit(tone="luxury"), first)  # 完了後の再送も同じジョブ
+        self.assertEqual(_usage(), before + 1)
+        self.assertEqual(llm.calls, 1)
+        self.assertEqual(self._articles(), 1)
+
+    def test_failed_job_refunds_quota_once(self):
+        before = _usage()
+        llm.fail_with = RuntimeError("model down")
+        job_id = self._submit()
+        self._wait_runs(1)
+        self.assertEqual(_query("SELECT status FROM generation_jobs WHERE id = ?", (job_id,))[0]["status"], "failed")
+        self.assertEqual(_usage(), before)
+
+        # 失敗済みのジョブをもう一度 failed にしても返却は増えない
+        conn = models.get_db_connection()
+        try:
+            gj._fail_job(conn, job_id, "again")
+        finally:
+            conn.close()
+        self.assertEqual(_usage(), before)
+        row = _query("SELECT quota_charged, quota_refunded FROM generation_jobs WHERE id = ?", (job_id,))[0]
+        self.assertEqual((row["quota_charged"], row["quota_refunded"]), (1, 1))
+
+    def test_resume_skips_live_jobs_and_stale_run_does_not_save_second_article(self):
+        llm.gate = threading.Event()
+        job_id = self._submit(tone="casual_friendly")
+        self.assertTrue(llm.entered.wait(10))
+
+        # heartbeat が新しい running は別プロセスの再開処理でも触らない
+        gj.resume_pending_generation_jobs()
+        row = _query("SELECT status, attempts FROM generation_jobs WHERE id = ?", (job_id,))[0]
+        self.assertEqual((row["status"], row["attempts"]), ("running", 1))
+
+        # heartbeat が途切れた → 再開処理が queued に戻し、2回目の実行が claim する
+        conn = models.get_db_connection()
+        try:
+            models.run_write(conn, lambda c: c.execute(
+                "UPDATE generation_jobs SET heartbeat_at = '2000-01-01 00:00:00.000' WHERE id = ?", (job_id,)
+            ))
+        finally:
+            conn.close()
+        llm.entered.clear()
+        gj.resume_pending_generation_jobs()
+        self.assertTrue(llm.entered.wait(10))
+
+        llm.gate.set()
+        self._wait_runs(2)  # 1回目の実行（保存は取り消される）と2回目の実行の両方
+
+        job = _query("SELECT status, attempts, article_id FROM generation_jobs WHERE id = ?", (job_id,))[0]
+        self.assertEqual((job["status"], job["attempts"]), ("done", 2))
+        self.assertEqual(llm.calls, 2)
+        self.assertEqual(self._articles(), 1)
+        self.assertEqual(
+            _query("SELECT reference FROM generated_articles WHERE id = ?", (job["article_id"],))[0]["reference"],
+            self._reference,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
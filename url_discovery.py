@@ -1,6 +1,17 @@
+import json
+import logging
 import os
-import requests
-from typing import List, Dict, Any, Tuple
+import threading
+import time
+import unicodedata
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Optional, Tuple
+
+import generation_metrics
+from http_client import http_get
+from models import get_db_connection, run_write
+
+logger = logging.getLogger(__name__)
 
 # 公式ドメイン優先（必要に応じて増やせます）
 OFFICIAL_DOMAINS = {
@@ -13,14 +24,61 @@ OFFICIAL_DOMAINS = {
 
 GOOGLE_CSE_ENDPOINT = "https://www.googleapis.com/customsearch/v1"
 
+# ----------------------------
+# CSE キャッシュ
+#   - 検索結果は正規化クエリ単位で cse_query_cache に保存（TTL 内は API を呼ばない）
+#   - 商品ごとの発見結果は discovered_reference_urls に保存（TTL 内は検索自体をしない）
+#   - クエリは並列に投げ、優先順に見てホワイトリスト通過が max_urls 本そろった時点で打ち切る
+#   - 同じクエリが同時に走っている場合は相乗りする
+# ----------------------------
+CSE_CACHE_TTL_SEC = float(os.getenv("HOROLOGEN_CSE_CACHE_TTL_SEC", str(7 * 86400)))
+DISCOVERY_TTL_SEC = float(os.getenv("HOROLOGEN_DISCOVERY_TTL_SEC", str(7 * 86400)))
+# 1本も見つからなかった商品は早めに再検索する
+DISCOVERY_EMPTY_TTL_SEC = float(os.getenv("HOROLOGEN_DISCOVERY_EMPTY_TTL_SEC", "86400"))
+# 1 にすると従来どおり1本ずつ（打ち切り後のクエリは課金されない）
+CSE_CONCURRENCY = int(os.getenv("HOROLOGEN_CSE_CONCURRENCY", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=max(1, CSE_CONCURRENCY), thread_name_prefix="horologen-cse")
+_inflight_lock = threading.Lock()
+_inflight: Dict[str, Future] = {}
+_stats_lock = threading.Lock()
+_stats = {"api_calls": 0, "query_cache_hits": 0, "coalesced": 0, "skipped": 0,
+          "discovery_cache_hits": 0, "discoveries": 0}
+
+
+def _count(**deltas) -> None:
+    with _stats_lock:
+        for k, v in deltas.items():
+            _stats[k] += v
+
+
+def cse_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out = dict(_stats)
+    out["inflight"] = len(_inflight)
+    out["concurrency"] = CSE_CONCURRENCY
+    return out
+
+
+def normalize_query(q: str) -> str:
+    """全角半角・大文字小文字・空白の違いを吸収したキャッシュキー用のクエリ"""
+    return " ".join(unicodedata.normalize("NFKC", q or "").lower().split())
+
+
+def _query_key(q: str, top_k: int) -> str:
+    return f"{normalize_query(q)}|{min(max(top_k, 1), 10)}"
+
+
+def _cse_credentials() -> Tuple[str, str]:
+    return os.getenv("GOOGLE_CSE_API_KEY", "").strip(), os.getenv("GOOGLE_CSE_CX", "").strip()
+
 
 def _cse_search(q: str, top_k: int = 5) -> Tuple[List[str], Dict[str, Any]]:
     """
     Google Custom Search JSON API (通常版) を使って検索結果URLを返す。
     環境変数が無ければ空で返す（エラーにしない）。
     """
-    api_key = os.getenv("GOOGLE_CSE_API_KEY", "").strip()
-    cx = os.getenv("GOOGLE_CSE_CX", "").strip()
+    api_key, cx = _cse_credentials()
 
     meta = {"query": q, "used": False, "status": None, "error": ""}
 
@@ -36,7 +94,7 @@ def _cse_search(q: str, top_k: int = 5) -> Tuple[List[str], Dict[str, Any]]:
     }
 
     try:
-        r = requests.get(GOOGLE_CSE_ENDPOINT, params=params, timeout=15)
+        r = http_get(GOOGLE_CSE_ENDPOINT, params=params, timeout=15)
         meta["used"] = True
         meta["status"] = r.status_code
         r.raise_for_status()
@@ -53,11 +111,89 @@ def _cse_search(q: str, top_k: int = 5) -> Tuple[List[str], Dict[str, Any]]:
         return [], meta
 
 
-def discover_reference_urls(brand: str, reference: str, max_urls: int = 3) -> Tuple[List[str], Dict[str, Any]]:
+def _search_and_store(q: str, top_k: int) -> Tuple[List[str], Dict[str, Any]]:
+    """ワーカースレッドで実行。成功した結果は（打ち切りで誰も待っていなくても）キャッシュに残す"""
+    urls, meta = _cse_search(q, top_k=top_k)
+    _count(api_calls=1)
+    if not meta.get("error"):
+        conn = get_db_connection()
+        try:
+            run_write(conn, lambda c: c.execute(
+                "INSERT OR REPLACE INTO cse_query_cache (query_key, query, urls_json, fetched_at) "
+                "VALUES (?, ?, ?, ?)",
+                (_query_key(q, top_k), q, json.dumps(urls, ensure_ascii=False), time.time())
+            ))
+        except Exception as e:
+            logger.warning("cse cache write failed: %s: %s", type(e).__name__, e)
+        finally:
+            conn.close()
+    return urls, meta
+
+
+def _submit_search(q: str, top_k: int) -> Tuple[Future, bool]:
+    """(future, 自分が投げたか)。同じクエリが実行中ならその future に相乗りする"""
+    key = _query_key(q, top_k)
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is not None:
+            _count(coalesced=1)
+            return fut, False
+        fut = _executor.submit(_search_and_store, q, top_k)
+        _inflight[key] = fut
+
+    def _done(_f, key=key):
+        with _inflight_lock:
+            if _inflight.get(key) is _f:
+                del _inflight[key]
+
+    fut.add_done_callback(_done)
+    return fut, True
+
+
+def _cached_search(conn, q: str, top_k: int) -> Optional[List[str]]:
+    row = conn.execute(
+        "SELECT urls_json, fetched_at FROM cse_query_cache WHERE query_key = ?",
+        (_query_key(q, top_k),)
+    ).fetchone()
+    if row is None or time.time() - row["fetched_at"] >= CSE_CACHE_TTL_SEC:
+        return None
+    try:
+        return json.loads(row["urls_json"])
+    except ValueError:
+        return None
+
+
+def load_discovered_urls(conn, brand: str, reference: str) -> Optional[Tuple[List[str], float]]:
+    """保存済みの発見結果 (urls, 経過秒)。TTL 切れ・未保存なら None"""
+    row = conn.execute(
+        "SELECT urls_json, discovered_at FROM discovered_reference_urls WHERE brand = ? AND reference = ?",
+        (brand, reference)
+    ).fetchone()
+    if row is None:
+        return None
+    urls = json.loads(row["urls_json"] or "[]")
+    age = time.time() - row["discovered_at"]
+    if age >= (DISCOVERY_TTL_SEC if urls else DISCOVERY_EMPTY_TTL_SEC):
+        return None
+    return urls, age
+
+
+def _store_discovered_urls(conn, brand: str, reference: str, urls: List[str], reason: str) -> None:
+    run_write(conn, lambda c: c.execute("""
+        INSERT INTO discovered_reference_urls (brand, reference, urls_json, reason, discovered_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(brand, reference) DO UPDATE SET
+            urls_json = excluded.urls_json, reason = excluded.reason, discovered_at = excluded.discovered_at
+    """, (brand, reference, json.dumps(urls, ensure_ascii=False), reason, time.time())))
+
+
+def discover_reference_urls(brand: str, reference: str, max_urls: int = 3, conn=None,
+                            refresh: bool = False) -> Tuple[List[str], Dict[str, Any]]:
     """
     brand + reference から URL候補を最大3本返す。
     - APIキーが無い場合は [] を返す（手入力運用にフォールバック）
     - 信頼ドメイン(ホワイトリスト)で最後にフィルタ
+    - 保存済みの発見結果が新しければ検索しない（refresh=True で再検索）
     """
     brand = (brand or "").strip()
     reference = (reference or "").strip()
@@ -74,6 +210,33 @@ def discover_reference_urls(brand: str, reference: str, max_urls: int = 3) -> Tu
         debug["auto_url_reason"] = "brand_or_reference_empty"
         return [], debug
 
+    own = conn is None
+    conn = conn or get_db_connection()
+    t0 = time.monotonic()
+    try:
+        if not refresh:
+            stored = load_discovered_urls(conn, brand, reference)
+            if stored is not None:
+                urls, age = stored
+                _count(discovery_cache_hits=1)
+                debug["filtered_results"] = urls[:max_urls]
+                debug["auto_url_used"] = True
+                debug["auto_url_reason"] = "cached"
+                debug["cache_age_sec"] = int(age)
+                generation_metrics.record("discovery", (time.monotonic() - t0) * 1000, detail=reference,
+                                          cache="hit", outcome="ok")
+                return urls[:max_urls], debug
+        found = _discover(conn, brand, reference, max_urls, debug)
+        generation_metrics.record("discovery", (time.monotonic() - t0) * 1000, detail=reference, cache="miss",
+                                  outcome=debug["auto_url_reason"])
+        return found
+    finally:
+        if own:
+            conn.close()
+
+
+def _discover(conn, brand: str, reference: str, max_urls: int,
+              debug: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
     # llm_client のホワイトリスト判定を使う（循環import回避のため関数内import）
     import llm_client as llmc
 
@@ -89,37 +252,97 @@ def discover_reference_urls(brand: str, reference: str, max_urls: int = 3) -> Tu
     # 3) 型番だけ（短い型番で引っかける）
     queries.append(reference)
 
-    seen = set()
-    candidates: List[str] = []
-
+    # 正規化して同じになるクエリは1回だけ
+    unique = []
+    seen_keys = set()
     for q in queries:
-        urls, meta = _cse_search(q, top_k=7)
-        debug["queries"].append({"q": q, **meta})
+        key = normalize_query(q)
+        if key not in seen_keys:
+            seen_keys.add(key)
+            unique.append(q)
+    queries = unique
 
-        # APIキーが無い場合：最初のクエリ時点で missing_env が入るので即終了
-        if meta.get("error", "").startswith("missing_env"):
-            debug["auto_url_reason"] = "missing_api_key_or_cx"
-            return [], debug
+    top_k = 7
+    api_key, cx = _cse_credentials()
+    if not api_key or not cx:
+        # APIキーが無い場合：最初のクエリ時点で missing_env として終了
+        _urls, meta = _cse_search(queries[0], top_k=top_k)
+        debug["queries"].append({"q": queries[0], **meta})
+        debug["auto_url_reason"] = "missing_api_key_or_cx"
+        return [], debug
 
-        debug["raw_results"].append({"q": q, "urls": urls})
+    results: Dict[int, Tuple[List[str], Dict[str, Any]]] = {}
+    futures: Dict[Future, Tuple[int, bool]] = {}
+    t0 = time.monotonic()
+    for i, q in enumerate(queries):
+        cached = _cached_search(conn, q, top_k)
+        if cached is not None:
+            _count(query_cache_hits=1)
+            results[i] = (cached, {"query": q, "used": False, "status": None, "error": "", "cache": "hit"})
+            generation_metrics.record("cse", (time.monotonic() - t0) * 1000, detail=q, cache="hit", outcome="ok")
+        else:
+            fut, created = _submit_search(q, top_k)
+            futures[fut] = (i, created)
+
+    def _candidates() -> Tuple[List[str], int]:
+        """優先順に、結果が出そろっている先頭のクエリまでで候補を作る"""
+        seen = set()
+        out: List[str] = []
+        n = 0
+        for i in range(len(queries)):
+            if i not in results:
+                break
+            n = i + 1
+            for u in results[i][0]:
+                if u in seen:
+                    continue
+                seen.add(u)
+                allowed, _host, _policy = llmc.get_source_policy(u)
+                if allowed:
+                    out.append(u)
+                if len(out) >= max_urls:
+                    return out, n
+        return out, n
 
-        for u in urls:
-            if u in seen:
-                continue
-            seen.add(u)
+    candidates, used_n = _candidates()
+    pending = set(futures)
+    while pending and len(candidates) < max_urls:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            i, created = futures[fut]
+            try:
+                results[i] = fut.result()
+            except CancelledError:
+                results[i] = ([], {"query": queries[i], "used": False, "status": None, "error": "cancelled"})
+            # 待ち時間は呼び出し側から見た時間（相乗りしたクエリは inflight）
+            generation_metrics.record("cse", (time.monotonic() - t0) * 1000, detail=queries[i],
+                                      cache="miss" if created else "inflight",
+                                      outcome=results[i][1].get("error") or "ok")
+        candidates, used_n = _candidates()
 
-            allowed, host, _policy = llmc.get_source_policy(u)
-            if not allowed:
-                continue
+    # 打ち切り：まだ始まっていない自分のクエリは取り消す（相乗り中のものは触らない）
+    for fut in pending:
+        if futures[fut][1]:
+            fut.cancel()
 
-            candidates.append(u)
-            if len(candidates) >= max_urls:
-                break
-        if len(candidates) >= max_urls:
-            break
+    _count(discoveries=1, skipped=len(queries) - used_n)
+    for i, q in enumerate(queries):
+        if i >= used_n:
+            debug["queries"].append({"q": q, "skipped": "enough_urls"})
+            continue
+        urls, meta = results[i]
+        debug["queries"].append({"q": q, **meta})
+        debug["raw_results"].append({"q": q, "urls": urls})
 
     debug["filtered_results"] = candidates[:max_urls]
     debug["auto_url_used"] = True
     debug["auto_url_reason"] = "ok" if candidates else "no_results_after_whitelist"
 
+    # 全クエリが失敗した場合は保存しない（次回また検索する）
+    if any(not results[i][1].get("error") for i in range(used_n)):
+        try:
+            _store_discovered_urls(conn, brand, reference, candidates[:max_urls], debug["auto_url_reason"])
+        except Exception as e:
+            logger.warning("discovered urls store failed: %s: %s", type(e).__name__, e)
+
     return candidates[:max_urls], debug